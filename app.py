@@ -1,48 +1,94 @@
 import streamlit as st
-import openai
 import pandas as pd
 from helpers import *
+from profiling import dataset_fingerprint
+from plot_executor import DATAFRAME_HANDOFF, PlotExecutor, PlotExecutionError
+from render_cache import PLOT_FORMAT, PLOT_DPI, get_render_cache, render_key, to_image
+from dataset_store import DATASET_FILES, get_dataset_registry
+from collections import ChainMap
+from ingest import read_csv_optimized, describe_report
+from preview import dataset_preview
+from metrics import span, start_trace, start_metrics_server
+from plot_templates import template_code
+from prompt_index import similar_code, remember_code
+from image_store import ChatImageStore
+from chat_history import show_history
+from dashboard import build_dashboard, dashboard_message, dashboard_prompts, show_dashboard
+from prefetch import prefetch_suggestions, prefetched_code
+from warmup import start_warmup
+from figure_info import describe_figure, wants_llm_description
+from sql_engine import (QUERY_RESULT, SQLQueryError, get_sql_primer, preload_table, run_sql_answer, run_sql_request,
+                        use_sql_engine)
 
 
-def execute_and_capture_plot(code):
+@st.cache_resource
+def get_plot_executor():
+    # One pool of warm worker processes shared by every session, each preloads the bundled datasets
+    return PlotExecutor(dataset_files=DATASET_FILES)
+
+
+# Serves /metrics when DATACHAT_METRICS_PORT is set, once per server process
+start_metrics_server()
+
+
+def execute_and_capture_plot(code, query_result=None):
     """
     Executes the given Python code which is expected to generate a matplotlib plot.
     Captures the plot and returns it as an image.
+    The code runs in a worker process of the plot executor, with a timeout.
+    Plots already rendered from the same code and data come from the render cache.
 
     :param code: A string of Python code to execute.
-    :return: BytesIO object containing the plot image.
+    :param query_result: The result frame of the SQL engine query the code plots, if any.
+    :return: The encoded plot image (bytes), the reasoning string and what the figure shows (see figure_info.py).
     """
-    # Execute the code
-    try: 
-        exec(code, globals())
-    except Exception as e:
+    with span("exec", format=PLOT_FORMAT, cache="miss") as s:
+        key = render_key(code, dataset_fingerprint(datasets[chosen_dataset]))
+        cached = get_render_cache().get(key)
+        if cached:
+            image, reasoning = cached
+            s.set(cache="hit", image_bytes=len(image))
+            return image, reasoning, get_render_cache().figure(key)
+
+        # Uploaded datasets are not preloaded by the workers, so send them along
+        sent = st.session_state["uploads"]
+        if query_result is not None:
+            sent = dict(sent, **{QUERY_RESULT: query_result})
+        job = get_plot_executor().submit(code, sent, image_format=PLOT_FORMAT, dpi=PLOT_DPI)
+        try: 
+            image, reasoning = job.result()
+            s.set(image_bytes=len(image))
+        except PlotExecutionError as e:
+            s.fail(e)
+            image = None
+        s.set(**job.timings)
+
+    if image is None:
+        print("Plot execution failed: " + s.error)
         st.info("Chatgpt failed to generate a plot. Please try again.")
         st.stop()
-    
-    # Save the plot to a BytesIO object
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    plt.close()
-    buf.seek(0)
-
-
-    return buf, reasoning
-
-# List to hold datasets
-if "datasets" not in st.session_state:
-    datasets = {}
-    # Preload datasets
-    datasets["Movies"] = pd.read_csv("movies.csv")
-    datasets["Housing"] =pd.read_csv("housing.csv")
-    datasets["Cars"] = pd.read_csv("cars.csv")
-    datasets["Colleges"] =pd.read_csv("colleges.csv")
-    datasets["Customers & Products"] = pd.read_csv("customers_and_products_contacts.csv")
-    datasets["Department Store"] = pd.read_csv("department_store.csv")
-    datasets["Energy Production"] = pd.read_csv("energy_production.csv")
-    st.session_state["datasets"] = datasets
-else:
-    # use the list already loaded
-    datasets = st.session_state["datasets"]
+
+    get_render_cache().put(key, image, reasoning, job.figure)
+    return image, reasoning, job.figure
+
+
+def stream_code(chunks):
+    """
+    Shows the generated code in the chat while it streams in and returns the full code
+    """
+    placeholder = st.empty()
+    code = ""
+    for chunk in chunks:
+        code += chunk
+        placeholder.code(code, language="python")
+    placeholder.empty()
+    return code
+
+# Datasets available to this session. The bundled ones are parsed once per server process, when
+# first needed, and shared by every session. Uploads stay in the session and shadow bundled names.
+if "uploads" not in st.session_state:
+    st.session_state["uploads"] = {}
+datasets = ChainMap(st.session_state["uploads"], get_dataset_registry())
 
 with st.sidebar:
     openai_api_key = st.text_input("Please Input OpenAI API Key below:", key="chatbot_api_key", type="password")
@@ -56,20 +102,35 @@ with st.sidebar:
         if uploaded_file:
             # Read in the data, add it to the list of available datasets. Give it a nice name.
             file_name = uploaded_file.name[:-4].capitalize()
-            datasets[file_name] = pd.read_csv(uploaded_file)
+            # Parse each upload once, not on every rerun
+            if st.session_state.get("upload_id") != uploaded_file.file_id:
+                progress_bar = st.progress(0.0, "Loading " + uploaded_file.name)
+                datasets[file_name], st.session_state["upload_report"] = read_csv_optimized(
+                    uploaded_file, progress=lambda done, text: progress_bar.progress(done, text))
+                progress_bar.empty()
+                st.session_state["upload_id"] = uploaded_file.file_id
+            st.caption(describe_report(st.session_state["upload_report"]))
             # We want to default the radio button to the newly added dataset
-            index_no = len(datasets)-1
+            index_no = list(datasets.keys()).index(file_name)
     except Exception as e:
         st.error("File failed to load. Please select a valid CSV file.")
         print("File failed to load.\n" + str(e))
     # Radio buttons for dataset choice
     chosen_dataset = dataset_container.radio(":bar_chart: Choose an example data:",datasets.keys(),index=index_no)
 
+    with st.expander("Dataset memory"):
+        for name, size in get_dataset_registry().memory_usage().items():
+            st.caption(name + ": " + ("not loaded" if size is None else "%.2f MB" % (size / 1024 / 1024)))
+        if "images" in st.session_state:
+            footprint = st.session_state["images"].footprint()
+            st.caption("Chat plots: %d, %.2f MB in memory, %.2f MB spilled to disk" % (
+                footprint["images"], footprint["memory_bytes"] / 1024 / 1024, footprint["disk_bytes"] / 1024 / 1024))
+
     st.sidebar.markdown("---")
     st.sidebar.markdown("### Prompt Guide")
     st.sidebar.markdown("- 🗒️ Start with \"Explore:\" to get suggested prompt from chatgpt")
     st.sidebar.markdown("- 📉 Start with \"Show:\" to have chatgpt generate a plot based on your entered prompt")
-    st.sidebar.markdown("- 📖 Say \"Describe it\" to have chatgpt describe the plot it just generated for you")
+    st.sidebar.markdown("- 📖 Say \"Describe it\" to have the plot just generated described to you, \"Describe it with chatgpt\" to ask chatgpt")
 
 
 st.title("💬 DataChat")
@@ -79,15 +140,20 @@ st.caption("An interactive chatbot designed to conduct data analysis and create
 if "messages" not in st.session_state:
     st.session_state["messages"] = [{"role": "assistant", "content": "How can I help you?"}]
 
+# Plots of this chat, the messages only hold their ids
+if "images" not in st.session_state:
+    st.session_state["images"] = ChatImageStore()
+images = st.session_state["images"]
+
 # This would keep any vis output from chatgpt staying in place
-for msg in st.session_state.messages:
-    st.chat_message(msg["role"]).write(msg["content"])
-    if "image" in msg:
-        st.chat_message("assistant").image(msg["image"], caption=msg["prompt"], use_column_width=True)
+# (the latest turns only, see chat_history.py)
+show_history(st.session_state.messages, images)
 
-# Stores the most recent plot code
+# Stores the most recent plot code, and what its figure shows with the reasoning for it
 if "vis_code" not in st.session_state:
     st.session_state["vis_code"] = ""
+    st.session_state["vis_figure"] = None
+    st.session_state["vis_reasoning"] = ""
 
 print(st.session_state["vis_code"])
 
@@ -96,8 +162,8 @@ if prompt := st.chat_input():
         st.info("Please add your OpenAI API key to continue.")
         st.stop()
 
-    # Set the API key globally for version 0.28
-    openai.api_key = openai_api_key
+    # The spans of this prompt (primer, llm, exec) share one trace id in the metrics log
+    start_trace()
 
     # Add your current message to the session state
     st.session_state.messages.append({"role": "user", "content": prompt})
@@ -108,45 +174,104 @@ if prompt := st.chat_input():
 
     # initialize answer with an empty string 
     answer = ""
+    # text answers are streamed into the chat as the tokens arrive
+    streamed = False
+    # code from chatgpt, remembered for similar prompts once it has produced a plot
+    generated_code = None
+    # chat message of a batch of plots
+    dashboard = None
+    # result of the SQL engine query a large dataset's plot is drawn from
+    sql_result = None
+
+    # If a prompt starts with "describe" the most recently generated plot is described from what its figure
+    # shows and the reasoning of its code, the plot code is only sent back to chatgpt when asked for
+    if charts := dashboard_prompts(prompt):
+        # Several plots at once ("Dashboard:" or several "Show:" lines), generated and rendered concurrently
+        with st.spinner("Creating %d plots" % len(charts)):
+            charts = build_dashboard(datasets[chosen_dataset], 'datasets["' + chosen_dataset + '"]', charts,
+                                     openai_api_key, get_plot_executor(), st.session_state["uploads"],
+                                     DATAFRAME_HANDOFF)
+        dashboard = dashboard_message(images, charts)
+        with st.chat_message("assistant"):
+            st.write(dashboard["content"])
+            show_dashboard(images, dashboard["dashboard"])
 
-    # naive approach to have chatgpt describe the most recently generated plot
-    # If a prompt starts with "describe" we will send the plot code back to chatgpt api and have it describe the code
-    if prompt.startswith("describe") or prompt.startswith("Describe"):
-        if st.session_state["vis_code"]:
-            answer = describe_plot(st.session_state["vis_code"], openai_api_key)
+    elif prompt.startswith("describe") or prompt.startswith("Describe"):
+        if st.session_state["vis_code"] and not wants_llm_description(prompt, st.session_state["vis_figure"]):
+            answer = describe_figure(st.session_state["vis_figure"], st.session_state["vis_reasoning"])
+        elif st.session_state["vis_code"]:
+            answer = st.chat_message("assistant").write_stream(describe_plot(st.session_state["vis_code"], openai_api_key, stream=True))
+            streamed = True
         else:
             st.info("You haven't created any visualization yet!")
             st.stop()
     
     elif prompt.startswith("show") or prompt.startswith("Show"):
         # Generate the prompt template depending on the selected dataset
-        primer1, primer2 = get_primer(datasets[chosen_dataset],'datasets["'+ chosen_dataset + '"]') 
+        primer1, primer2 = get_primer(datasets[chosen_dataset],'datasets["'+ chosen_dataset + '"]', DATAFRAME_HANDOFF, prompt) 
         
-        # Format the question to be ready to sent to chatgpt api
-        question_to_ask = format_question(primer1, primer2, prompt)
+        # Simple prompts (histogram of X, mean of Y by Z, Y over time) are answered from a local template
+        answer = template_code(datasets[chosen_dataset], prompt)
+        if answer is None:
+            # The suggestions of an Explore answer are generated ahead of time
+            answer = generated_code = prefetched_code(datasets[chosen_dataset], prompt)
+        if answer is None:
+            # Rephrasings of an earlier prompt on this dataset reuse its code
+            answer = similar_code(datasets[chosen_dataset], prompt)
+        if answer is None and use_sql_engine(datasets[chosen_dataset]):
+            # Large datasets: ChatGPT writes an aggregation query for the embedded SQL engine
+            # and code that plots its small result (see sql_engine.py)
+            sql_primer1, sql_primer2 = get_sql_primer(datasets[chosen_dataset], prompt)
+            question_to_ask = format_question(sql_primer1, sql_primer2, prompt)
+            sql_answer = stream_code(run_sql_request(question_to_ask, openai_api_key, dataset_fingerprint(datasets[chosen_dataset]), stream=True))
+            try:
+                sql_result, answer = run_sql_answer(datasets[chosen_dataset], sql_answer)
+                primer2 = sql_primer2
+            except SQLQueryError as e:
+                print("SQL engine query failed: " + str(e))
+                st.info("The SQL query failed (%s), generating pandas code instead." % e)
+        if answer is None:
+            # Format the question to be ready to sent to chatgpt api
+            question_to_ask = format_question(primer1, primer2, prompt)
 
-        # Retrieve the code answer
-        answer = run_request(question_to_ask, openai_api_key)
+            # Retrieve the code answer
+            answer = stream_code(run_request(question_to_ask, openai_api_key, dataset_fingerprint(datasets[chosen_dataset]), stream=True))
+            generated_code = answer
         answer = primer2 + answer
         answer = format_response(answer)
     
     elif "explore" in prompt or "Explore" in prompt:
-        answer = ask_gpt(describe_dataset(datasets[chosen_dataset]), prompt, openai_api_key)
+        answer = st.chat_message("assistant").write_stream(ask_gpt(describe_dataset(datasets[chosen_dataset], prompt), prompt, openai_api_key, dataset_fingerprint(datasets[chosen_dataset]), stream=True))
+        streamed = True
+        # Users usually pick one of the suggestions next, their code is generated in the background
+        prefetch_suggestions(datasets[chosen_dataset], 'datasets["' + chosen_dataset + '"]', answer, openai_api_key,
+                             DATAFRAME_HANDOFF, get_plot_executor(), st.session_state["uploads"])
 
     # simply send the prompt to chatgpt api
     else:
-        answer = ask_gpt("", prompt, openai_api_key)
+        answer = st.chat_message("assistant").write_stream(ask_gpt("", prompt, openai_api_key, stream=True))
+        streamed = True
 
     # print(answer)
 
     # Execute the code 
-    if "plt.show()" in answer or "plt" in answer:
+    if dashboard:
+        st.session_state.messages.append(dashboard)
+        plotted = [chart for chart in charts if chart.image]
+        if plotted:
+            st.session_state["vis_code"] = plotted[-1].code
+            st.session_state["vis_figure"] = plotted[-1].figure
+            st.session_state["vis_reasoning"] = plotted[-1].reasoning
+    elif "plt.show()" in answer or "plt" in answer:
         # Execute the code and get the plot image
-        plot_image, reasoning = execute_and_capture_plot(answer)
+        plot_bytes, reasoning, figure = execute_and_capture_plot(answer, sql_result)
+        plot_image = to_image(plot_bytes)
+        if generated_code:
+            remember_code(datasets[chosen_dataset], prompt, generated_code)
 
         # # display text
         msg = 'A visualization has been created based on your prompt'
-        st.session_state.messages.append({"role": "assistant", "content": msg, "prompt": prompt, "image":plot_image})
+        st.session_state.messages.append({"role": "assistant", "content": msg, "prompt": prompt, "image":images.put(plot_bytes)})
         st.chat_message("assistant").write(msg)
 
         # Display the plot in the image container
@@ -158,17 +283,20 @@ if prompt := st.chat_input():
 
         # Store the current code in the session state
         st.session_state["vis_code"] = answer
+        st.session_state["vis_figure"] = figure
+        st.session_state["vis_reasoning"] = reasoning
+    elif streamed:
+        st.session_state.messages.append({"role": "assistant", "content": answer})
     else:
         st.session_state.messages.append({"role": "assistant", "content": answer})
         st.chat_message("assistant").write(answer)
     
-# Display the datasets in a list of tabs
-tab_list = st.tabs(datasets.keys())
-
-# Load up each tab with a dataset
-for dataset_num, tab in enumerate(tab_list):
-    with tab:
-        # Can't get the name of the tab! Can't index key list. So convert to list and index
-        dataset_name = list(datasets.keys())[dataset_num]
-        st.subheader(dataset_name)
-        st.dataframe(datasets[dataset_name],hide_index=True)
+# Display a page of the chosen dataset, the other datasets are not sent to the browser
+dataset_preview(chosen_dataset, datasets[chosen_dataset])
+
+# The first page is out: start the plot workers, they load the bundled datasets in their own
+# processes, and import the api client in the background
+get_plot_executor()
+start_warmup()
+# Large datasets are copied into the SQL engine while the user writes a prompt
+preload_table(datasets[chosen_dataset])
@@ -1,31 +1,22 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import io
 import matplotlib.pyplot as plt
+import openai
 from helpers import *
+from user_store import get_user_store
 
-# Initialize SQLite database
-conn = sqlite3.connect('users.db')
-c = conn.cursor()
-c.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        email TEXT PRIMARY KEY,
-        password TEXT NOT NULL
-    )
-''')
-conn.commit()
+# User accounts, shared by all sessions through a pool of SQLite connections (see user_store.py)
+users = get_user_store()
 
 def add_user(email, password):
-    try:
-        c.execute("INSERT INTO users (email, password) VALUES (?, ?)", (email, password))
-        conn.commit()
-    except sqlite3.IntegrityError:
+    if not users.add_user(email, password):
         st.error("User already exists. Please sign in.")
+        return False
+    return True
 
 def authenticate_user(email, password):
-    c.execute("SELECT * FROM users WHERE email = ? AND password = ?", (email, password))
-    return c.fetchone()
+    return users.authenticate(email, password)
 
 # Initialize in-memory session state
 if "auth_status" not in st.session_state:
@@ -38,8 +29,8 @@ if "vis_code" not in st.session_state:
     st.session_state["vis_code"] = ""
 
 def sign_up(email, password):
-    add_user(email, password)
-    st.success("Sign Up Successful. Please Sign In.")
+    if add_user(email, password):
+        st.success("Sign Up Successful. Please Sign In.")
 
 def sign_in(email, password):
     user = authenticate_user(email, password)
@@ -53,6 +44,7 @@ def sign_in(email, password):
         return False
 
 def sign_out():
+    users.forget(st.session_state["user_email"])
     st.session_state["auth_status"] = False
     st.session_state["user_email"] = ""
     st.session_state["messages"] = [{"role": "assistant", "content": "How can I help you?"}]
@@ -1,59 +1,44 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
-import io
-import matplotlib.pyplot as plt
-import stripe
 from helpers import *
+from user_store import get_user_store
+from profiling import dataset_fingerprint
+from plot_executor import DATAFRAME_HANDOFF, PlotExecutor, PlotExecutionError
+from render_cache import PLOT_FORMAT, PLOT_DPI, get_render_cache, render_key, to_image
+from ingest import read_csv_optimized, describe_report
+from preview import dataset_preview
+from metrics import span, start_trace, start_metrics_server
+from plot_templates import template_code
+from prompt_index import similar_code, remember_code
+from image_store import ChatImageStore
+from chat_history import show_history
+from dashboard import build_dashboard, dashboard_message, dashboard_prompts, show_dashboard
+from prefetch import prefetch_suggestions, prefetched_code
+from warmup import start_warmup
+from figure_info import describe_figure, wants_llm_description
+from sql_engine import (QUERY_RESULT, SQLQueryError, get_sql_primer, preload_table, run_sql_answer, run_sql_request,
+                        use_sql_engine)
+from checkout import CheckoutLinks, create_checkout_session
 
-# Load Stripe secret key
+# Load Stripe secret key, it is handed to stripe when the first checkout link is created
 stripe_secret_key = st.secrets["stripe_secret_key"]
-stripe.api_key = stripe_secret_key
-
-# Initialize SQLite database
-conn = sqlite3.connect('users.db')
-c = conn.cursor()
-c.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        email TEXT PRIMARY KEY,
-        password TEXT NOT NULL
-    )
-''')
-conn.commit()
+
+# User accounts, shared by all sessions through a pool of SQLite connections (see user_store.py)
+users = get_user_store()
 
 def add_user(email, password):
-    try:
-        c.execute("INSERT INTO users (email, password) VALUES (?, ?)", (email, password))
-        conn.commit()
-    except sqlite3.IntegrityError:
+    if not users.add_user(email, password):
         st.error("User already exists. Please sign in.")
+        return False
+    return True
 
 def authenticate_user(email, password):
-    c.execute("SELECT * FROM users WHERE email = ? AND password = ?", (email, password))
-    return c.fetchone()
-
-def create_checkout_session():
-    try:
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {
-                        'name': 'DataChat Access',
-                    },
-                    'unit_amount': 500,  # Amount in cents ($5.00)
-                },
-                'quantity': 1,
-            }],
-            mode='payment',
-            success_url='https://datatovischatbot.streamlit.app?payment=success',
-            cancel_url='https://datatovischatbot.streamlit.app?payment=cancel',
-        )
-        return session.url
-    except Exception as e:
-        st.error(f"Error creating checkout session: {e}")
-        return None
+    return users.authenticate(email, password)
+
+@st.cache_resource
+def get_checkout_links():
+    # Checkout sessions are created once per user in the background and reused until they expire
+    return CheckoutLinks(create=lambda user: create_checkout_session(user, api_key=stripe_secret_key))
 
 # Initialize in-memory session state
 if "auth_status" not in st.session_state:
@@ -64,16 +49,24 @@ if "messages" not in st.session_state:
     st.session_state["messages"] = [{"role": "assistant", "content": "How can I help you?"}]
 if "vis_code" not in st.session_state:
     st.session_state["vis_code"] = ""
+    # What the latest plot shows and the reasoning for it, "Describe it" is answered from them
+    st.session_state["vis_figure"] = None
+    st.session_state["vis_reasoning"] = ""
+# Plots of the chat, the messages only hold their ids
+if "images" not in st.session_state:
+    st.session_state["images"] = ChatImageStore()
 
 def sign_up(email, password):
-    add_user(email, password)
-    st.success("Sign Up Successful. Please Sign In.")
+    if add_user(email, password):
+        st.success("Sign Up Successful. Please Sign In.")
 
 def sign_in(email, password):
     user = authenticate_user(email, password)
     if user:
         st.session_state["auth_status"] = True
         st.session_state["user_email"] = email
+        # Start creating the checkout link now, so it is usually ready by the next rerun
+        get_checkout_links().get(email)
         st.success("Sign In Successful.")
         return True
     else:
@@ -81,33 +74,70 @@ def sign_in(email, password):
         return False
 
 def sign_out():
+    users.forget(st.session_state["user_email"])
     st.session_state["auth_status"] = False
     st.session_state["user_email"] = ""
     st.session_state["messages"] = [{"role": "assistant", "content": "How can I help you?"}]
     st.session_state["vis_code"] = ""
-    if "datasets" in st.session_state:
-        del st.session_state["datasets"]
+    st.session_state["vis_figure"] = None
+    st.session_state["vis_reasoning"] = ""
+    st.session_state["images"].close()
+    st.session_state["images"] = ChatImageStore()
+    for key in ("datasets", "upload_id", "upload_report", "history_pages"):
+        if key in st.session_state:
+            del st.session_state[key]
 
-# Load user-uploaded dataset
+# Load user-uploaded dataset in chunks with compact dtypes, showing progress
 def load_user_dataset(uploaded_file):
     if uploaded_file is not None:
-        return pd.read_csv(uploaded_file)
+        progress_bar = st.progress(0.0, "Loading " + uploaded_file.name)
+        df, report = read_csv_optimized(uploaded_file, progress=lambda done, text: progress_bar.progress(done, text))
+        progress_bar.empty()
+        st.session_state["upload_report"] = report
+        return df
     return None
 
-def execute_and_capture_plot(code):
-    try:
-        exec(code, globals())
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        plt.close()
-        buf.seek(0)
-        return buf
-    except SyntaxError as e:
-        st.error(f"Failed to generate plot: {e}")
-        return None
-    except Exception as e:
-        st.error(f"Failed to generate plot: {str(e)}")
-        return None   
+# Serves /metrics when DATACHAT_METRICS_PORT is set, once per server process
+start_metrics_server()
+
+@st.cache_resource
+def get_plot_executor():
+    # One pool of warm worker processes shared by every session
+    return PlotExecutor()
+
+def execute_and_capture_plot(code, query_result=None):
+    # Plots already rendered from the same code and data come from the render cache,
+    # the result of an SQL engine query is sent along with the datasets
+    with span("exec", format=PLOT_FORMAT, cache="miss") as s:
+        key = render_key(code, dataset_fingerprint(st.session_state["datasets"]["User Data"]))
+        cached = get_render_cache().get(key)
+        if cached:
+            s.set(cache="hit", image_bytes=len(cached[0]))
+            return cached[0], cached[1], get_render_cache().figure(key)
+        sent = st.session_state["datasets"]
+        if query_result is not None:
+            sent = dict(sent, **{QUERY_RESULT: query_result})
+        job = get_plot_executor().submit(code, sent, image_format=PLOT_FORMAT, dpi=PLOT_DPI)
+        try:
+            image, reasoning = job.result()
+            s.set(image_bytes=len(image), **job.timings)
+            get_render_cache().put(key, image, reasoning, job.figure)
+            return image, reasoning, job.figure
+        except PlotExecutionError as e:
+            s.fail(e)
+            s.set(**job.timings)
+            st.error(f"Failed to generate plot: {str(e)}")
+            return None, None, None   
+
+def stream_code(chunks):
+    # Show the generated code while it streams in, then hand back the full code
+    placeholder = st.empty()
+    code = ""
+    for chunk in chunks:
+        code += chunk
+        placeholder.code(code, language="python")
+    placeholder.empty()
+    return code
         
 # Authentication
 if not st.session_state["auth_status"]:
@@ -134,33 +164,38 @@ else:
         openai_api_key = st.text_input("Please Input OpenAI API Key below:", key="chatbot_api_key", type="password")
 
     if st.session_state["auth_status"]:
-        payment_url = create_checkout_session()
+        # Only reads the cache, the link is created in the background and shown once ready
+        payment_url = get_checkout_links().get(st.session_state["user_email"])
         if payment_url:
             st.markdown(f'<a href="{payment_url}" target="_blank"><button style="background-color:green">Buy me a Coffee</button></a>', unsafe_allow_html=True)
 
     st.title("💬 Data to Visualization Chatbot")
     st.caption("An interactive chatbot designed to conduct data analysis and create data visualizations from natural language")
 
-    for msg in st.session_state.messages:
-        st.chat_message(msg["role"]).write(msg["content"])
-        if "image" in msg:
-            st.chat_message("assistant").image(msg["image"], caption=msg["prompt"], use_column_width=True)
+    # The latest turns only, see chat_history.py
+    images = st.session_state["images"]
+    show_history(st.session_state.messages, images)
 
     st.markdown("---")
     st.markdown("### Prompt Guide")
     st.markdown("- 🗒️ Start with \"Explore:\" to get suggested prompt from ChatGPT")
     st.markdown("- 📉 Start with \"Show:\" to have ChatGPT generate a plot based on your entered prompt")
-    st.markdown("- 📖 Say \"Describe it\" to have ChatGPT describe the plot it just generated for you")
+    st.markdown("- 📖 Say \"Describe it\" to have the plot just generated described to you, \"Describe it with ChatGPT\" to ask ChatGPT")
 
     uploaded_file = st.file_uploader("Upload your dataset (CSV)", type=["csv"])
 
     if uploaded_file:
-        user_dataset = load_user_dataset(uploaded_file)
-        if user_dataset is not None:
-            st.session_state["datasets"] = {"User Data": user_dataset}
-            chosen_dataset = "User Data"
-        else:
-            st.error("Failed to load dataset.")
+        # Parse each upload once, not on every rerun
+        if st.session_state.get("upload_id") != uploaded_file.file_id:
+            user_dataset = load_user_dataset(uploaded_file)
+            if user_dataset is not None:
+                st.session_state["datasets"] = {"User Data": user_dataset}
+                st.session_state["upload_id"] = uploaded_file.file_id
+            else:
+                st.error("Failed to load dataset.")
+        if "upload_report" in st.session_state:
+            st.caption(describe_report(st.session_state["upload_report"]))
+        chosen_dataset = "User Data"
     else:
         st.info("Please upload a CSV file to proceed.")
 
@@ -171,41 +206,103 @@ else:
             if not openai_api_key:
                 st.error("Please add your OpenAI API key to continue.")
             else:
+                # The spans of this prompt share one trace id in the metrics log
+                start_trace()
                 st.session_state.messages.append({"role": "user", "content": prompt})
                 st.chat_message("user").write(prompt)
 
-                openai.api_key = openai_api_key
-
                 answer = ""
-                if prompt.lower().startswith("describe"):
-                    if st.session_state["vis_code"]:
-                        answer = describe_plot(st.session_state["vis_code"], openai_api_key)
+                # text answers are streamed into the chat as the tokens arrive
+                streamed = False
+                # code from chatgpt, remembered for similar prompts once it has produced a plot
+                generated_code = None
+                # chat message of a batch of plots
+                dashboard = None
+                sql_result = None
+                if charts := dashboard_prompts(prompt):
+                    # Several plots at once, generated and rendered concurrently
+                    with st.spinner("Creating %d plots" % len(charts)):
+                        charts = build_dashboard(st.session_state["datasets"][chosen_dataset], f'datasets["{chosen_dataset}"]', charts, openai_api_key, get_plot_executor(), st.session_state["datasets"], DATAFRAME_HANDOFF)
+                    dashboard = dashboard_message(images, charts)
+                    with st.chat_message("assistant"):
+                        st.write(dashboard["content"])
+                        show_dashboard(images, dashboard["dashboard"])
+                elif prompt.lower().startswith("describe"):
+                    if st.session_state["vis_code"] and not wants_llm_description(prompt, st.session_state["vis_figure"]):
+                        # Described from what the figure shows, see figure_info.py
+                        answer = describe_figure(st.session_state["vis_figure"], st.session_state["vis_reasoning"])
+                    elif st.session_state["vis_code"]:
+                        answer = st.chat_message("assistant").write_stream(describe_plot(st.session_state["vis_code"], openai_api_key, stream=True))
+                        streamed = True
                     else:
                         st.info("You haven't created any visualization yet!")
                         st.stop()
                 elif prompt.lower().startswith("show"):
-                    primer1, primer2 = get_primer(st.session_state["datasets"][chosen_dataset], f'st.session_state["datasets"]["{chosen_dataset}"]')
-                    question_to_ask = format_question(primer1, primer2, prompt)
-                    answer = run_request(question_to_ask, openai_api_key)
+                    primer1, primer2 = get_primer(st.session_state["datasets"][chosen_dataset], f'datasets["{chosen_dataset}"]', DATAFRAME_HANDOFF, prompt)
+                    # Simple prompts are answered from a local template, the rest go to chatgpt
+                    answer = template_code(st.session_state["datasets"][chosen_dataset], prompt)
+                    if answer is None:
+                        # The suggestions of an Explore answer are generated ahead of time
+                        answer = generated_code = prefetched_code(st.session_state["datasets"][chosen_dataset], prompt)
+                    if answer is None:
+                        # Rephrasings of an earlier prompt on this dataset reuse its code
+                        answer = similar_code(st.session_state["datasets"][chosen_dataset], prompt)
+                    if answer is None and use_sql_engine(st.session_state["datasets"][chosen_dataset]):
+                        # Large uploads: the plot is drawn from an aggregation query on the embedded SQL engine
+                        sql_primer1, sql_primer2 = get_sql_primer(st.session_state["datasets"][chosen_dataset], prompt)
+                        question_to_ask = format_question(sql_primer1, sql_primer2, prompt)
+                        sql_answer = stream_code(run_sql_request(question_to_ask, openai_api_key, dataset_fingerprint(st.session_state["datasets"][chosen_dataset]), stream=True))
+                        try:
+                            sql_result, answer = run_sql_answer(st.session_state["datasets"][chosen_dataset], sql_answer)
+                            primer2 = sql_primer2
+                        except SQLQueryError as e:
+                            print("SQL engine query failed: " + str(e))
+                            st.info(f"The SQL query failed ({e}), generating pandas code instead.")
+                    if answer is None:
+                        question_to_ask = format_question(primer1, primer2, prompt)
+                        answer = stream_code(run_request(question_to_ask, openai_api_key, dataset_fingerprint(st.session_state["datasets"][chosen_dataset]), stream=True))
+                        generated_code = answer
                     answer = primer2 + answer
                     answer = format_response(answer)
                 elif "explore" in prompt.lower():
-                    answer = ask_gpt(describe_dataset(st.session_state["datasets"][chosen_dataset]), prompt, openai_api_key)
+                    answer = st.chat_message("assistant").write_stream(ask_gpt(describe_dataset(st.session_state["datasets"][chosen_dataset], prompt), prompt, openai_api_key, dataset_fingerprint(st.session_state["datasets"][chosen_dataset]), stream=True))
+                    streamed = True
+                    # Users usually pick one of the suggestions next, their code is generated in the background
+                    prefetch_suggestions(st.session_state["datasets"][chosen_dataset], f'datasets["{chosen_dataset}"]', answer, openai_api_key, DATAFRAME_HANDOFF, get_plot_executor(), st.session_state["datasets"])
                 else:
-                    answer = ask_gpt("", prompt, openai_api_key)
+                    answer = st.chat_message("assistant").write_stream(ask_gpt("", prompt, openai_api_key, stream=True))
+                    streamed = True
 
-                if "plt.show()" in answer or "plt" in answer:
-                    plot_image = execute_and_capture_plot(answer)
-                    if plot_image:
+                if dashboard:
+                    st.session_state.messages.append(dashboard)
+                    plotted = [chart for chart in charts if chart.image]
+                    if plotted:
+                        st.session_state["vis_code"] = plotted[-1].code
+                        st.session_state["vis_figure"] = plotted[-1].figure
+                        st.session_state["vis_reasoning"] = plotted[-1].reasoning
+                elif "plt.show()" in answer or "plt" in answer:
+                    plot_bytes, reasoning, figure = execute_and_capture_plot(answer, sql_result)
+                    if plot_bytes:
+                        if generated_code:
+                            remember_code(st.session_state["datasets"][chosen_dataset], prompt, generated_code)
                         msg = 'A visualization has been created based on your prompt'
-                        st.session_state.messages.append({"role": "assistant", "content": msg, "prompt": prompt, "image": plot_image})
+                        st.session_state.messages.append({"role": "assistant", "content": msg, "prompt": prompt, "image": images.put(plot_bytes)})
                         st.chat_message("assistant").write(msg)
-                        st.chat_message("assistant").image(plot_image, caption="Generated Plot", use_column_width=True)
+                        st.chat_message("assistant").image(to_image(plot_bytes), caption="Generated Plot", use_column_width=True)
                         st.session_state["vis_code"] = answer
+                        st.session_state["vis_figure"] = figure
+                        st.session_state["vis_reasoning"] = reasoning
+                elif streamed:
+                    st.session_state.messages.append({"role": "assistant", "content": answer})
                 else:
                     st.session_state.messages.append({"role": "assistant", "content": answer})
                     st.chat_message("assistant").write(answer)
 
         if chosen_dataset:
-            st.subheader(f"{chosen_dataset} Dataset")
-            st.dataframe(st.session_state["datasets"][chosen_dataset], hide_index=True)
+            dataset_preview(f"{chosen_dataset} Dataset", st.session_state["datasets"][chosen_dataset])
+            # Large uploads are copied into the SQL engine while the user writes a prompt
+            preload_table(st.session_state["datasets"][chosen_dataset])
+
+# The first page is out: start the plot workers and import the api and payment clients in the background
+get_plot_executor()
+start_warmup(("openai", "stripe"))
@@ -0,0 +1,104 @@
+"""
+Rerun time of app.py as the chat history grows. A chat of N turns (a prompt, an answer and a
+plot each) is put into the session state and the script is rerun through Streamlit's AppTest,
+once rendering the whole history as before and once with the windowed history of chat_history.py.
+Each setup runs in its own process, as the history window is read at import.
+
+    python benchmarks/bench_chat_render.py --turns 5 50 200 500 --output chat_render.json
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Setups by DATACHAT_HISTORY_TURNS, 0 renders every message
+MODES = {"full_history": "0", "windowed": "20"}
+
+
+def make_plots(count):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from render_cache import PLOT_FORMAT
+
+    plots = []
+    for i in range(count):
+        fig, ax = plt.subplots(figsize=(6, 3))
+        ax.bar(["a", "b", "c"], [i % 7 + 1, i % 5 + 1, i % 3 + 1])
+        ax.set_title("turn %d" % i)
+        buf = io.BytesIO()
+        fig.savefig(buf, format=PLOT_FORMAT, dpi=80)
+        plt.close(fig)
+        plots.append(buf.getvalue())
+    return plots
+
+
+def run_mode(turns, reruns):
+    from streamlit.testing.v1 import AppTest
+    from image_store import ChatImageStore
+
+    plots = make_plots(max(turns))
+    results = {}
+    for n in turns:
+        images = ChatImageStore()
+        messages = [{"role": "assistant", "content": "How can I help you?"}]
+        for i in range(n):
+            messages.append({"role": "user", "content": "Show: plot %d" % i})
+            messages.append({"role": "assistant", "content": "A visualization has been created based on your prompt",
+                             "prompt": "Show: plot %d" % i, "image": images.put(plots[i])})
+        at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+        at.session_state["messages"] = messages
+        at.session_state["images"] = images
+        at.run()
+        times = []
+        for _ in range(reruns):
+            start = time.perf_counter()
+            at.run()
+            times.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        results[str(n)] = {"rerun_ms": round(statistics.median(times) * 1000, 1),
+                           "messages_rendered": len(at.chat_message)}
+        images.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 50, 200, 500])
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.turns, args.reruns)))
+        return
+
+    results = {}
+    for mode, window in MODES.items():
+        command = [sys.executable, __file__, "--mode", mode, "--reruns", str(args.reruns), "--turns"] + [
+            str(n) for n in args.turns]
+        env = dict(os.environ, DATACHAT_HISTORY_TURNS=window, DATACHAT_METRICS="off")
+        out = subprocess.run(command, capture_output=True, text=True, cwd=ROOT, env=env)
+        if out.returncode != 0:
+            results[mode] = {"failed": "exit code %d" % out.returncode, "stderr": out.stderr.strip()[-300:]}
+        else:
+            results[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    report = json.dumps({"benchmark": "chat_render", "reruns": args.reruns, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Exec time of generated plot code as written against the code_optimizer output. The corpus in
+slow_code.json holds answers of the shape ChatGPT gives, with plt.show(), file I/O, iterrows loops,
+row-wise apply and repeated groupbys. Each answer runs after its primer code on the bundled
+datasets and on copies scaled to more rows. The two figures are compared byte for byte.
+
+    python benchmarks/bench_code_optimizer.py --scales 1 10 50 --output code_optimizer.json
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import pandas as pd
+
+import reduction
+from code_optimizer import optimize_code
+from dataset_store import DATASET_FILES
+from helpers import format_response, get_primer
+from profiling import numeric_columns
+
+
+def render(code, datasets):
+    """
+    Runs the code as the plot worker does, returns the seconds spent and the PNG,
+    or the error message instead of the PNG
+    """
+    namespace = {"datasets": datasets, "pd": pd, "plt": plt}
+    namespace.update(reduction.namespace())
+    start = time.perf_counter()
+    try:
+        exec(code, namespace)
+    except Exception as e:
+        plt.close("all")
+        return time.perf_counter() - start, "%s: %s" % (type(e).__name__, e)
+    seconds = time.perf_counter() - start
+    buf = io.BytesIO()
+    plt.savefig(buf, format="png")
+    plt.close("all")
+    return seconds, buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "benchmarks", "slow_code.json"))
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    with open(args.corpus) as f:
+        corpus = json.load(f)
+    bundled = {name: pd.read_csv(os.path.join(ROOT, path)) for name, path in DATASET_FILES.items()}
+
+    results = []
+    for scale in args.scales:
+        datasets = {name: pd.concat([df] * scale, ignore_index=True) for name, df in bundled.items()}
+        numeric = numeric_columns(datasets.values())
+        for item in corpus:
+            name = item["dataset"]
+            _, primer_code = get_primer(datasets[name], 'datasets["%s"]' % name, "copy", item["prompt"])
+            # The code as the app had it before (format_response only dropped read_csv), and optimized
+            original = primer_code + item["code"].replace("plt.show()", "")
+            original = "\n".join(line for line in original.splitlines()
+                                 if "read_csv" not in line and "savefig" not in line and "to_csv" not in line)
+            start = time.perf_counter()
+            optimized, rewrites = optimize_code(format_response(primer_code + item["code"]), numeric)
+            optimize_seconds = time.perf_counter() - start
+
+            before, after = [], []
+            for _ in range(args.repeat):
+                seconds, image_before = render(original, datasets)
+                before.append(seconds)
+                seconds, image_after = render(optimized, datasets)
+                after.append(seconds)
+            results.append({
+                "prompt": item["prompt"],
+                "scale": scale,
+                "rows": len(datasets[name]),
+                "rewrites": sorted(set(rewrites) - {"strip_io"}),
+                "original_ms": round(statistics.median(before) * 1000, 2),
+                "optimized_ms": round(statistics.median(after) * 1000, 2),
+                "optimize_ms": round(optimize_seconds * 1000, 2),
+                "speedup": round(statistics.median(before) / statistics.median(after), 2),
+                "same_image": image_before == image_after,
+            })
+            for key, image in (("original_error", image_before), ("optimized_error", image_after)):
+                if isinstance(image, str):
+                    results[-1][key] = image
+
+    totals = {}
+    for scale in args.scales:
+        # Answers that failed to run are left out of the totals
+        runs = [r for r in results if r["scale"] == scale and "original_error" not in r and "optimized_error" not in r]
+        totals["x%d" % scale] = {"original_ms": round(sum(r["original_ms"] for r in runs), 1),
+                                 "optimized_ms": round(sum(r["optimized_ms"] for r in runs), 1)}
+    report = json.dumps({"benchmark": "code_optimizer", "totals": totals, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
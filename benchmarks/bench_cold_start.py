@@ -0,0 +1,122 @@
+"""
+Cold start of the apps. Each module the apps import is timed with python -X importtime in a
+fresh process, after streamlit which the server has loaded already, and the heavy third party
+modules it pulls in are listed. Then the first run of app.py and app_prd.py (the time to first
+render) is timed through Streamlit's AppTest, each in a fresh process, once as the apps start
+now and once with openai, matplotlib.pyplot and stripe imported up front as they used to be.
+The time of AppTest itself is left out by running an empty script first.
+
+    python benchmarks/bench_cold_start.py --runs 5 --target-ms 1000 --output cold_start.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODULES = ["helpers", "llm_client", "checkout", "plot_executor", "dashboard", "prefetch", "warmup"]
+HEAVY = ["openai", "aiohttp", "requests", "matplotlib.pyplot", "stripe"]
+APPS = ["app.py", "app_prd.py"]
+# Setups by what is imported before the first run, eager is how the apps used to start
+MODES = {"lazy": [], "eager": ["openai", "matplotlib.pyplot", "stripe"]}
+
+
+def import_time(module):
+    """
+    Cumulative milliseconds of importing module and of the heavy modules it pulled in
+    """
+    command = [sys.executable, "-X", "importtime", "-c", "import streamlit; import " + module]
+    out = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    if out.returncode != 0:
+        return {"failed": out.stderr.strip()[-300:]}
+    cumulative = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|")
+        if total.strip().isdigit():
+            cumulative.setdefault(name.strip(), int(total) / 1000)
+    # streamlit's own imports come first, the ones after "streamlit" belong to module
+    names = list(cumulative)
+    after = names[names.index("streamlit") + 1:] if "streamlit" in names else names
+    return {"ms": round(cumulative.get(module, 0.0), 1),
+            "heavy": {name: round(cumulative[name], 1) for name in HEAVY if name in after}}
+
+
+def first_render(app, preload):
+    from streamlit.testing.v1 import AppTest
+    import warmup
+
+    # AppTest scans the installed components on its first run, pay for that on an empty script
+    AppTest.from_string("import streamlit as st").run()
+
+    start = time.perf_counter()
+    for module in preload:
+        __import__(module)
+    at = AppTest.from_file(os.path.join(ROOT, app), default_timeout=120)
+    at.secrets["stripe_secret_key"] = "sk_test_bench"
+    at.run()
+    first = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    start = time.perf_counter()
+    at.run()
+    rerun = time.perf_counter() - start
+    start = time.perf_counter()
+    warmup.wait_warmup(60)
+    return {"first_render_ms": round(first * 1000, 1), "rerun_ms": round(rerun * 1000, 1),
+            "warmup_wait_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=1000, help="time to first render to stay under")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--app", help=argparse.SUPPRESS)
+    parser.add_argument("--preload", nargs="*", default=[], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.app:
+        print(json.dumps(first_render(args.app, args.preload)))
+        return
+
+    imports = {module: import_time(module) for module in MODULES}
+
+    renders = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATACHAT_METRICS="off", DATACHAT_USER_DB=os.path.join(tmp, "users.db"),
+                   DATACHAT_LLM_CACHE_PATH=os.path.join(tmp, "llm_cache.db"))
+        for app in APPS:
+            for mode, preload in MODES.items():
+                runs = []
+                for _ in range(args.runs):
+                    command = [sys.executable, __file__, "--app", app, "--preload"] + preload
+                    out = subprocess.run(command, capture_output=True, text=True, cwd=ROOT, env=env)
+                    if out.returncode != 0:
+                        runs = {"failed": "exit code %d" % out.returncode, "stderr": out.stderr.strip()[-300:]}
+                        break
+                    runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+                if isinstance(runs, dict):
+                    renders.setdefault(app, {})[mode] = runs
+                    continue
+                result = {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+                result["meets_target"] = result["first_render_ms"] <= args.target_ms
+                renders.setdefault(app, {})[mode] = result
+
+    report = json.dumps({"benchmark": "cold_start", "runs": args.runs, "target_ms": args.target_ms,
+                         "imports": imports, "first_render": renders}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
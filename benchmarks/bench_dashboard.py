@@ -0,0 +1,94 @@
+"""
+Wall time of a dashboard of several plots, created one "Show:" prompt after the other against
+dashboard.build_dashboard, which sends the ChatGPT requests together and runs the scripts side
+by side. ChatGPT is the local stub from stub_llm.py with a fixed latency. Templates, similar
+prompts and the response and render caches are off, so every plot is generated and rendered.
+
+    python benchmarks/bench_dashboard.py --charts 2 4 8 --latency 1.0 --output dashboard.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PORT = 8797
+os.environ.update(DATACHAT_OPENAI_API_BASE="http://127.0.0.1:%d/v1" % PORT, DATACHAT_TEMPLATES="off",
+                  DATACHAT_SIMILAR_PROMPTS="off", DATACHAT_LLM_CACHE="off", DATACHAT_RENDER_CACHE_MB="0",
+                  DATACHAT_METRICS="off")
+
+import stub_llm
+from dashboard import build_dashboard
+from dataset_store import DATASET_FILES, get_dataset_registry
+from helpers import format_question, format_response, get_primer, run_request
+from plot_executor import DATAFRAME_HANDOFF, PlotExecutor
+from render_cache import PLOT_DPI, PLOT_FORMAT
+
+PROMPTS = [
+    "Show: average price by type", "Show: histogram of horsepower", "Show: mpg by origin",
+    "Show: weight by cylinders", "Show: acceleration over year", "Show: count of origin",
+    "Show: median displacement by cylinders", "Show: horsepower versus weight",
+]
+
+
+def one_by_one(df, name, prompts, executor):
+    """
+    The previous flow: each prompt waits for its code, then for its plot
+    """
+    times = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        primer1, primer2 = get_primer(df, 'datasets["%s"]' % name, DATAFRAME_HANDOFF, prompt)
+        answer = run_request(format_question(primer1, primer2, prompt), "stub", use_cache=False)
+        executor.run(format_response(primer2 + answer), image_format=PLOT_FORMAT, dpi=PLOT_DPI)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--charts", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds the stub waits before answering")
+    parser.add_argument("--workers", type=int, default=4, help="plot executor workers")
+    parser.add_argument("--dataset", default="Cars")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    server = stub_llm.serve(PORT, args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    executor = PlotExecutor(workers=args.workers, dataset_files=DATASET_FILES)
+    df = get_dataset_registry()[args.dataset]
+    # Warm up the workers and the dataset profile
+    one_by_one(df, args.dataset, PROMPTS[:1], executor)
+
+    results = {}
+    for n in args.charts:
+        prompts = PROMPTS[:n]
+        times = one_by_one(df, args.dataset, prompts, executor)
+        start = time.perf_counter()
+        charts = build_dashboard(df, 'datasets["%s"]' % args.dataset, prompts, "stub", executor,
+                                 handoff=DATAFRAME_HANDOFF)
+        batch = time.perf_counter() - start
+        results[str(n)] = {
+            "one_by_one_s": round(sum(times), 3),
+            "slowest_chart_s": round(max(times), 3),
+            "dashboard_s": round(batch, 3),
+            "failures": sum(1 for chart in charts if chart.error),
+        }
+    executor.shutdown()
+    server.shutdown()
+
+    report = json.dumps({"benchmark": "dashboard", "llm_latency": args.latency, "workers": args.workers,
+                         "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
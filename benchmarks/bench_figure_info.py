@@ -0,0 +1,117 @@
+"""
+Time to read what a figure shows (figure_info.figure_metadata) and to describe it from that, as
+the plot workers and "Describe it" do, on figures with growing numbers of artists: bars, lines,
+scatter points, histogram bins, pie slices and heatmap cells. savefig_ms is the time the worker
+already spends encoding the same figure, for scale.
+
+    python benchmarks/bench_figure_info.py --sizes 10 1000 10000 --output figure_info.json
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from figure_info import describe_figure, figure_metadata
+
+
+def _bars(ax, n, rng):
+    ax.bar(["item %d" % i for i in range(n)], rng.random(n))
+
+
+def _pandas_bars(ax, n, rng):
+    pd.Series(rng.random(n), index=["item %d" % i for i in range(n)]).plot.bar(ax=ax)
+
+
+def _lines(ax, n, rng):
+    # n lines of 100 points
+    for i in range(n):
+        ax.plot(rng.random(100), label="series %d" % i)
+
+
+def _time_series(ax, n, rng):
+    pd.Series(rng.random(n * 100), index=pd.date_range("2000-01-01", periods=n * 100, freq="h")).plot(ax=ax)
+
+
+def _scatter(ax, n, rng):
+    ax.scatter(rng.random(n * 100), rng.random(n * 100))
+
+
+def _histogram(ax, n, rng):
+    ax.hist(rng.standard_normal(100000), bins=n)
+
+
+def _pie(ax, n, rng):
+    ax.pie(rng.random(n), labels=["slice %d" % i for i in range(n)])
+
+
+def _heatmap(ax, n, rng):
+    ax.imshow(rng.random((n, 100)))
+
+
+FIGURES = {"bars": _bars, "pandas_bars": _pandas_bars, "lines": _lines, "time_series": _time_series,
+           "scatter": _scatter, "histogram": _histogram, "pie": _pie, "heatmap": _heatmap}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-savefig-above", type=int, default=1000,
+                        help="time savefig only up to this size, it takes seconds on the largest figures")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+    for name, draw in FIGURES.items():
+        for size in args.sizes:
+            if name == "pie" and size > 1000:
+                continue
+            fig, ax = plt.subplots(1, 1, figsize=(10, 4))
+            draw(ax, size, rng)
+            start = time.perf_counter()
+            # Always drawn once, the workers read the figure after savefig
+            if size <= args.skip_savefig_above:
+                fig.savefig(io.BytesIO(), format="png")
+            else:
+                fig.canvas.draw()
+            savefig_seconds = time.perf_counter() - start
+
+            extract, describe = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                metadata = figure_metadata(fig)
+                extract.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                text = describe_figure(metadata)
+                describe.append(time.perf_counter() - start)
+            plt.close(fig)
+            results.append({"figure": name, "size": size, "artists": metadata["axes"][0]["artists"],
+                            "plot_type": metadata["axes"][0]["plot_type"],
+                            "extract_ms": round(statistics.median(extract) * 1000, 2),
+                            "describe_ms": round(statistics.median(describe) * 1000, 3),
+                            "savefig_ms": round(savefig_seconds * 1000, 1) if size <= args.skip_savefig_above else None,
+                            "metadata_bytes": len(json.dumps(metadata)), "description": text[:160]})
+
+    report = json.dumps({"benchmark": "figure_info", "max_extract_ms": max(r["extract_ms"] for r in results),
+                         "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
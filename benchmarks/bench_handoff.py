@@ -0,0 +1,86 @@
+"""
+Measures the peak memory and time of running primed plotting code with the two dataframe
+handoff modes: "copy" (df=<dataset>.copy()) and "view" (copy-on-write shallow copy).
+Each mode runs in its own interpreter because copy-on-write is a process-wide pandas option.
+
+    python benchmarks/bench_handoff.py --scale 500 --output handoff.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# A typical generated plot, plus a mutation that must stay inside the run
+PLOT_CODE = """
+df['Price per Room'] = df['Price'] / df['Rooms']
+summary = df.groupby('Home Type')['Price per Room'].mean()
+ax.bar(summary.index.astype(str), summary.values)
+datasets["Housing"]["Price"] = 0
+reasoning = 'bar chart'
+"""
+
+
+def run_mode(handoff, scale):
+    import matplotlib
+    matplotlib.use("Agg")
+    import pandas as pd
+    from helpers import get_primer
+    from plot_executor import enable_copy_on_write, handoff_datasets
+
+    copy_on_write = handoff == "view" and enable_copy_on_write()
+    housing = pd.read_csv(os.path.join(ROOT, "housing.csv"))
+    housing = pd.concat([housing] * scale, ignore_index=True)
+    shared = {"Housing": housing}
+    price_before = housing["Price"].sum()
+    _, primer_code = get_primer(housing, 'datasets["Housing"]', handoff)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    namespace = {"datasets": handoff_datasets(shared, handoff, copy_on_write)}
+    exec(primer_code + PLOT_CODE, namespace)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "handoff": handoff,
+        "copy_on_write": copy_on_write,
+        "rows": len(housing),
+        "dataset_mb": round(housing.memory_usage(deep=True).sum() / 1024 / 1024, 2),
+        "peak_mb": round(peak / 1024 / 1024, 2),
+        "seconds": round(elapsed, 4),
+        "leaked": bool(housing["Price"].sum() != price_before or "Price per Room" in housing.columns),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=200, help="copies of housing.csv to stack")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.scale)))
+        return
+
+    results = []
+    for handoff in ("copy", "view"):
+        out = subprocess.run([sys.executable, __file__, "--mode", handoff, "--scale", str(args.scale)],
+                             check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    report = json.dumps({"benchmark": "handoff", "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Offline end-to-end benchmark of a "Show:" round trip. Replays the prompts in prompts.json
+against the bundled datasets and against copies of housing.csv and colleges.csv scaled to
+10x, 100x and 1000x rows. openai.ChatCompletion.create is replaced by the deterministic
+stub from stub_llm.py with a configurable latency, and each stage is timed on its own:
+get_primer, format_question, the LLM call, format_response, then the code runs through a
+PlotExecutor as in the app. exec, savefig and figure_info are timed inside the worker,
+executor is the whole round trip including optimizing, queueing and sending the upload.
+
+    python benchmarks/bench_pipeline.py --latency 0.5 --scales 10 100 --output pipeline.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import openai
+import pandas as pd
+
+import helpers
+import stub_llm
+from dataset_store import DATASET_FILES
+from plot_executor import DATAFRAME_HANDOFF, PlotExecutionError, PlotExecutor
+
+STAGES = ("get_primer", "format_question", "llm", "format_response", "executor", "exec", "savefig",
+          "figure_info")
+# Seconds reported by the worker in PlotJob.timings for each stage
+WORKER_STAGES = {"exec": "exec_seconds", "savefig": "savefig_seconds", "figure_info": "figure_info_seconds"}
+SCALED = ("Housing", "Colleges")
+
+
+def install_stub(latency):
+    """
+    Replaces the chat completions api with the local deterministic stub
+    """
+    def create(model=None, messages=(), **kwargs):
+        task = next((m["content"] for m in messages if m["role"] == "system"), "")
+        prompt = next((m["content"] for m in messages if m["role"] == "user"), "")
+        time.sleep(latency)
+        reply = stub_llm.stub_reply(task, prompt)
+        return {"choices": [{"message": {"role": "assistant", "content": reply}}],
+                "usage": {"prompt_tokens": len((task + prompt).split()), "completion_tokens": len(reply.split())}}
+
+    openai.ChatCompletion.create = create
+
+
+def load_datasets(scales):
+    datasets = {name: pd.read_csv(os.path.join(ROOT, path)) for name, path in DATASET_FILES.items()}
+    for name in SCALED:
+        for scale in scales:
+            datasets["%s x%d" % (name, scale)] = pd.concat([datasets[name]] * scale, ignore_index=True)
+    return datasets
+
+
+def timed(stages, name, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    stages[name] = time.perf_counter() - start
+    return result
+
+
+def run_prompt(datasets, name, prompt, executor):
+    stages = {}
+    df = datasets[name]
+    primer_desc, primer_code = timed(stages, "get_primer", helpers.get_primer, df, 'datasets["' + name + '"]',
+                                     DATAFRAME_HANDOFF, prompt)
+    question = timed(stages, "format_question", helpers.format_question, primer_desc, primer_code, prompt)
+    answer = timed(stages, "llm", helpers.run_request, question, "offline", use_cache=False)
+    code = timed(stages, "format_response", helpers.format_response, primer_code + answer)
+
+    # The bundled datasets are preloaded by the workers, the scaled copies are sent like uploads
+    uploads = None if name in DATASET_FILES else {name: df}
+    job = executor.submit(code, uploads)
+    error = None
+    start = time.perf_counter()
+    try:
+        image, _ = job.result()
+        image_bytes = len(image)
+    except PlotExecutionError as e:
+        error = str(e)
+        image_bytes = 0
+    stages["executor"] = time.perf_counter() - start
+    for stage, key in WORKER_STAGES.items():
+        if key in job.timings:
+            stages[stage] = job.timings[key]
+
+    return {
+        "dataset": name,
+        "rows": len(df),
+        "prompt": prompt,
+        "stages": {stage: round(seconds, 6) for stage, seconds in stages.items()},
+        "total": round(sum(stages[stage] for stage in STAGES[:5] if stage in stages), 6),
+        "image_bytes": image_bytes,
+        "error": error,
+    }
+
+
+def summarize(runs):
+    summary = {}
+    for stage in STAGES + ("total",):
+        values = sorted(run["total"] if stage == "total" else run["stages"][stage]
+                        for run in runs if stage == "total" or stage in run["stages"])
+        if values:
+            summary[stage] = {
+                "median": round(statistics.median(values), 6),
+                "p95": round(values[min(len(values) - 1, int(0.95 * len(values)))], 6),
+                "max": round(values[-1], 6),
+            }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stub waits before answering")
+    parser.add_argument("--scales", type=int, nargs="*", default=[10, 100, 1000])
+    parser.add_argument("--prompts", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts.json"))
+    parser.add_argument("--workers", type=int, default=2, help="plot worker processes")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    install_stub(args.latency)
+    executor = PlotExecutor(workers=args.workers, dataset_files=DATASET_FILES, handoff=DATAFRAME_HANDOFF)
+    # Waits for every worker to load the bundled datasets, start up is not part of a round trip
+    for job in [executor.submit("fig = plt.figure()") for _ in range(args.workers)]:
+        job.result()
+    with open(args.prompts) as f:
+        corpus = json.load(f)
+    datasets = load_datasets(args.scales)
+
+    runs = []
+    for name in datasets:
+        base = name.split(" x")[0]
+        for prompt in corpus.get(base, []):
+            runs.append(run_prompt(datasets, name, prompt, executor))
+    executor.shutdown()
+
+    by_dataset = {}
+    for run in runs:
+        by_dataset.setdefault(run["dataset"], []).append(run)
+    report = json.dumps({
+        "benchmark": "pipeline",
+        "llm_latency": args.latency,
+        "handoff": DATAFRAME_HANDOFF,
+        "workers": args.workers,
+        "summary": summarize(runs),
+        "datasets": {name: {"rows": group[0]["rows"], "summary": summarize(group)} for name, group in by_dataset.items()},
+        "runs": runs,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
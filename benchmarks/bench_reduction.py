@@ -0,0 +1,79 @@
+"""
+Render time of line, scatter and bar plots as the data grows, raw matplotlib calls against
+the data reduction helpers in reduction.py.
+
+    python benchmarks/bench_reduction.py --rows 10000 100000 1000000 --output reduction.json
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from reduction import plot_bars, plot_line, plot_scatter
+
+RAW = {
+    "line": lambda ax, df: ax.plot(df.sort_values("x")["x"], df.sort_values("x")["y"]),
+    "scatter": lambda ax, df: ax.scatter(df["x"], df["y"]),
+    "bar": lambda ax, df: ax.bar(df["category"].astype(str), df["y"]),
+}
+REDUCED = {
+    "line": lambda ax, df: plot_line(ax, df, "x", "y"),
+    "scatter": lambda ax, df: plot_scatter(ax, df, "x", "y"),
+    "bar": lambda ax, df: plot_bars(ax, df, "category", "y"),
+}
+
+
+def make_frame(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "x": np.arange(rows, dtype="float64"),
+        "y": rng.standard_normal(rows).cumsum(),
+        "category": rng.choice(["north", "south", "east", "west"], rows),
+    })
+
+
+def render_seconds(plot, df):
+    start = time.perf_counter()
+    fig, ax = plt.subplots(1, 1, figsize=(10, 4))
+    plot(ax, df)
+    fig.savefig(io.BytesIO(), format="png")
+    plt.close(fig)
+    return round(time.perf_counter() - start, 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--raw-limit", type=int, default=10_000, help="skip raw plots above this many rows")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        df = make_frame(rows)
+        for kind in ("line", "scatter", "bar"):
+            results.append({
+                "plot": kind,
+                "rows": rows,
+                "raw_seconds": render_seconds(RAW[kind], df) if rows <= args.raw_limit else None,
+                "reduced_seconds": render_seconds(REDUCED[kind], df),
+            })
+    report = json.dumps({"benchmark": "reduction", "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
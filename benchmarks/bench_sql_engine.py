@@ -0,0 +1,121 @@
+"""
+Time per chart on a large upload, with pandas code scanning the dataframe in the plot worker
+against an aggregation query on the embedded SQL engine (sql_engine.py) whose small result is
+plotted by the worker. The housing dataset is scaled to --rows rows and sent along like an
+upload, and loaded into the engine up front as the apps do while the user types (load_ms).
+The first pass pays for sending the upload to the workers, the second asks new questions on
+the same columns (the engine indexes them by now) and the third repeats the first questions
+(the engine keeps their results).
+
+    python benchmarks/bench_sql_engine.py --rows 1000000 --output sql_engine.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+from plot_executor import PlotExecutor
+from render_cache import PLOT_DPI, PLOT_FORMAT
+from sql_engine import QUERY_RESULT, SQLEngine
+
+PASSES = ("first_pass", "new_questions", "repeated")
+PRIMER = "import pandas as pd\nimport matplotlib.pyplot as plt\nfig,ax = plt.subplots(1,1,figsize=(10,4))\n"
+
+# Each question as the pandas code ChatGPT writes for it and as the SQL path's query and code
+QUESTIONS = [
+    {"prompt": "average price by home type", "variant": ("AVG", "MIN"),
+     "pandas": "df = datasets['Upload'].copy()\ns = df.groupby('Home Type')['Price'].mean()\n"
+               "ax.bar(s.index.astype(str), s.values)\nreasoning = 'bar'\n",
+     "query": 'SELECT "Home Type", AVG("Price") AS price FROM data GROUP BY "Home Type"',
+     "code": "df = datasets['Query result'].copy()\nax.bar(df['Home Type'].astype(str), df['price'])\nreasoning = 'bar'\n"},
+    {"prompt": "houses sold per year", "variant": ("COUNT(*)", "AVG(\"Price\")"),
+     "pandas": "df = datasets['Upload'].copy()\ns = df['Year'].value_counts().sort_index()\n"
+               "ax.plot(s.index, s.values)\nreasoning = 'line'\n",
+     "query": 'SELECT "Year", COUNT(*) AS n FROM data GROUP BY "Year" ORDER BY "Year"',
+     "code": "df = datasets['Query result'].copy()\nax.plot(df['Year'], df['n'])\nreasoning = 'line'\n"},
+    {"prompt": "average lot area of single family homes by foundation", "variant": ("Single Family", "Townhouse"),
+     "pandas": "df = datasets['Upload'].copy()\nd = df[df['Home Type'] == 'Single Family']\n"
+               "s = d.groupby('Foundation Type')['Lot Area'].mean()\nax.bar(s.index.astype(str), s.values)\n"
+               "reasoning = 'bar'\n",
+     "query": 'SELECT "Foundation Type", AVG("Lot Area") AS area FROM data WHERE "Home Type" = \'Single Family\' '
+              'GROUP BY "Foundation Type"',
+     "code": "df = datasets['Query result'].copy()\nax.bar(df['Foundation Type'].astype(str), df['area'])\n"
+             "reasoning = 'bar'\n"},
+    {"prompt": "max price by rooms for houses with central air", "variant": ("= 'Y'", "= 'N'"),
+     "pandas": "df = datasets['Upload'].copy()\nd = df[df['Central Air'] == 'Y']\ns = d.groupby('Rooms')['Price'].max()\n"
+               "ax.bar(s.index.astype(str), s.values)\nreasoning = 'bar'\n",
+     "query": 'SELECT "Rooms", MAX("Price") AS price FROM data WHERE "Central Air" = \'Y\' GROUP BY "Rooms"',
+     "code": "df = datasets['Query result'].copy()\nax.bar(df['Rooms'].astype(str), df['price'])\nreasoning = 'bar'\n"},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--engine", default="sqlite", choices=["sqlite", "duckdb"])
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    housing = pd.read_csv(os.path.join(ROOT, "housing.csv"))
+    big = pd.concat([housing] * (args.rows // len(housing) + 1), ignore_index=True).iloc[:args.rows]
+    executor = PlotExecutor(workers=args.workers)
+    engine = SQLEngine(engine=args.engine)
+
+    start = time.perf_counter()
+    engine.preload(big).result()
+    load_seconds = time.perf_counter() - start
+
+    results = []
+    for run in PASSES:
+        for item in QUESTIONS:
+            # New questions on the same columns: another aggregate or filter value
+            pandas_code, query = item["pandas"], item["query"]
+            if run == "new_questions":
+                old, new = item["variant"]
+                pandas_code = pandas_code.replace(old.replace('"', "'"), new.replace('"', "'"))
+                query = query.replace(old, new)
+                if old == "AVG":
+                    pandas_code = pandas_code.replace(".mean()", ".min()")
+                elif old == "COUNT(*)":
+                    pandas_code = pandas_code.replace("df['Year'].value_counts().sort_index()",
+                                                      "df.groupby('Year')['Price'].mean()")
+            start = time.perf_counter()
+            executor.run(PRIMER + pandas_code, {"Upload": big}, image_format=PLOT_FORMAT, dpi=PLOT_DPI)
+            pandas_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = engine.query(big, query)
+            query_seconds = time.perf_counter() - start
+            executor.run(PRIMER + item["code"], {QUERY_RESULT: result}, image_format=PLOT_FORMAT, dpi=PLOT_DPI)
+            sql_seconds = time.perf_counter() - start
+            results.append({"prompt": item["prompt"], "run": run, "pandas_ms": round(pandas_seconds * 1000, 1),
+                            "sql_ms": round(sql_seconds * 1000, 1), "query_ms": round(query_seconds * 1000, 1),
+                            "result_rows": len(result)})
+    executor.shutdown()
+
+    totals = {}
+    for run in PASSES:
+        runs = [r for r in results if r["run"] == run]
+        totals[run] = {"pandas_ms": round(sum(r["pandas_ms"] for r in runs), 1),
+                       "sql_ms": round(sum(r["sql_ms"] for r in runs), 1),
+                       "median_query_ms": round(statistics.median(r["query_ms"] for r in runs), 1)}
+    report = json.dumps({"benchmark": "sql_engine", "engine": engine.table_class.engine, "rows": len(big),
+                         "load_ms": round(load_seconds * 1000, 1),
+                         "upload_mb": round(big.memory_usage(deep=True).sum() / 1024 / 1024, 1),
+                         "engine_stats": engine.stats(), "totals": totals, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
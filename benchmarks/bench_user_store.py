@@ -0,0 +1,154 @@
+"""
+Concurrent sign ins against the user database. The old setup, one sqlite3 connection and cursor
+shared by every thread with plain-text passwords, is compared with user_store.UserStore: pooled
+WAL connections with PBKDF2 hashes, first with cold logins and then with repeated logins answered
+from its login cache. Sign ups run alongside the logins so readers compete with a writer.
+Each setup runs in its own process, as the shared cursor can crash the interpreter.
+
+    python benchmarks/bench_user_store.py --threads 16 --logins 2000 --output user_store.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from user_store import UserStore
+
+
+class SharedConnection:
+    """
+    The previous app_prd.py code: one module-level connection and cursor for all threads
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.c = self.conn.cursor()
+        self.c.execute("CREATE TABLE IF NOT EXISTS users (email TEXT PRIMARY KEY, password TEXT NOT NULL)")
+        self.conn.commit()
+
+    def add_user(self, email, password):
+        try:
+            self.c.execute("INSERT INTO users (email, password) VALUES (?, ?)", (email, password))
+            self.conn.commit()
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def authenticate(self, email, password):
+        self.c.execute("SELECT * FROM users WHERE email = ? AND password = ?", (email, password))
+        return self.c.fetchone() is not None
+
+
+def run(store, users, logins, threads, signups):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def login(i):
+        email = "user%d@example.com" % (i % users)
+        start = time.perf_counter()
+        try:
+            ok = store.authenticate(email, "password%d" % (i % users))
+            if not ok:
+                raise ValueError("rejected valid login")
+        except Exception as e:
+            with lock:
+                errors.append("%s: %s" % (type(e).__name__, e))
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    def signup(i):
+        try:
+            store.add_user("new%d@example.com" % i, "secret")
+        except Exception as e:
+            with lock:
+                errors.append("%s: %s" % (type(e).__name__, e))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        for i in range(logins):
+            pool.submit(login, i)
+            if signups and i % (logins // signups or 1) == 0:
+                pool.submit(signup, i)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "logins_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3) if latencies else None,
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 3) if latencies else None,
+        "errors": len(errors),
+        "error_examples": sorted(set(errors))[:3],
+    }
+
+
+def run_mode(mode, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.db")
+        if mode == "shared_connection":
+            store = SharedConnection(path)
+        else:
+            store = UserStore(path, **({"iterations": args.iterations} if args.iterations else {}))
+        for u in range(args.users):
+            store.add_user("user%d@example.com" % u, "password%d" % u)
+        if mode == "shared_connection":
+            return run(store, args.users, args.logins, args.threads, args.signups)
+        if mode == "user_store_cold":
+            # Every login is new: one PBKDF2 hash each, the cost of a first sign in
+            store.session_ttl = 0
+            result = run(store, args.users, args.logins, args.threads, args.signups)
+        else:
+            # Repeated logins within the login cache ttl, after each user signed in once
+            for u in range(args.users):
+                store.authenticate("user%d@example.com" % u, "password%d" % u)
+            result = run(store, args.users, args.logins, args.threads, args.signups)
+        result["iterations"] = store.iterations
+        store.close()
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--logins", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--signups", type=int, default=50, help="sign ups interleaved with the logins")
+    parser.add_argument("--iterations", type=int, default=None, help="PBKDF2 iterations (default DATACHAT_PASSWORD_ITERATIONS)")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args)))
+        return
+
+    results = {}
+    for mode in ("shared_connection", "user_store_cold", "user_store_cached"):
+        command = [sys.executable, __file__, "--mode", mode] + [
+            a for name in ("users", "logins", "threads", "signups", "iterations")
+            if getattr(args, name) is not None for a in ("--" + name, str(getattr(args, name)))]
+        out = subprocess.run(command, capture_output=True, text=True)
+        if out.returncode != 0:
+            results[mode] = {"crashed": "exit code %d" % out.returncode, "stderr": out.stderr.strip()[-300:]}
+        else:
+            results[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    report = json.dumps({"benchmark": "user_store", "threads": args.threads, "logins": args.logins,
+                         "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Rendering of the chat history. Streamlit reruns the whole script on every interaction, so looping
+over all messages made each rerun slower as the chat grew. Only the last HISTORY_TURNS messages
+are rendered, earlier ones are paged in on request, and the history runs as a fragment: opening
+an older plot or paging back reruns the history alone instead of the whole app.
+"""
+import os
+import streamlit as st
+from image_store import RECENT_FULL_SIZE, show_history_image
+from dashboard import show_dashboard
+from fragments import fragment
+
+# Messages rendered on a rerun, 0 renders the whole history
+HISTORY_TURNS = int(os.environ.get("DATACHAT_HISTORY_TURNS", 20))
+
+
+def history_window(count, shown, turns=HISTORY_TURNS):
+    """
+    Index of the first message to render out of count, with shown earlier pages opened
+    """
+    if not turns:
+        return 0
+    return max(count - turns * (shown + 1), 0)
+
+
+def _show_earlier():
+    st.session_state["history_pages"] = st.session_state.get("history_pages", 0) + 1
+
+
+@fragment
+def show_history(messages, images, turns=HISTORY_TURNS):
+    """
+    Renders the latest messages of the chat, with a button paging in earlier ones
+    """
+    start = history_window(len(messages), st.session_state.get("history_pages", 0), turns)
+    if start:
+        st.button("Show %d earlier messages" % min(start, turns), key="history_more", on_click=_show_earlier)
+
+    recent = [i for i, msg in enumerate(messages) if "image" in msg or "dashboard" in msg][-RECENT_FULL_SIZE:]
+    for i in range(start, len(messages)):
+        msg = messages[i]
+        st.chat_message(msg["role"]).write(msg["content"])
+        if "image" in msg:
+            show_history_image(images, msg["image"], msg["prompt"], i in recent, "full_size_%d" % i)
+        if "dashboard" in msg:
+            with st.chat_message("assistant"):
+                show_dashboard(images, msg["dashboard"], i in recent)
@@ -0,0 +1,124 @@
+"""
+Stripe checkout links for the "Buy me a Coffee" button. Creating a checkout session is a network
+round trip to Stripe, so a session is created once per user and reused until shortly before it
+expires. Links are created and renewed on a background thread: get() only reads the cache and
+never waits on Stripe, a user whose link is not ready yet just gets no button on this rerun.
+
+Set DATACHAT_STRIPE_API_BASE (e.g. http://127.0.0.1:8766, see stub_stripe.py) to run offline.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+STRIPE_API_BASE = os.environ.get("DATACHAT_STRIPE_API_BASE") or None
+# Seconds a checkout session stays valid, Stripe accepts 30 minutes to 24 hours
+CHECKOUT_TTL = int(os.environ.get("DATACHAT_CHECKOUT_TTL", 23 * 3600))
+# Links are renewed this many seconds before they expire
+REFRESH_MARGIN = 15 * 60
+# Seconds to wait before retrying after Stripe failed
+RETRY_DELAY = 60
+
+SUCCESS_URL = 'https://datatovischatbot.streamlit.app?payment=success'
+CANCEL_URL = 'https://datatovischatbot.streamlit.app?payment=cancel'
+
+logger = logging.getLogger(__name__)
+
+
+def create_checkout_session(customer_email=None, ttl=CHECKOUT_TTL, api_key=None):
+    """
+    Creates a Stripe checkout session and returns its url and expiry time (unix seconds).
+    stripe is imported here, on the checkout thread, so it stays out of the app's startup.
+    """
+    import stripe
+
+    if api_key:
+        stripe.api_key = api_key
+    if STRIPE_API_BASE:
+        stripe.api_base = STRIPE_API_BASE
+    session = stripe.checkout.Session.create(
+        payment_method_types=['card'],
+        line_items=[{
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {
+                    'name': 'DataChat Access',
+                },
+                'unit_amount': 500,  # Amount in cents ($5.00)
+            },
+            'quantity': 1,
+        }],
+        mode='payment',
+        customer_email=customer_email or None,
+        expires_at=int(time.time()) + ttl,
+        success_url=SUCCESS_URL,
+        cancel_url=CANCEL_URL,
+    )
+    return session.url, getattr(session, "expires_at", None) or int(time.time()) + ttl
+
+
+class CheckoutLinks:
+    """
+    Per-user cache of checkout links, filled and renewed in the background.
+    create is called as create(user) and returns (url, expires_at).
+    """
+
+    def __init__(self, create=create_checkout_session, refresh_margin=REFRESH_MARGIN, retry_delay=RETRY_DELAY,
+                 workers=2):
+        self.create = create
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self.created = 0
+        self.failures = 0
+        self._links = {}
+        self._pending = set()
+        self._retry_after = {}
+        self._lock = threading.Lock()
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="checkout")
+
+    def get(self, user):
+        """
+        Returns the user's checkout url, or None while it is being created. Never blocks on Stripe.
+        """
+        now = time.time()
+        with self._lock:
+            url, expires_at = self._links.get(user, (None, 0))
+            if expires_at <= now:
+                url = None
+                self._links.pop(user, None)
+            if expires_at - self.refresh_margin <= now and user not in self._pending \
+                    and self._retry_after.get(user, 0) <= now:
+                self._pending.add(user)
+                self._threads.submit(self._refresh, user)
+        return url
+
+    def _refresh(self, user):
+        try:
+            url, expires_at = self.create(user)
+        except Exception as e:
+            logger.warning("Creating a checkout session failed: %s", e)
+            with self._lock:
+                self.failures += 1
+                self._retry_after[user] = time.time() + self.retry_delay
+                self._pending.discard(user)
+            return
+        with self._lock:
+            self.created += 1
+            now = time.time()
+            # Links of users who stopped coming back are dropped as new ones are created
+            for stale in [u for u, (_, exp) in self._links.items() if exp <= now]:
+                del self._links[stale]
+            for stale in [u for u, retry in self._retry_after.items() if retry <= now]:
+                del self._retry_after[stale]
+            self._links[user] = (url, expires_at)
+            self._retry_after.pop(user, None)
+            self._pending.discard(user)
+
+    def stats(self):
+        with self._lock:
+            return {"links": len(self._links), "pending": len(self._pending), "created": self.created,
+                    "failures": self.failures}
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
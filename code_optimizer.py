@@ -0,0 +1,578 @@
+"""
+AST pass over the generated plot code before it runs. It strips file I/O and show() calls,
+rewrites slow pandas idioms into vectorized ones and rejects code whose cost has no bound.
+The I/O calls are read_csv and friends, to_csv and friends, savefig and show. The rewrites are:
+- df["col"].apply / .map with an arithmetic lambda: the expression on the whole column
+- DataFrame.apply(axis=1) with an arithmetic lambda over row["col"]: the same on df["col"]
+- for i, row in df.iterrows() reading only row["col"]: a loop over zip(df.index, df["col"], ...)
+- the same df.groupby(...) built in several statements or in a loop: built once into a variable
+Rejected are while loops, very long ranges, recursion, input, eval/exec, file and process access.
+The unparsed result is a normalized form of the code, render_cache uses it as the cache key.
+
+The two apply rewrites only touch columns the caller knows to be numeric in the datasets (a
+category column has no arithmetic) and that the code does not assign or convert. Vectorized
+arithmetic follows numpy rules, so a division by zero that raised in a row-wise apply gives inf.
+Powers are left alone, an int64 column raises on x ** -1 and silently wraps around on x ** 40.
+iterrows hands out each row as a Series of the frame's common dtype, so next to a float column an
+int column comes out as floats; the zip loop yields each column's own values. The rewritten loop
+may only compute with the values, it is skipped when one is formatted as text (2020 vs 2020.0).
+The groupby is only built once when the frame shares its data with no other name or code before
+the last use: an alias, a shallow copy, pipe() or the frame passed to a call could change it.
+"""
+import ast
+import copy
+import os
+
+OPTIMIZER_ENABLED = os.environ.get("DATACHAT_CODE_OPTIMIZER", "on").lower() not in ("0", "off", "false", "no")
+# Longest constant range() the generated code may loop over
+MAX_RANGE = 10_000_000
+
+READERS = {"read_csv", "read_excel", "read_json", "read_parquet", "read_table", "read_pickle", "read_sql",
+           "read_feather", "read_html", "read_clipboard"}
+WRITERS = {"to_csv", "to_excel", "to_json", "to_parquet", "to_pickle", "to_sql", "to_feather", "to_html",
+           "to_clipboard", "savefig", "show"}
+FORBIDDEN_CALLS = {"input", "eval", "exec", "compile", "__import__", "open", "breakpoint", "exit", "quit"}
+FORBIDDEN_MODULES = {"os", "sys", "subprocess", "socket", "shutil", "requests", "urllib", "http", "multiprocessing",
+                     "threading", "ctypes", "pickle", "signal", "pathlib", "resource"}
+# Methods that change the frame they are called on
+MUTATING_METHODS = {"insert", "pop", "update", "drop_duplicates", "set_index", "reset_index", "rename", "fillna",
+                    "dropna", "drop", "sort_values", "sort_index", "replace", "astype"}
+# Calls whose result must not be treated as a Series or DataFrame by the apply rewrite
+_GROUPED = {"groupby", "rolling", "resample", "expanding", "ewm"}
+# Calls whose result may hold columns with other dtypes than the datasets
+_RETYPING = {"astype", "rename", "assign", "convert_dtypes", "infer_objects", "set_axis", "Categorical", "cut",
+             "qcut", "DataFrame"}
+# Calls that turn a value into text, where an int upcast to float by iterrows shows
+_FORMATTING = {"str", "repr", "format"}
+# Methods returning an object that shares data with the frame, or handing the frame to other code
+_SHARING_METHODS = {"pipe", "to_numpy", "view", "__array__"}
+# Attributes of a frame that hold no data of it
+_METADATA = {"shape", "columns", "index", "dtypes", "size", "ndim", "empty", "name", "dtype"}
+# Builtins that only read the frame passed to them
+_READING_CALLS = {"len", "print", "repr", "str", "isinstance", "type", "id"}
+# No ** : an int64 column raises on a negative exponent and wraps around on a large one,
+# where the Python ints of a per-element lambda give floats or grow without limit
+_ARITHMETIC = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod)
+
+
+class UnsafeCodeError(ValueError):
+    pass
+
+
+def _call_name(node):
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    return None
+
+
+def _base_name(node):
+    # df for df, df["a"], df.a.b; None when the chain contains a call
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _column(node):
+    # "col" for df["col"] and df.col, else None
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and isinstance(node.slice, ast.Constant) \
+            and isinstance(node.slice.value, str):
+        return node.slice.value
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+        return node.attr
+    return None
+
+
+def _constant_int(node):
+    # The value of an integer literal or of arithmetic on integer literals, else None
+    if isinstance(node, ast.Constant) and isinstance(node.value, int):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        value = _constant_int(node.operand)
+        return None if value is None else -value
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Pow)):
+        left, right = _constant_int(node.left), _constant_int(node.right)
+        if left is None or right is None or (isinstance(node.op, ast.Pow) and not 0 <= right <= 64):
+            return None
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Sub):
+            return left - right
+        return left * right if isinstance(node.op, ast.Mult) else left ** right
+    return None
+
+
+def _check(tree):
+    """
+    Raises UnsafeCodeError for constructs whose run time or effects have no bound
+    """
+    functions = {node.name: node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.While):
+            raise UnsafeCodeError("while loops are not allowed in plot code")
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            names = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module or ""]
+            for name in names:
+                if name.split(".")[0] in FORBIDDEN_MODULES:
+                    raise UnsafeCodeError("importing %s is not allowed in plot code" % name)
+        if isinstance(node, ast.Call):
+            name = _call_name(node)
+            if isinstance(node.func, ast.Name) and name in FORBIDDEN_CALLS:
+                raise UnsafeCodeError("%s() is not allowed in plot code" % name)
+            if name == "range" and any(abs(_constant_int(arg) or 0) > MAX_RANGE for arg in node.args):
+                raise UnsafeCodeError("range() over more than %d items" % MAX_RANGE)
+            if isinstance(node.func, ast.Attribute) and _base_name(node.func) == "itertools" \
+                    and name in ("count", "cycle", "repeat"):
+                raise UnsafeCodeError("itertools.%s() has no end" % name)
+            if isinstance(node.func, ast.Attribute) and _base_name(node.func) == "time" and name == "sleep":
+                raise UnsafeCodeError("time.sleep() is not allowed in plot code")
+    for name, function in functions.items():
+        if any(isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == name
+               for node in ast.walk(function)):
+            raise UnsafeCodeError("recursive function %s" % name)
+
+
+def _is_io(statement):
+    """
+    True for statements reading a file, or calls writing one or showing the figure
+    """
+    if isinstance(statement, (ast.Assign, ast.AnnAssign, ast.AugAssign, ast.Expr)) and statement.value is not None:
+        for node in ast.walk(statement.value):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in READERS:
+                return True
+        value = statement.value
+        if isinstance(statement, ast.Expr) and isinstance(value, ast.Call) and isinstance(value.func, ast.Attribute) \
+                and value.func.attr in WRITERS:
+            return True
+    return False
+
+
+class _StripIO(ast.NodeTransformer):
+    def __init__(self):
+        self.stripped = 0
+
+    def _body(self, statements):
+        kept = []
+        for statement in statements:
+            if _is_io(statement):
+                self.stripped += 1
+                continue
+            kept.append(self.visit(statement))
+        return kept
+
+    def generic_visit(self, node):
+        for field in ("body", "orelse", "finalbody"):
+            statements = getattr(node, field, None)
+            if isinstance(statements, list) and statements and isinstance(statements[0], ast.stmt):
+                kept = self._body(statements)
+                # A block left empty still needs a statement
+                setattr(node, field, kept or ([ast.Pass()] if field == "body" else []))
+        for handler in getattr(node, "handlers", []):
+            self.generic_visit(handler)
+        return node
+
+
+def _vectorizable(node, usable):
+    """
+    True when node is arithmetic or a single comparison over constants and nodes usable() accepts
+    """
+    if usable(node):
+        return True
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, (int, float)) and not isinstance(node.value, bool)
+    if isinstance(node, ast.BinOp):
+        return isinstance(node.op, _ARITHMETIC) and _vectorizable(node.left, usable) and _vectorizable(node.right, usable)
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, (ast.USub, ast.UAdd)) and _vectorizable(node.operand, usable)
+    if isinstance(node, ast.Compare):
+        return len(node.ops) == 1 and not isinstance(node.ops[0], (ast.Is, ast.IsNot, ast.In, ast.NotIn)) \
+            and _vectorizable(node.left, usable) and _vectorizable(node.comparators[0], usable)
+    return False
+
+
+def _row_column(node, row):
+    # "col" for row["col"]
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == row \
+            and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str):
+        return node.slice.value
+    return None
+
+
+def _uses_only_columns(tree, row):
+    # row appears only as row["col"] reads
+    columns = []
+    for node in ast.walk(tree):
+        column = _row_column(node, row)
+        if column is not None:
+            if not isinstance(node.ctx, ast.Load):
+                return None
+            if column not in columns:
+                columns.append(column)
+    allowed = {id(node.value) for node in ast.walk(tree) if _row_column(node, row) is not None}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == row and id(node) not in allowed:
+            return None
+    return columns
+
+
+def _formats(tree, row):
+    # True when a row["col"] value ends up in an f-string, str(), repr(), format() or % formatting
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FormattedValue) or (isinstance(node, ast.Call) and _call_name(node) in _FORMATTING) \
+                or (isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mod) and isinstance(node.left, ast.Constant)
+                    and isinstance(node.left.value, str)):
+            if any(_row_column(n, row) is not None for n in ast.walk(node)):
+                return True
+    return False
+
+
+def _known_numeric(tree, numeric):
+    """
+    The columns of numeric the code does not assign, so they still have their dtype from the
+    datasets when the code runs
+    """
+    known = set(numeric or ())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and not isinstance(node.ctx, ast.Load):
+            known.discard(node.attr)
+        if isinstance(node, ast.Subscript) and not isinstance(node.ctx, ast.Load):
+            known.difference_update(n.value for n in ast.walk(node.slice) if isinstance(n, ast.Constant))
+    return known
+
+
+def _retyped_names(tree):
+    # Names bound to a converted or newly built frame (df = df.astype(...)), and the names bound from those
+    names = set()
+    changed = True
+    while changed:
+        changed = False
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Assign):
+                continue
+            if any(isinstance(n, ast.Call) and _call_name(n) in _RETYPING for n in ast.walk(node.value)) \
+                    or any(isinstance(n, ast.Name) and n.id in names for n in ast.walk(node.value)):
+                for target in node.targets:
+                    # df["a"] = ... changes one column, which _known_numeric leaves out
+                    for n in (target.elts if isinstance(target, (ast.Tuple, ast.List)) else [target]):
+                        if isinstance(n, ast.Name) and n.id not in names:
+                            names.add(n.id)
+                            changed = True
+    return names
+
+
+class _Substitute(ast.NodeTransformer):
+    def __init__(self, replace):
+        self.replace = replace
+
+    def visit(self, node):
+        replacement = self.replace(node)
+        if replacement is not None:
+            return copy.deepcopy(replacement)
+        return super().visit(node)
+
+
+class _Vectorize(ast.NodeTransformer):
+    """
+    Rewrites arithmetic apply/map lambdas and iterrows loops
+    """
+
+    def __init__(self, grouped, taken, numeric, retyped):
+        self.grouped = grouped
+        self.retyped = retyped
+        self.taken = taken
+        self.numeric = numeric
+        self.rewrites = []
+
+    def _fresh(self, prefix):
+        i = 0
+        while "%s%d" % (prefix, i) in self.taken:
+            i += 1
+        name = "%s%d" % (prefix, i)
+        self.taken.add(name)
+        return name
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if not (isinstance(func, ast.Attribute) and func.attr in ("apply", "map") and len(node.args) == 1
+                and isinstance(node.args[0], ast.Lambda)):
+            return node
+        target = func.value
+        base = _base_name(target)
+        if base is None or base in self.grouped or base in self.retyped:
+            return node
+        lam = node.args[0]
+        if len(lam.args.args) != 1 or lam.args.defaults or lam.args.vararg or lam.args.kwarg:
+            return node
+        param = lam.args.args[0].arg
+        keywords = {kw.arg: kw.value for kw in node.keywords}
+
+        if func.attr == "apply" and set(keywords) == {"axis"} and isinstance(keywords["axis"], ast.Constant) \
+                and keywords["axis"].value in (1, "columns"):
+            # Row-wise: row["col"] becomes target["col"]
+            columns = _uses_only_columns(lam.body, param)
+            if not columns or not set(columns) <= self.numeric or \
+                    not _vectorizable(lam.body, lambda n: _row_column(n, param) is not None):
+                return node
+            replaced = _Substitute(lambda n: ast.Subscript(value=target, slice=n.slice, ctx=ast.Load())
+                                   if _row_column(n, param) is not None else None).visit(copy.deepcopy(lam.body))
+            self.rewrites.append("rowwise_apply")
+            return replaced
+
+        if keywords or _column(target) not in self.numeric \
+                or not any(isinstance(n, ast.Name) and n.id == param for n in ast.walk(lam.body)):
+            return node
+        if not _vectorizable(lam.body, lambda n: isinstance(n, ast.Name) and n.id == param):
+            return node
+        replaced = _Substitute(lambda n: target if isinstance(n, ast.Name) and n.id == param else None)
+        self.rewrites.append(func.attr + "_lambda")
+        return replaced.visit(copy.deepcopy(lam.body))
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        it = node.iter
+        if not (isinstance(it, ast.Call) and isinstance(it.func, ast.Attribute) and it.func.attr == "iterrows"
+                and not it.args and not it.keywords and isinstance(it.func.value, ast.Name)
+                and isinstance(node.target, ast.Tuple) and len(node.target.elts) == 2
+                and all(isinstance(e, ast.Name) for e in node.target.elts) and not node.orelse):
+            return node
+        frame = it.func.value.id
+        index, row = node.target.elts[0].id, node.target.elts[1].id
+        body = ast.Module(body=node.body, type_ignores=[])
+        columns = _uses_only_columns(body, row)
+        if columns is None or index == row or _formats(body, row):
+            return node
+        # The loop must not write to the frame it walks
+        for n in ast.walk(body):
+            if isinstance(n, (ast.Subscript, ast.Attribute, ast.Name)) and not isinstance(n.ctx, ast.Load) \
+                    and (_base_name(n) == frame):
+                return node
+        names = {column: self._fresh("_col") for column in columns}
+        new_body = [_Substitute(lambda n: ast.Name(id=names[_row_column(n, row)], ctx=ast.Load())
+                                if _row_column(n, row) is not None else None).visit(statement)
+                    for statement in node.body]
+        node.target = ast.Tuple(elts=[ast.Name(id=index, ctx=ast.Store())] +
+                                [ast.Name(id=names[c], ctx=ast.Store()) for c in columns], ctx=ast.Store())
+        node.iter = ast.Call(func=ast.Name(id="zip", ctx=ast.Load()),
+                             args=[ast.Attribute(value=ast.Name(id=frame, ctx=ast.Load()), attr="index", ctx=ast.Load())] +
+                             [ast.Subscript(value=ast.Name(id=frame, ctx=ast.Load()), slice=ast.Constant(c),
+                                            ctx=ast.Load()) for c in columns], keywords=[])
+        node.body = new_body
+        self.rewrites.append("iterrows")
+        return node
+
+
+def _is_constant(node):
+    if isinstance(node, ast.Constant):
+        return True
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return all(_is_constant(e) for e in node.elts)
+    return False
+
+
+def _groupby_calls(statement):
+    """
+    The df.groupby(<constants>) calls that run whenever the statement runs, with whether they sit in
+    a loop. Calls under if/try/and/or or in nested functions and lambdas may not run and are left alone.
+    """
+    found = []
+    stack = [(statement, False)]
+    while stack:
+        node, in_loop = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef, ast.If, ast.IfExp,
+                             ast.Try, ast.BoolOp, ast.While)):
+            continue
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "groupby" \
+                and isinstance(node.func.value, ast.Name) and all(_is_constant(a) for a in node.args) \
+                and all(_is_constant(kw.value) for kw in node.keywords):
+            found.append((node, in_loop))
+        if isinstance(node, ast.For):
+            stack.append((node.iter, in_loop))
+            stack.extend((child, True) for child in node.body)
+            continue
+        stack.extend((child, in_loop) for child in ast.iter_child_nodes(node))
+    return found
+
+
+def _mutates(statement, name, allow_assign=False):
+    """
+    True when the statement may change the object bound to name
+    """
+    if allow_assign and isinstance(statement, ast.Assign):
+        # The value is evaluated before the targets are stored
+        return _mutates(ast.Expr(value=statement.value), name)
+    for node in ast.walk(statement):
+        if isinstance(node, (ast.Name, ast.Subscript, ast.Attribute)) and not isinstance(node.ctx, ast.Load) \
+                and _base_name(node) == name:
+            return True
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and _base_name(node.func.value) == name:
+            if node.func.attr in MUTATING_METHODS and any(kw.arg == "inplace" for kw in node.keywords):
+                return True
+            if node.func.attr in ("insert", "pop", "update"):
+                return True
+        if isinstance(node, ast.NamedExpr) and node.target.id == name:
+            return True
+    return False
+
+
+def _shared_root(node):
+    """
+    The name whose data node evaluates to: df for df, df["a"], df.loc[...], df.values or
+    df.copy(deep=False). None for new objects, e.g. the result of df.groupby() or df.copy().
+    """
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        shallow = node.func.attr == "copy" and (any(not (isinstance(a, ast.Constant) and a.value) for a in node.args) or
+                                                any(kw.arg == "deep" and not (isinstance(kw.value, ast.Constant)
+                                                                              and kw.value.value) for kw in node.keywords))
+        if node.func.attr in _SHARING_METHODS or shallow:
+            return _shared_root(node.func.value)
+        return None
+    if isinstance(node, ast.Attribute) and node.attr in _METADATA:
+        return None
+    if isinstance(node, (ast.Attribute, ast.Subscript)):
+        return _shared_root(node.value)
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _aliases(statements, name):
+    """
+    name and the names it was bound from sharing their data (df = raw or df = raw.copy(deep=False)),
+    any of them changed changes the frame
+    """
+    names = {name}
+    changed = True
+    while changed:
+        changed = False
+        for statement in statements:
+            for node in ast.walk(statement):
+                if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id in names for t in node.targets):
+                    root = _shared_root(node.value)
+                    if root is not None and root not in names:
+                        names.add(root)
+                        changed = True
+    return names
+
+
+def _escapes(statement, names):
+    """
+    True when the statement binds an object sharing data with one of names to another name,
+    puts it in a container or hands it to code that may keep or change it
+    """
+    parents = {id(child): node for node in ast.walk(statement) for child in ast.iter_child_nodes(node)}
+    for node in ast.walk(statement):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id in names:
+            parent = parents.get(id(node))
+            if isinstance(parent, (ast.Attribute, ast.Subscript)) and parent.value is node:
+                continue
+            if isinstance(parent, ast.Call) and isinstance(parent.func, ast.Name) and parent.func.id in _READING_CALLS:
+                continue
+            if isinstance(parent, (ast.Assign, ast.NamedExpr)) and _bound_to(parent, names):
+                continue
+            return True
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "pipe" \
+                and _shared_root(node.func.value) in names:
+            return True
+        if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign, ast.NamedExpr)) and node.value is not None \
+                and _shared_root(node.value) in names and not _bound_to(node, names):
+            return True
+        if isinstance(node, (ast.For, ast.comprehension)) and _shared_root(node.iter) in names and (
+                (isinstance(node.iter, ast.Attribute) and node.iter.attr in ("values", "array")) or
+                (isinstance(node.iter, ast.Call) and _call_name(node.iter) in _SHARING_METHODS)):
+            # for values in df.values: the rows are views of the frame
+            return True
+    return False
+
+
+def _bound_to(assign, names):
+    # True when every target of the assignment is one of names
+    targets = assign.targets if isinstance(assign, ast.Assign) else [assign.target]
+    return all(isinstance(t, ast.Name) and t.id in names for t in targets)
+
+
+def _hoist_groupby(module, taken, rewrites):
+    """
+    Builds a groupby that top-level statements build repeatedly (in several statements or
+    in a loop) once, before the first of them
+    """
+    uses = {}
+    for i, statement in enumerate(module.body):
+        for call, in_loop in _groupby_calls(statement):
+            uses.setdefault(ast.dump(call), []).append((i, call, in_loop))
+    inserts = []
+    for key, calls in uses.items():
+        statements = sorted({i for i, _, _ in calls})
+        if len(statements) < 2 and not any(in_loop for _, _, in_loop in calls):
+            continue
+        first, last = statements[0], statements[-1]
+        frame = calls[0][1].func.value.id
+        names = _aliases(module.body[:last + 1], frame)
+        if any(_escapes(module.body[i], names) for i in range(last + 1)):
+            continue
+        if any(_mutates(module.body[i], name, allow_assign=(i == last and first != last and name == frame))
+               for i in range(first, last + 1) for name in names):
+            continue
+        i = 0
+        while "_grouped%d" % i in taken:
+            i += 1
+        name = "_grouped%d" % i
+        taken.add(name)
+        inserts.append((first, ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())], value=calls[0][1])))
+        ids = {id(call) for _, call, _ in calls}
+        for index in statements:
+            module.body[index] = _Substitute(lambda n: ast.Name(id=name, ctx=ast.Load()) if id(n) in ids else None) \
+                .visit(module.body[index])
+        rewrites.append("groupby_once")
+    for first, assign in sorted(inserts, key=lambda x: x[0], reverse=True):
+        module.body.insert(first, assign)
+
+
+def _grouped_names(tree):
+    # Names bound to groupby/rolling/resample objects, whose apply is not element-wise
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and any(isinstance(n, ast.Call) and _call_name(n) in _GROUPED
+                                                for n in ast.walk(node.value)):
+            names.update(t.id for t in node.targets if isinstance(t, ast.Name))
+    return names
+
+
+def strip_io(code):
+    """
+    The code without file reads, file writes and show() calls, raises SyntaxError if it does not parse
+    """
+    tree = ast.parse(code)
+    _StripIO().visit(tree)
+    return ast.unparse(tree)
+
+
+def optimize_code(code, numeric=None):
+    """
+    Returns the optimized, normalized code and the list of rewrites applied.
+    numeric holds the names of the columns that are numeric in the datasets the code runs on
+    (profiling.numeric_columns), without it no apply or map is vectorized.
+    Raises SyntaxError when the code does not parse and UnsafeCodeError when it is rejected.
+    """
+    tree = ast.parse(code)
+    _check(tree)
+    rewrites = []
+    stripper = _StripIO()
+    stripper.visit(tree)
+    rewrites.extend(["strip_io"] * stripper.stripped)
+    taken = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+    vectorize = _Vectorize(_grouped_names(tree), taken, _known_numeric(tree, numeric), _retyped_names(tree))
+    vectorize.visit(tree)
+    rewrites.extend(vectorize.rewrites)
+    _hoist_groupby(tree, taken, rewrites)
+    ast.fix_missing_locations(tree)
+    return ast.unparse(tree), rewrites
+
+
+def normalized_code(code):
+    """
+    The optimized code as a cache key, or None when the code does not parse or is rejected
+    """
+    try:
+        return optimize_code(code)[0]
+    except (SyntaxError, UnsafeCodeError):
+        return None
@@ -0,0 +1,157 @@
+"""
+Batch mode for several plots at once. A message starting with "Dashboard:" (one plot per line or
+separated by ";") or holding several "Show:" lines is answered as a grid of plots: the code of
+every plot is requested from ChatGPT concurrently, then the scripts run side by side on the plot
+executor, so the whole dashboard takes about as long as its slowest plot.
+"""
+import os
+import re
+import streamlit as st
+from helpers import format_question, format_response, get_primer, run_requests
+from metrics import span
+from plot_executor import PlotExecutionError
+from plot_templates import template_code
+from profiling import dataset_fingerprint
+from prompt_index import remember_code, similar_code
+from render_cache import PLOT_DPI, PLOT_FORMAT, get_render_cache, render_key, to_image
+
+# ChatGPT requests and plot scripts in flight at once for one dashboard
+DASHBOARD_CONCURRENCY = int(os.environ.get("DATACHAT_DASHBOARD_CONCURRENCY", 4))
+MAX_CHARTS = 8
+GRID_COLUMNS = 2
+
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+
+
+def dashboard_prompts(prompt):
+    """
+    The "Show:" prompts of a batch message, or None when the message is a single prompt
+    """
+    text = prompt.strip()
+    if text.lower().startswith("dashboard:"):
+        parts = re.split(r"[\n;]+", text[len("dashboard:"):])
+    else:
+        parts = [line for line in text.splitlines() if _BULLET.sub("", line).lower().startswith("show:")]
+        if len(parts) < 2:
+            return None
+    charts = []
+    for part in parts:
+        part = _BULLET.sub("", part).strip()
+        if part:
+            charts.append(part if part.lower().startswith("show:") else "Show: " + part)
+    return charts[:MAX_CHARTS] or None
+
+
+class Chart:
+    """
+    One plot of a dashboard: its prompt, the code to run and the rendered image (with its
+    figure metadata) or the error
+    """
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.code = None
+        self.generated = None
+        self.image = None
+        self.reasoning = None
+        self.figure = None
+        self.error = None
+
+
+def _render(charts, executor, datasets, fingerprint, limit):
+    # Submits the scripts to the executor, waiting on the oldest once limit are running
+    cache = get_render_cache()
+    running = []
+
+    def collect(chart, key, job):
+        try:
+            chart.image, chart.reasoning = job.result()
+        except PlotExecutionError as e:
+            chart.error = "Failed to generate plot: " + str(e)
+            return
+        chart.figure = job.figure
+        cache.put(key, chart.image, chart.reasoning, chart.figure)
+
+    for chart in charts:
+        if chart.code is None:
+            continue
+        key = render_key(chart.code, fingerprint)
+        cached = cache.get(key)
+        if cached:
+            chart.image, chart.reasoning = cached
+            chart.figure = cache.figure(key)
+            continue
+        if len(running) >= limit:
+            collect(*running.pop(0))
+        running.append((chart, key, executor.submit(chart.code, datasets, image_format=PLOT_FORMAT, dpi=PLOT_DPI)))
+    for item in running:
+        collect(*item)
+
+
+def build_dashboard(df_dataset, df_name, prompts, key, executor, datasets=None, handoff="copy",
+                    limit=DASHBOARD_CONCURRENCY):
+    """
+    Generates and renders the plots of prompts on one dataset and returns their Chart objects.
+    Templates and similar past prompts answer what they can, the rest go to ChatGPT together.
+    """
+    with span("dashboard", charts=len(prompts)) as s:
+        fingerprint = dataset_fingerprint(df_dataset)
+        charts = [Chart(prompt) for prompt in prompts]
+        questions = {}
+        for chart in charts:
+            primer1, primer2 = get_primer(df_dataset, df_name, handoff, chart.prompt)
+            code = template_code(df_dataset, chart.prompt)
+            if code is None:
+                code = similar_code(df_dataset, chart.prompt)
+            if code is None:
+                questions[chart] = (format_question(primer1, primer2, chart.prompt), primer2)
+            else:
+                chart.code = format_response(primer2 + code)
+
+        if questions:
+            answers = run_requests([q for q, _ in questions.values()], key, fingerprint, limit=limit)
+            for (chart, (_, primer2)), answer in zip(questions.items(), answers):
+                if isinstance(answer, Exception):
+                    chart.error = "ChatGPT failed to generate this plot: " + str(answer)
+                else:
+                    chart.generated = answer
+                    chart.code = format_response(primer2 + answer)
+
+        _render(charts, executor, datasets, fingerprint, limit)
+        for chart in charts:
+            if chart.generated and chart.image:
+                remember_code(df_dataset, chart.prompt, chart.generated)
+        s.set(llm_requests=len(questions), failures=sum(1 for chart in charts if chart.error))
+    return charts
+
+
+def dashboard_message(images, charts):
+    """
+    The chat message of a dashboard, its plots are added to the session's image store
+    """
+    entries = []
+    for chart in charts:
+        if chart.image:
+            entries.append({"prompt": chart.prompt, "image": images.put(chart.image), "reasoning": chart.reasoning})
+        else:
+            entries.append({"prompt": chart.prompt, "error": chart.error or "No plot was generated"})
+    plotted = sum(1 for entry in entries if "image" in entry)
+    content = "A dashboard of %d plots has been created based on your prompt" % plotted
+    if plotted < len(entries):
+        content += " (%d failed)" % (len(entries) - plotted)
+    return {"role": "assistant", "content": content, "dashboard": entries}
+
+
+def show_dashboard(images, entries, full_size=True):
+    """
+    Lays out the plots of a dashboard message as a grid, older dashboards with thumbnails
+    """
+    for row in range(0, len(entries), GRID_COLUMNS):
+        for column, entry in zip(st.columns(GRID_COLUMNS), entries[row:row + GRID_COLUMNS]):
+            with column:
+                if "image" in entry:
+                    data = images.full(entry["image"]) if full_size else images.thumbnail(entry["image"])
+                    st.image(to_image(data, images.image_format), caption=entry["prompt"], use_column_width=True)
+                    st.caption(entry["reasoning"])
+                else:
+                    st.error(entry["prompt"] + ": " + entry["error"])
@@ -0,0 +1,78 @@
+import threading
+from collections.abc import Mapping
+import pandas as pd
+
+# Bundled example datasets
+DATASET_FILES = {
+    "Movies": "movies.csv",
+    "Housing": "housing.csv",
+    "Cars": "cars.csv",
+    "Colleges": "colleges.csv",
+    "Customers & Products": "customers_and_products_contacts.csv",
+    "Department Store": "department_store.csv",
+    "Energy Production": "energy_production.csv",
+}
+
+
+class DatasetRegistry(Mapping):
+    """
+    Read-only, process-wide registry of the bundled datasets. Each CSV is parsed once,
+    on first access, and the same dataframe is then shared by every session.
+    Sessions must not modify these dataframes.
+    """
+
+    def __init__(self, files=DATASET_FILES):
+        self._files = dict(files)
+        self._frames = {}
+        # Bytes held by each loaded dataset. The frames never change, so the deep memory count
+        # (a pass over every string) runs once per dataset instead of on every rerun
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        df = self._frames.get(name)
+        if df is None:
+            path = self._files[name]
+            with self._lock:
+                df = self._frames.get(name)
+                if df is None:
+                    df = pd.read_csv(path)
+                    self._frames[name] = df
+        return df
+
+    def __iter__(self):
+        return iter(self._files)
+
+    def __len__(self):
+        return len(self._files)
+
+    def is_loaded(self, name):
+        return name in self._frames
+
+    def preload(self):
+        for name in self._files:
+            self[name]
+
+    def memory_usage(self):
+        """
+        Bytes held by each loaded dataset (None for datasets not loaded yet)
+        """
+        for name in self._files:
+            if name in self._frames and name not in self._sizes:
+                self._sizes[name] = int(self._frames[name].memory_usage(deep=True).sum())
+        return {name: self._sizes.get(name) for name in self._files}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_dataset_registry():
+    """
+    Returns the registry shared by every session in this process
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DatasetRegistry()
+    return _registry
@@ -0,0 +1,375 @@
+"""
+Reads what a rendered figure shows from its live Axes: the plot type, title, axis labels, series,
+categories, the number of bars, points or bins and the data ranges. The plot workers extract it
+right after savefig and send it back with the image, so "Describe it" can be answered locally from
+the metadata and the reasoning of the code, without sending the code to ChatGPT. Only lists and
+counts the Axes already hold are read (ax.dataLim for the ranges, bar containers for the bar
+values), so figures with thousands of artists are read in a few milliseconds, see
+benchmarks/bench_figure_info.py.
+"""
+import os
+from metrics import traced
+
+LOCAL_DESCRIBE = os.environ.get("DATACHAT_LOCAL_DESCRIBE", "on").lower() not in ("0", "off", "false", "no")
+# Words of a "Describe it" prompt asking for ChatGPT's description instead
+LLM_WORDS = ("chatgpt", "gpt", "llm")
+MAX_AXES = 6
+MAX_SERIES = 8
+MAX_CATEGORIES = 12
+# A bar container with at least this many adjacent bars of one width is a histogram
+HISTOGRAM_BINS = 5
+
+
+def _artists(ax):
+    # The data artists of ax by kind, in one pass: ax.lines, ax.patches and the like filter all
+    # children of the Axes again on every use
+    from matplotlib.collections import Collection
+    from matplotlib.image import AxesImage
+    from matplotlib.lines import Line2D
+    from matplotlib.patches import Patch
+    from matplotlib.spines import Spine
+
+    artists = {"lines": [], "collections": [], "patches": [], "images": []}
+    for artist in ax.get_children():
+        if isinstance(artist, Line2D):
+            artists["lines"].append(artist)
+        elif isinstance(artist, Collection):
+            artists["collections"].append(artist)
+        elif isinstance(artist, Patch) and not isinstance(artist, Spine) and artist is not ax.patch:
+            artists["patches"].append(artist)
+        elif isinstance(artist, AxesImage):
+            artists["images"].append(artist)
+    return artists
+
+
+def identify_plot_type(ax, artists=None):
+    # matplotlib is only imported by the plot workers, see warmup.py
+    from matplotlib.container import BarContainer
+    import matplotlib.collections as mcoll
+    import matplotlib.patches as mpatches
+
+    if artists is None:
+        artists = _artists(ax)
+    kinds = []
+    if any(isinstance(patch, mpatches.Wedge) for patch in artists["patches"]):
+        kinds.append("Pie Chart")
+    if artists["images"] or any(isinstance(c, mcoll.QuadMesh) for c in artists["collections"]):
+        kinds.append("Heatmap")
+    bars = [c for c in ax.containers if isinstance(c, BarContainer)]
+    if bars:
+        if _is_histogram(bars[0]):
+            kinds.append("Histogram")
+        elif bars[0].orientation == "horizontal":
+            kinds.append("Horizontal Bar Plot")
+        else:
+            kinds.append("Bar Plot")
+    elif any(isinstance(patch, mpatches.Rectangle) for patch in artists["patches"]):
+        kinds.append("Bar Plot")
+    for collection in artists["collections"]:
+        if isinstance(collection, mcoll.PolyCollection) and collection.get_array() is not None:
+            kind = "Hexbin Plot"
+        elif isinstance(collection, mcoll.PolyCollection):
+            kind = "Area Plot"
+        elif isinstance(collection, mcoll.PathCollection):
+            kind = "Scatter Plot"
+        else:
+            continue
+        if kind not in kinds:
+            kinds.append(kind)
+    for line in artists["lines"]:
+        # ax.plot(x, y, "o") draws markers only
+        kind = "Scatter Plot" if line.get_linestyle() in ("None", "") else "Line Plot"
+        if kind not in kinds:
+            kinds.append(kind)
+    return " and ".join(kinds) or "Unknown Plot Type"
+
+
+def _is_histogram(container):
+    import numpy as np
+
+    patches = container.patches
+    if len(patches) < HISTOGRAM_BINS or container.orientation != "vertical":
+        return False
+    x = np.array([patch.get_x() for patch in patches])
+    width = np.array([patch.get_width() for patch in patches])
+    order = np.argsort(x)
+    x, width = x[order], width[order]
+    return bool(np.allclose(x[:-1] + width[:-1], x[1:]) and np.allclose(width, width[0]))
+
+
+def _labels(artists):
+    # Labels the legend would show, artists without one are named "_child0" and the like
+    return [str(label) for label in (artist.get_label() for artist in artists)
+            if label and not str(label).startswith("_")]
+
+
+def _categories(axis):
+    # Positions and names of the categories of a text axis, None for a numeric or date axis.
+    # Read from the axis units or the fixed tick labels, generating the ticks of thousands of
+    # categories would take longer than the rest of the figure.
+    from matplotlib.category import UnitData
+    import matplotlib.ticker as mticker
+
+    if isinstance(axis.units, UnitData):
+        mapping = axis.units._mapping
+        return list(mapping.values()), [str(name) for name in mapping]
+    # set_xticklabels (and pandas' bar plots) fix the ticks and label them by position
+    formatter, locator = axis.get_major_formatter(), axis.get_major_locator()
+    if not isinstance(formatter, (mticker.FixedFormatter, mticker.FuncFormatter)) or \
+            not isinstance(locator, mticker.FixedLocator):
+        return None
+    names = [str(formatter(loc, i)) for i, loc in enumerate(locator.locs)]
+    for name in names:
+        try:
+            float(name.replace("−", "-").replace(",", ""))
+        except ValueError:
+            return list(locator.locs), names
+    return None
+
+
+def _value_format(ax, axis):
+    # How a data value of axis reads: a date for date axes, None for plain numbers
+    import matplotlib.dates as mdates
+
+    formatter = axis.get_major_formatter()
+    if isinstance(formatter, (mdates.AutoDateFormatter, mdates.DateFormatter, mdates.ConciseDateFormatter)):
+        return lambda value: mdates.num2date(value).date().isoformat()
+    if type(formatter).__name__ == "TimeSeries_DateFormatter" and getattr(ax, "freq", None) is not None:
+        # pandas plots a regular time series against period ordinals
+        import pandas as pd
+        return lambda value: str(pd.Period(ordinal=int(round(value)), freq=ax.freq))
+    return None
+
+
+def _value(value, value_format=None):
+    value = float(value)
+    if value_format is not None:
+        try:
+            return value_format(value)
+        except (ValueError, OverflowError):
+            pass
+    return value
+
+
+def _bar_labels(ax, container, centers):
+    # The category of each bar: the tick label at its position
+    import numpy as np
+
+    categories = _categories(ax.yaxis if container.orientation == "horizontal" else ax.xaxis)
+    if not categories or not categories[0]:
+        return None
+    ticks, texts = np.asarray(categories[0], dtype=float), categories[1]
+    order = np.argsort(ticks)
+    ticks = ticks[order]
+    right = np.clip(np.searchsorted(ticks, centers), 1, max(len(ticks) - 1, 1))
+    left = right - 1
+    nearest = np.where(np.abs(centers - ticks[left]) <= np.abs(centers - ticks[np.minimum(right, len(ticks) - 1)]),
+                       left, right)
+    nearest = np.clip(nearest, 0, len(ticks) - 1)
+    return [texts[order[i]] for i in nearest]
+
+
+def _bars(ax, containers, histogram):
+    import numpy as np
+
+    info = {"bars": sum(len(c.patches) for c in containers), "bar_groups": len(containers)}
+    container = containers[0]
+    horizontal = container.orientation == "horizontal"
+    values = np.asarray(container.datavalues, dtype=float)
+    if not len(values) or np.isnan(values).all():
+        return info
+    if histogram:
+        edges = [patch.get_x() for patch in container.patches]
+        info["bins"] = len(container.patches)
+        info["bin_range"] = [_value(min(edges)), _value(max(edges) + container.patches[-1].get_width())]
+        return info
+    if horizontal:
+        centers = np.array([patch.get_y() + patch.get_height() / 2 for patch in container.patches])
+    else:
+        centers = np.array([patch.get_x() + patch.get_width() / 2 for patch in container.patches])
+    labels = _bar_labels(ax, container, centers)
+    high, low = int(np.nanargmax(values)), int(np.nanargmin(values))
+    info["highest"] = [labels[high] if labels else None, _value(values[high])]
+    info["lowest"] = [labels[low] if labels else None, _value(values[low])]
+    return info
+
+
+def _pie(wedges):
+    slices = []
+    for wedge in wedges:
+        slices.append([str(wedge.get_label()), round((wedge.theta2 - wedge.theta1) / 3.6, 1)])
+    slices.sort(key=lambda s: -s[1])
+    return {"slices": len(slices), "largest": slices[:MAX_CATEGORIES]}
+
+
+def _lines(lines, x_format):
+    import numpy as np
+
+    points = sum(len(line.get_xdata()) for line in lines)
+    peaks = []
+    for line in lines[:MAX_SERIES]:
+        xy = np.asarray(line.get_xydata(), dtype=float)
+        if not len(xy) or np.isnan(xy[:, 1]).all():
+            continue
+        high = int(np.nanargmax(xy[:, 1]))
+        peaks.append([str(line.get_label()), _value(xy[high, 0], x_format), _value(xy[high, 1])])
+    return {"lines": len(lines), "points": points, "peaks": peaks}
+
+
+def _axes_metadata(ax):
+    import matplotlib.collections as mcoll
+    import matplotlib.patches as mpatches
+    from matplotlib.container import BarContainer
+
+    artists = _artists(ax)
+    info = {"plot_type": identify_plot_type(ax, artists), "title": ax.get_title(), "xlabel": ax.get_xlabel(),
+            "ylabel": ax.get_ylabel(), "artists": sum(len(group) for group in artists.values())}
+    series = _labels(artists["lines"]) + _labels(artists["collections"]) + _labels(ax.containers)
+    info["series_count"] = len(series)
+    info["series"] = series[:MAX_SERIES]
+
+    x_format, y_format = _value_format(ax, ax.xaxis), _value_format(ax, ax.yaxis)
+    for name, axis in (("x", ax.xaxis), ("y", ax.yaxis)):
+        categories = _categories(axis)
+        if categories and categories[1]:
+            info[name + "_categories"] = categories[1][:MAX_CATEGORIES]
+            info[name + "_category_count"] = len(categories[1])
+
+    limits = ax.dataLim
+    if limits.width >= 0 and limits.height >= 0 and not info.get("x_categories"):
+        info["x_range"] = [_value(limits.x0, x_format), _value(limits.x1, x_format)]
+    if limits.width >= 0 and limits.height >= 0 and not info.get("y_categories"):
+        info["y_range"] = [_value(limits.y0, y_format), _value(limits.y1, y_format)]
+
+    bars = [c for c in ax.containers if isinstance(c, BarContainer)]
+    if bars:
+        info.update(_bars(ax, bars, info["plot_type"].startswith("Histogram")))
+    wedges = [patch for patch in artists["patches"] if isinstance(patch, mpatches.Wedge)]
+    if wedges:
+        info.update(_pie(wedges))
+        info.pop("x_range", None)
+        info.pop("y_range", None)
+    if artists["lines"]:
+        info.update(_lines(artists["lines"], x_format))
+    scatter = [c for c in artists["collections"] if isinstance(c, mcoll.PathCollection)]
+    if scatter:
+        info["scatter_points"] = sum(len(c.get_offsets()) for c in scatter)
+    if artists["images"]:
+        info["grid"] = list(artists["images"][0].get_array().shape[:2])
+    return info
+
+
+def figure_metadata(fig):
+    """
+    What the figure shows, as a dict of plain values that pickles small: its suptitle and per
+    plot (up to MAX_AXES, colorbars left out) the plot type, labels, series, categories,
+    counts and data ranges. The workers read it after savefig, before closing the figure.
+    """
+    axes = [ax for ax in fig.axes if ax.get_label() != "<colorbar>" and ax.has_data()]
+    suptitle = fig._suptitle.get_text() if getattr(fig, "_suptitle", None) is not None else ""
+    return {"suptitle": suptitle, "plots": len(axes), "axes": [_axes_metadata(ax) for ax in axes[:MAX_AXES]]}
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if abs(value) >= 1000:
+        return "{:,.0f}".format(value)
+    return "%.3g" % value
+
+
+def _listing(items, count):
+    text = ", ".join(str(item) for item in items)
+    if count > len(items):
+        text += " and %d more" % (count - len(items))
+    return text
+
+
+def _axis_text(info, name):
+    label = " ".join(info[name + "label"].split())
+    text = "the %s axis " % name + ("shows " + label if label else "has")
+    if info.get(name + "_categories"):
+        count = info[name + "_category_count"]
+        text += "%s%d categories (%s)" % (" in " if label else " ", count, _listing(info[name + "_categories"], count))
+    elif info.get(name + "_range"):
+        low, high = info[name + "_range"]
+        text += (" " if label else " values ") + "from %s to %s" % (_number(low), _number(high))
+    return text
+
+
+def _describe_axes(info):
+    sentences = []
+    plot_type = info["plot_type"].lower() if info["plot_type"] != "Unknown Plot Type" else "plot"
+    opening = "a " + plot_type
+    if info["title"]:
+        opening += ' titled "%s"' % info["title"]
+    sentences.append(opening)
+
+    if "slices" in info:
+        largest = ", ".join("%s (%s%%)" % (label, _number(share)) for label, share in info["largest"])
+        sentences.append("It has %d slices: %s." % (info["slices"], largest))
+    else:
+        x_text = _axis_text(info, "x")
+        sentences.append(x_text[0].upper() + x_text[1:] + " and " + _axis_text(info, "y") + ".")
+
+    if "bins" in info:
+        low, high = info["bin_range"]
+        sentences.append("The values are counted in %d bins from %s to %s." % (info["bins"], _number(low),
+                                                                               _number(high)))
+    elif "bars" in info:
+        text = "There are %d bars" % info["bars"]
+        if info["bar_groups"] > 1:
+            text += " in %d groups" % info["bar_groups"]
+        if "highest" in info:
+            high, low = info["highest"], info["lowest"]
+            text += ", the highest is %s%s and the lowest %s%s" % (
+                high[0] + " at " if high[0] else "", _number(high[1]),
+                low[0] + " at " if low[0] else "", _number(low[1]))
+        sentences.append(text + ".")
+    if "lines" in info:
+        text = "There %s %d line%s with %s points in total" % ("is" if info["lines"] == 1 else "are", info["lines"],
+                                                             "" if info["lines"] == 1 else "s",
+                                                             "{:,}".format(info["points"]))
+        if len(info["peaks"]) == 1:
+            _, x, y = info["peaks"][0]
+            text += ", peaking at %s where x is %s" % (_number(y), _number(x))
+        sentences.append(text + ".")
+    if "scatter_points" in info:
+        sentences.append("It shows %s points." % "{:,}".format(info["scatter_points"]))
+    if "grid" in info:
+        sentences.append("The grid has %d rows and %d columns." % tuple(info["grid"]))
+    if info["series_count"] > 1:
+        sentences.append("The series are %s." % _listing(info["series"], info["series_count"]))
+    return sentences
+
+
+@traced("describe_figure")
+def describe_figure(figure, reasoning=""):
+    """
+    A description of the plot made from the figure_metadata dict, followed by the reasoning
+    the generated code gave for it
+    """
+    parts = []
+    axes = figure["axes"]
+    if len(axes) == 1:
+        sentences = _describe_axes(axes[0])
+        parts.append("This plot shows " + sentences[0] + ". " + " ".join(sentences[1:]))
+    else:
+        parts.append("This figure has %d plots" % figure["plots"] +
+                     (' under the title "%s".' % figure["suptitle"] if figure["suptitle"] else "."))
+        for n, info in enumerate(axes, 1):
+            sentences = _describe_axes(info)
+            parts.append("Plot %d is %s. %s" % (n, sentences[0], " ".join(sentences[1:])))
+    text = " ".join(part.strip() for part in parts)
+    if reasoning:
+        text += "\n\n" + reasoning
+    return text
+
+
+def wants_llm_description(prompt, figure):
+    """
+    Whether a "Describe it" prompt goes to ChatGPT: when it asks for ChatGPT by name, when local
+    descriptions are turned off (DATACHAT_LOCAL_DESCRIBE) or when no figure metadata is at hand
+    """
+    words = prompt.lower()
+    return not LOCAL_DESCRIBE or not figure or not figure["axes"] or any(word in words for word in LLM_WORDS)
@@ -0,0 +1,8 @@
+"""
+Streamlit fragments for the parts of the page that rerun on their own (the chat history and the
+dataset preview). st.fragment is st.experimental_fragment before Streamlit 1.37; older versions
+have neither, and the decorated function then runs as part of the whole script.
+"""
+import streamlit as st
+
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
@@ -1,36 +1,87 @@
+import asyncio
 import random
-import matplotlib.pyplot as plt
 import io
-import openai
-from matplotlib.lines import Line2D
-import matplotlib.collections as mcoll
-import matplotlib.lines as mlines
-import matplotlib.patches as mpatches
-
-def identify_plot_type(ax):
-    for item in ax.get_children():
-        if isinstance(item, Line2D):
-            return "Line Plot"
-        elif isinstance(item, mcoll.PathCollection):
-            return 'Scatter Plot'
-        elif isinstance(item, mpatches.Wedge):
-            return 'Pie Chart'
-        elif isinstance(item, mpatches.Rectangle):
-            return 'Bar Plot'
-    return "Unknown Plot Type"
-
+from profiling import get_profile, describe_columns
+from llm_cache import get_response_cache
+from llm_client import get_client
+from reduction import primer_hint
+from metrics import annotate, span, traced
+from code_optimizer import strip_io
+from prompt_budget import PRIMER_TOKEN_BUDGET, HEAD_COLUMNS, budget_columns, compact_head, count_tokens, rank_columns
+from figure_info import identify_plot_type
+
+def chat_completion(task, prompt, key, fingerprint="", use_cache=True, model="gpt-4", stream=False, stage="llm"):
+    """
+    Sends the system task and user prompt to the chatgpt api.
+    Responses are cached on disk under model, task, prompt and dataset fingerprint,
+    pass use_cache=False to always call the api.
+    With stream=True a generator of text chunks is returned instead of the full response.
+    Each call is traced as a span named stage, with the model, cache status and token usage.
+    """
+    client = get_client(key, model)
+    if stream:
+        return _stream_completion(client, task, prompt, fingerprint, use_cache, stage)
+
+    with span(stage, model=model, cache="bypass") as s:
+        cache = get_response_cache()
+        if use_cache and cache.enabled:
+            cached = cache.get(model, task, prompt, fingerprint)
+            if cached is not None:
+                s.set(cache="hit")
+                return cached
+            s.set(cache="miss")
+
+        llm_response = client.complete(task, prompt)
+
+        if use_cache:
+            cache.put(model, task, prompt, llm_response, fingerprint)
+        return llm_response
+
+
+def _stream_completion(client, task, prompt, fingerprint, use_cache, stage="llm"):
+    # A cache hit comes back as a single chunk, a miss is cached once fully streamed
+    with span(stage, model=client.model, cache="bypass", stream=True) as s:
+        cache = get_response_cache()
+        if use_cache and cache.enabled:
+            cached = cache.get(client.model, task, prompt, fingerprint)
+            if cached is not None:
+                s.set(cache="hit")
+                yield cached
+                return
+            s.set(cache="miss")
+
+        chunks = []
+        for chunk in client.stream(task, prompt):
+            chunks.append(chunk)
+            yield chunk
+
+        if use_cache:
+            cache.put(client.model, task, prompt, "".join(chunks), fingerprint)
+
+
+async def achat_completion(task, prompt, key, fingerprint="", use_cache=True, model="gpt-4", stage="llm"):
+    """
+    asyncio version of chat_completion, for sending several requests concurrently
+    """
+    with span(stage, model=model, cache="bypass") as s:
+        cache = get_response_cache()
+        if use_cache and cache.enabled:
+            cached = cache.get(model, task, prompt, fingerprint)
+            if cached is not None:
+                s.set(cache="hit")
+                return cached
+            s.set(cache="miss")
 
-# function that simply sends user's prompt to the chatgpt api and returns the response
-def ask_gpt(task, prompt, key):
-    openai.api_key = key
-    model = "gpt-4"
+        llm_response = await get_client(key, model).acomplete(task, prompt)
 
-    response = openai.ChatCompletion.create(model=model,
-        messages=[{"role":"system","content":task},{"role":"user","content":prompt}])
+        if use_cache:
+            cache.put(model, task, prompt, llm_response, fingerprint)
+        return llm_response
 
-    llm_response = response["choices"][0]["message"]["content"]
 
-    return llm_response
+# function that simply sends user's prompt to the chatgpt api and returns the response
+def ask_gpt(task, prompt, key, fingerprint="", use_cache=True, stream=False):
+    return chat_completion(task, prompt, key, fingerprint, use_cache, stream=stream, stage="llm_chat")
 
 
 def simulate_chatgpt_response(user_message):
@@ -82,7 +133,7 @@ def simulate_chatgpt_response(user_message):
 #     return buf
 
 
-def run_request(question_to_ask, key):
+def run_request(question_to_ask, key, fingerprint="", use_cache=True, stream=False):
     """
     This function sends the user prompt input to the chatgpt-4 api
     retrieves back the python code to generate the plot 
@@ -93,15 +144,45 @@ def run_request(question_to_ask, key):
     # Ensure GPT-4 does not include additional comments
     task = task + " The script should only include code, no comments."
 
-    openai.api_key = key
+    return chat_completion(task, question_to_ask, key, fingerprint, use_cache, stream=stream, stage="llm_code")
+
+
+async def arun_request(question_to_ask, key, fingerprint="", use_cache=True):
+    """
+    asyncio version of run_request, for generating several plots concurrently
+    """
+    task = "Generate Python Code Script."
+    task = task + " The script should only include code, no comments."
+
+    return await achat_completion(task, question_to_ask, key, fingerprint, use_cache, stage="llm_code")
 
-    response = openai.ChatCompletion.create(model="gpt-4",
-        messages=[{"role":"system","content":task},{"role":"user","content":question_to_ask}])
-    llm_response = response["choices"][0]["message"]["content"]
 
-    return llm_response
+def run_requests(questions, key, fingerprint="", use_cache=True, limit=4):
+    """
+    Sends several code requests concurrently over one aiohttp session, at most limit at a time.
+    Blocks until all are answered, the answers come back in order and a failed request
+    returns its exception instead of a string.
+    """
+    import aiohttp
+    import openai
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(limit)
 
-def describe_plot(plot_code, key):
+        async def run(question):
+            async with semaphore:
+                return await arun_request(question, key, fingerprint, use_cache)
+
+        async with aiohttp.ClientSession() as session:
+            token = openai.aiosession.set(session)
+            try:
+                return await asyncio.gather(*(run(q) for q in questions), return_exceptions=True)
+            finally:
+                openai.aiosession.reset(token)
+
+    return asyncio.run(run_all())
+
+def describe_plot(plot_code, key, use_cache=True, stream=False):
     """
     Describes the plot by sending the code response to generate the plot back to chatgpt 
     """
@@ -112,18 +193,14 @@ def describe_plot(plot_code, key):
     Do not talk about the aspect of the code and only the plot itself. Keep the description short. 
     """
 
-    model = "gpt-4"
-    openai.api_key = key
-
-    response = openai.ChatCompletion.create(model=model,
-        messages=[{"role":"system","content":task},{"role":"user","content":plot_code}])
-    llm_response = response["choices"][0]["message"]["content"]
-
-    return llm_response
+    # The plot code already embeds the dataset reference, so it is a sufficient cache key
+    return chat_completion(task, plot_code, key, use_cache=use_cache, stream=stream, stage="llm_describe")
 
-def describe_dataset(df_dataset):
+@traced("describe_dataset")
+def describe_dataset(df_dataset, question="", budget=PRIMER_TOKEN_BUDGET):
     """
     This function takes a dataframe and returns a description of the dataset
+    Wide datasets are compacted to the token budget, keeping the columns most relevant to question
     """
     desc = """
     I built a natural language to data visualization chatbot using openai api. Now to help users explore the dataset and suggest 
@@ -132,14 +209,20 @@ def describe_dataset(df_dataset):
     the suggested prompts. 
     """
 
-    for i in df_dataset.columns:
-        if len(df_dataset[i].drop_duplicates()) < 20 and df_dataset.dtypes[i]=="O":
-            desc = desc + "\nThe column '" + i + "' has categorical values '" + \
-                "','".join(str(x) for x in df_dataset[i].drop_duplicates()) + "'. "
-        elif df_dataset.dtypes[i]=="int64" or df_dataset.dtypes[i]=="float64":
-            desc = desc + "\nThe column '" + i + "' is type " + str(df_dataset.dtypes[i]) + " and contains numeric values. "
+    profile = get_profile(df_dataset)
+    full_columns = describe_columns(profile)
+    head = profile["head"]
+    budget = budget - count_tokens(desc)
+    if count_tokens(full_columns) + count_tokens(head) > budget:
+        head = compact_head(df_dataset, [col["name"] for col in rank_columns(profile, question)[:HEAD_COLUMNS]])
+    _, columns, report = budget_columns(profile, question, budget - count_tokens(head), "", full_columns)
+    report["budget_tokens"] += count_tokens(head)
+    report["unbudgeted_tokens"] += count_tokens(profile["head"])
+    report["tokens_saved"] = report["unbudgeted_tokens"] - report["budget_tokens"]
+    annotate(**report)
+    desc = desc + columns
     
-    desc += "\n\nHead of the dataset:\n" + df_dataset.head().to_string()
+    desc += "\n\nHead of the dataset:\n" + head
     desc += "\n\nUser input:"
     
     return desc
@@ -147,8 +230,13 @@ def describe_dataset(df_dataset):
 
 def format_response(res):
     """
-    Remove the load_csv from the answer if it exists
+    Remove the load_csv from the answer if it exists, along with other file I/O and plt.show().
+    Answers that do not parse fall back to removing the read_csv line.
     """
+    try:
+        return strip_io(res)
+    except SyntaxError:
+        pass
 
     csv_line = res.find("read_csv")
     if csv_line > 0:
@@ -168,6 +256,7 @@ def format_response(res):
         res = res_before + res_after
     return res
 
+@traced("format_question")
 def format_question(primer_desc,primer_code , question):
     """
     Fill in the model_specific_instructions variable
@@ -178,28 +267,39 @@ def format_question(primer_desc,primer_code , question):
     # Put the question at the end of the description primer within quotes, then add on the code primer.
     return  '"""\n' + primer_desc + question + '\n"""\n' + primer_code
 
-def get_primer(df_dataset,df_name):
+@traced("get_primer")
+def get_primer(df_dataset,df_name,handoff="copy",question="",budget=PRIMER_TOKEN_BUDGET):
     """
     Primer function to take a dataframe and its name
     and the name of the columns
     and any columns with less than 20 unique values it adds the values to the primer
+    (column details come from the cached dataset profile, see profiling.py)
     and horizontal grid lines and labeling
+    With handoff="view" df is a shallow copy, which the plot executor workers (and only they) back
+    with copy-on-write, so the primer asks for .loc assignments: chained ones would change nothing
+    Past the token budget only the columns most relevant to question are described (see prompt_budget.py)
     """
 
-    primer_desc = "Use a dataframe called df from data_file.csv with columns '" \
-        + "','".join(str(x) for x in df_dataset.columns) + "'. "
-    for i in df_dataset.columns:
-        if len(df_dataset[i].drop_duplicates()) < 20 and df_dataset.dtypes[i]=="O":
-            primer_desc = primer_desc + "\nThe column '" + i + "' has categorical values '" + \
-                "','".join(str(x) for x in df_dataset[i].drop_duplicates()) + "'. "
-        elif df_dataset.dtypes[i]=="int64" or df_dataset.dtypes[i]=="float64":
-            primer_desc = primer_desc + "\nThe column '" + i + "' is type " + str(df_dataset.dtypes[i]) + " and contains numeric values. "   
-    primer_desc = primer_desc + "\nLabel the x and y axes appropriately."
-    primer_desc = primer_desc + "\nAdd a title. Set the fig suptitle as empty."
-    primer_desc = primer_desc + "\nPut your reasoning of why you chose the specifc plot type and other reasons of how you came up with the plot according to the prompt in a long string and store it in a variable named \"reasoning\"" # Space for additional instructions if needed
-    primer_desc = primer_desc + "\nUsing Python version 3.9.12, create a script using the dataframe df to graph the following: "
+    profile = get_profile(df_dataset)
+    # Large datasets: point the model at the data reduction helpers of the plot executor
+    instructions = primer_hint(profile["rows"])
+    instructions = instructions + "\nLabel the x and y axes appropriately."
+    instructions = instructions + "\nAdd a title. Set the fig suptitle as empty."
+    instructions = instructions + "\nPut your reasoning of why you chose the specifc plot type and other reasons of how you came up with the plot according to the prompt in a long string and store it in a variable named \"reasoning\"" # Space for additional instructions if needed
+    if handoff == "view":
+        instructions = instructions + "\nTo change values of df use df.loc[rows, column] = value, never chained assignment like df[column][rows] = value."
+    instructions = instructions + "\nUsing Python version 3.9.12, create a script using the dataframe df to graph the following: "
+
+    primer_desc = "Use a dataframe called df from data_file.csv with columns '"
+    names, columns, report = budget_columns(profile, question, budget - count_tokens(primer_desc + "'. " + instructions),
+                                            "','".join(str(x) for x in df_dataset.columns), describe_columns(profile))
+    annotate(**report)
+    primer_desc = primer_desc + names + "'. " + columns + instructions
     pimer_code = "import pandas as pd\nimport matplotlib.pyplot as plt\n"
     pimer_code = pimer_code + "fig,ax = plt.subplots(1,1,figsize=(10,4))\n"
     pimer_code = pimer_code + "ax.spines['top'].set_visible(False)\nax.spines['right'].set_visible(False) \n"
-    pimer_code = pimer_code + "df=" + df_name + ".copy()\n"
+    if handoff == "view":
+        pimer_code = pimer_code + "df=" + df_name + ".copy(deep=False)\n"
+    else:
+        pimer_code = pimer_code + "df=" + df_name + ".copy()\n"
     return primer_desc,pimer_code
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""
+Plots of the chat history. Messages keep an image id instead of the image itself, the store keeps
+the encoded plots of one session within a memory cap: the least recently viewed full-size images
+are spilled to a per-session directory on disk and read back when asked for. Older turns are shown
+as small thumbnails, their full-size image is only loaded when the user opens it.
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+import streamlit as st
+from render_cache import PLOT_FORMAT, to_image
+
+SESSION_IMAGE_MB = int(os.environ.get("DATACHAT_SESSION_IMAGE_MB", 16))
+SPILL_DIR = os.environ.get("DATACHAT_IMAGE_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "datachat-images")
+THUMBNAIL_WIDTH = 320
+# The latest plots of the chat are shown at full size, older ones as thumbnails
+RECENT_FULL_SIZE = 2
+
+
+def make_thumbnail(data, image_format=PLOT_FORMAT, width=THUMBNAIL_WIDTH):
+    """
+    A downscaled copy of a png or webp image. SVG markup is small and scales in the browser,
+    it is kept as it is.
+    """
+    if image_format == "svg":
+        return data
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((width, width * image.height // max(image.width, 1)))
+        buf = io.BytesIO()
+        image.save(buf, format=image_format.upper())
+    return buf.getvalue()
+
+
+class ChatImageStore:
+    """
+    Images of one chat session by id, full-size ones in an LRU bounded by max_bytes
+    and spilled to disk beyond it, thumbnails always in memory
+    """
+
+    def __init__(self, max_bytes=SESSION_IMAGE_MB * 1024 * 1024, image_format=PLOT_FORMAT, spill_dir=SPILL_DIR):
+        self.max_bytes = max_bytes
+        self.image_format = image_format
+        self.directory = os.path.join(spill_dir, uuid.uuid4().hex)
+        self.spills = 0
+        self.loads = 0
+        self._full = OrderedDict()
+        self._thumbnails = {}
+        self._on_disk = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # The spilled files go away with the session
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+    def put(self, data):
+        """
+        Adds an encoded image and returns its id
+        """
+        image_id = hashlib.sha1(data).hexdigest()[:16]
+        thumbnail = make_thumbnail(data, self.image_format)
+        with self._lock:
+            self._thumbnails[image_id] = thumbnail
+            self._keep(image_id, data)
+        return image_id
+
+    def _keep(self, image_id, data):
+        if image_id in self._full:
+            self._full.move_to_end(image_id)
+            return
+        self._full[image_id] = data
+        self._bytes += len(data)
+        # Spill the least recently used full-size images, always keeping the newest one
+        while self._bytes > self.max_bytes and len(self._full) > 1:
+            old_id, old = self._full.popitem(last=False)
+            self._bytes -= len(old)
+            if old_id not in self._on_disk:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, old_id + "." + self.image_format)
+                with open(path, "wb") as f:
+                    f.write(old)
+                self._on_disk[old_id] = (path, len(old))
+                self.spills += 1
+
+    def full(self, image_id):
+        """
+        The full-size image, read back from disk if it was spilled
+        """
+        with self._lock:
+            data = self._full.get(image_id)
+            if data is not None:
+                self._full.move_to_end(image_id)
+                return data
+            path, _ = self._on_disk[image_id]
+        with open(path, "rb") as f:
+            data = f.read()
+        with self._lock:
+            self.loads += 1
+            self._keep(image_id, data)
+        return data
+
+    def thumbnail(self, image_id):
+        return self._thumbnails[image_id]
+
+    def footprint(self):
+        """
+        Bytes held in memory and on disk by this session's images
+        """
+        with self._lock:
+            thumbnails = sum(len(t) for t in self._thumbnails.values())
+            return {
+                "images": len(self._thumbnails),
+                "full_size_in_memory": len(self._full),
+                "memory_bytes": self._bytes + thumbnails,
+                "thumbnail_bytes": thumbnails,
+                "spilled": len(self._on_disk),
+                "disk_bytes": sum(size for _, size in self._on_disk.values()),
+                "spills": self.spills,
+                "loads": self.loads,
+            }
+
+    def close(self):
+        self._finalizer()
+
+
+def show_history_image(images, image_id, caption, full_size, key):
+    """
+    Shows a plot of the chat history: the full-size image for recent turns, otherwise
+    a thumbnail with a toggle that loads the full-size image on demand
+    """
+    with st.chat_message("assistant"):
+        if not full_size:
+            full_size = st.toggle("Full size", key=key)
+        data = images.full(image_id) if full_size else images.thumbnail(image_id)
+        st.image(to_image(data, images.image_format), caption=caption, use_column_width=full_size)
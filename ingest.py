@@ -0,0 +1,192 @@
+"""
+Streaming CSV ingestion for uploads. The file is parsed in chunks and each column is stored in
+the most compact dtype that holds it: category for low-cardinality strings in large uploads,
+the smallest integer type, float32 when lossless and datetime64 for date strings.
+Uploads above the byte ceiling are sampled and uploads above the row ceiling are truncated.
+"""
+import os
+import re
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+CHUNK_ROWS = 100_000
+MAX_ROWS = int(os.environ.get("DATACHAT_UPLOAD_MAX_ROWS", 5_000_000))
+MAX_BYTES = int(os.environ.get("DATACHAT_UPLOAD_MAX_MB", 500)) * 1024 * 1024
+# Strings become categories when the column has at least CATEGORY_MIN_ROWS rows and fewer distinct
+# values than CATEGORY_RATIO of them. Category columns behave differently in generated pandas code
+# (fillna with a new value raises, groupby lists unobserved categories), so only columns where the
+# saving is large are converted.
+CATEGORY_RATIO = 0.05
+CATEGORY_MIN_ROWS = 10_000
+
+# Quick check before the formats are tried: a 4 digit year first, or a 2 or 4 digit year last
+_DATE_PATTERN = re.compile(r"^\s*(\d{4}[-/.]\d{1,2}[-/.]\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.](\d{2}|\d{4}))"
+                           r"([ T]\d{1,2}:\d{2}(:\d{2})?)?\s*$")
+_DATE_FORMATS = ["%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d", "%m/%d/%Y", "%d/%m/%Y", "%m/%d/%y", "%d/%m/%y",
+                 "%d.%m.%Y", "%d.%m.%y", "%m-%d-%Y", "%d-%m-%Y"]
+_TIME_FORMATS = ["", " %H:%M", " %H:%M:%S", "T%H:%M", "T%H:%M:%S"]
+
+
+def _file_size(file):
+    size = getattr(file, "size", None)
+    if size is None:
+        pos = file.tell()
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(pos)
+    return size
+
+
+def _date_format(column):
+    """
+    The strptime format every value of a sample of the column parses with, None if it holds
+    something else than dates (version numbers like 1.2.3 or IP addresses match no format)
+    """
+    sample = column.dropna().head(100)
+    if sample.empty or not all(isinstance(x, str) and _DATE_PATTERN.match(x) for x in sample):
+        return None
+    for date_format in _DATE_FORMATS:
+        for time_format in _TIME_FORMATS:
+            try:
+                pd.to_datetime(sample, format=date_format + time_format)
+            except (ValueError, OverflowError):
+                continue
+            return date_format + time_format
+    return None
+
+
+def _shrink_column(column, dates=True):
+    kind = column.dtype.kind
+    if kind in "iu":
+        return pd.to_numeric(column, downcast="integer" if kind == "i" else "unsigned")
+    if kind == "f":
+        as_float32 = column.astype("float32")
+        # Only keep float32 when it round-trips, prices and ids must not lose precision
+        if ((as_float32.astype("float64") == column) | column.isna()).all():
+            return as_float32
+        return column
+    if kind == "O":
+        date_format = _date_format(column) if dates else None
+        if date_format is not None:
+            dates = pd.to_datetime(column, format=date_format, errors="coerce")
+            # Kept as strings if any value past the sample does not parse, rather than lost as NaT
+            if not (dates.isna() & column.notna()).any():
+                return dates
+        if len(column) >= CATEGORY_MIN_ROWS and column.nunique() < CATEGORY_RATIO * len(column):
+            return column.astype("category")
+    return column
+
+
+def shrink_dtypes(df):
+    """
+    Returns the dataframe with every column converted to its most compact dtype
+    """
+    return pd.DataFrame({name: _shrink_column(df[name]) for name in df.columns}, index=df.index)
+
+
+def _kind(dtype):
+    # Numbers of any width agree with each other, a category agrees with the values it holds
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    return "n" if dtype.kind in "iuf" else dtype.kind
+
+
+def _mixed_columns(chunks):
+    """
+    Columns the parser read as numbers in some chunks and as text in others
+    """
+    return [name for name in chunks[0].columns if len({_kind(chunk[name].dtype) for chunk in chunks}) > 1]
+
+
+def _combine(chunks):
+    # Categories differ between chunks, so categorical columns are unioned instead of concatenated
+    columns = {}
+    for name in chunks[0].columns:
+        parts = [chunk[name] for chunk in chunks]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[name] = pd.Series(union_categoricals(parts), name=name)
+        else:
+            columns[name] = pd.concat([part.astype(object) if isinstance(part.dtype, pd.CategoricalDtype) else part
+                                       for part in parts], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def _read_chunks(file, chunksize, max_rows, fraction, size, progress, dtype=None):
+    chunks = []
+    rows_read = 0
+    rows_kept = 0
+    memory_before = 0
+    truncated = False
+
+    for chunk in pd.read_csv(file, chunksize=chunksize, dtype=dtype):
+        rows_read += len(chunk)
+        if fraction < 1.0:
+            chunk = chunk.sample(frac=fraction, random_state=0).sort_index()
+        if rows_kept + len(chunk) > max_rows:
+            chunk = chunk.iloc[:max_rows - rows_kept]
+            truncated = True
+        memory_before += int(chunk.memory_usage(deep=True).sum())
+        # Dates are only parsed on the whole column, a chunk may hold all the values that are not dates
+        chunks.append(pd.DataFrame({name: _shrink_column(chunk[name], dates=False) for name in chunk.columns},
+                                   index=chunk.index))
+        rows_kept += len(chunk)
+        if progress is not None:
+            done = min(1.0, file.tell() / size) if size and hasattr(file, "tell") else 0.0
+            progress(done, "Loaded %d rows" % rows_read)
+        if truncated:
+            break
+    return chunks, rows_read, memory_before, truncated
+
+
+def read_csv_optimized(file, chunksize=CHUNK_ROWS, max_rows=MAX_ROWS, max_bytes=MAX_BYTES, progress=None):
+    """
+    Reads a CSV in chunks with compact dtypes.
+    progress is called with (fraction done, message) after each chunk.
+    Returns the dataframe and a report of rows, memory saved and any sampling or truncation.
+    """
+    size = _file_size(file)
+    # Above the byte ceiling keep an even sample of every chunk so the result fits under it
+    fraction = min(1.0, max_bytes / size) if size else 1.0
+    start = file.tell()
+    chunks, rows_read, memory_before, truncated = _read_chunks(file, chunksize, max_rows, fraction, size, progress)
+
+    mixed = _mixed_columns(chunks) if len(chunks) > 1 else []
+    if mixed:
+        # An id column with "A12" in a later chunk: read those columns as text in every chunk,
+        # as a single read of the file would, instead of joining numbers and strings
+        file.seek(start)
+        chunks, rows_read, memory_before, truncated = _read_chunks(
+            file, chunksize, max_rows, fraction, size, progress, dtype={name: str for name in mixed})
+
+    if not chunks:
+        df = pd.DataFrame()
+    else:
+        # Dtypes chosen per chunk may differ (int8 vs int16), shrink once more on the whole frame
+        df = shrink_dtypes(_combine(chunks) if len(chunks) > 1 else chunks[0].reset_index(drop=True))
+
+    memory_after = int(df.memory_usage(deep=True).sum())
+    report = {
+        "rows": len(df),
+        "rows_read": rows_read,
+        "columns": len(df.columns),
+        "bytes": size,
+        "memory_before": memory_before,
+        "memory_after": memory_after,
+        "memory_saved": max(0, memory_before - memory_after),
+        "sampled": fraction < 1.0,
+        "truncated": truncated,
+    }
+    return df, report
+
+
+def describe_report(report):
+    """
+    One line summary of an ingestion report for the UI
+    """
+    text = "%d rows, %.1f MB in memory (%.1f MB saved by compact dtypes)." % (
+        report["rows"], report["memory_after"] / 1024 / 1024, report["memory_saved"] / 1024 / 1024)
+    if report["sampled"]:
+        text += " The file is larger than the upload limit, a %d row sample was loaded." % report["rows"]
+    elif report["truncated"]:
+        text += " Only the first %d rows were loaded." % report["rows"]
+    return text
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from metrics import annotate
+
+# Point this at a local stub (e.g. http://127.0.0.1:8765/v1, see stub_llm.py) to run offline
+API_BASE = os.environ.get("DATACHAT_OPENAI_API_BASE") or None
+REQUEST_TIMEOUT = 120
+# Clients kept for reuse, keyed by a hash of the api key so the cache does not hold every key
+MAX_CLIENTS = 64
+
+_session = None
+_clients = OrderedDict()
+_lock = threading.Lock()
+
+
+def _openai():
+    """
+    The openai module, imported on first use as it takes longer to import than the rest of the
+    app (see warmup.py). One requests session is shared by every client so HTTP connections to
+    the api are reused.
+    """
+    global _session
+    import openai
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+        openai.requestssession = _session
+    return openai
+
+
+def _messages(task, prompt):
+    return [{"role": "system", "content": task}, {"role": "user", "content": prompt}]
+
+
+def _record_usage(response, model):
+    usage = response.get("usage") or {}
+    annotate(model=model, prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+
+
+class LLMClient:
+    """
+    Thin wrapper around the chatgpt api that keeps the key per client instead of
+    setting the global openai.api_key, and offers blocking, streaming and asyncio calls
+    """
+
+    def __init__(self, api_key, model="gpt-4", api_base=API_BASE, request_timeout=REQUEST_TIMEOUT):
+        self.api_key = api_key
+        self.model = model
+        self.api_base = api_base
+        self.request_timeout = request_timeout
+
+    def _params(self, task, prompt, **extra):
+        params = dict(model=self.model, messages=_messages(task, prompt), api_key=self.api_key,
+                      request_timeout=self.request_timeout, **extra)
+        if self.api_base:
+            params["api_base"] = self.api_base
+        return params
+
+    def complete(self, task, prompt):
+        """
+        Returns the whole response once the model has finished
+        """
+        openai = _openai()
+        response = openai.ChatCompletion.create(**self._params(task, prompt))
+        _record_usage(response, self.model)
+        return response["choices"][0]["message"]["content"]
+
+    def stream(self, task, prompt):
+        """
+        Yields the response text chunk by chunk as the tokens arrive
+        """
+        openai = _openai()
+        chunks = 0
+        for chunk in openai.ChatCompletion.create(**self._params(task, prompt, stream=True)):
+            delta = chunk["choices"][0].get("delta", {}).get("content")
+            if delta:
+                chunks += 1
+                yield delta
+        # Streamed responses carry no usage, each chunk is about one token and a token about 4 characters
+        annotate(model=self.model, prompt_tokens=(len(task) + len(prompt)) // 4, completion_tokens=chunks,
+                 tokens_estimated=True)
+
+    async def acomplete(self, task, prompt):
+        response = await _openai().ChatCompletion.acreate(**self._params(task, prompt))
+        _record_usage(response, self.model)
+        return response["choices"][0]["message"]["content"]
+
+
+def get_client(api_key, model="gpt-4"):
+    """
+    Returns the client for this key and model, creating it on first use.
+    Only the MAX_CLIENTS most recently used clients (and so api keys) are kept.
+    """
+    key = (hashlib.sha256((api_key or "").encode("utf-8")).hexdigest(), model, API_BASE)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = LLMClient(api_key, model)
+            _clients[key] = client
+            while len(_clients) > MAX_CLIENTS:
+                _clients.popitem(last=False)
+        else:
+            _clients.move_to_end(key)
+    return client
@@ -0,0 +1,225 @@
+"""
+Per-stage latency and token instrumentation. Code is wrapped in spans; every finished span is
+appended to a rotating JSONL log and folded into in-memory histograms and counters that are
+served in the Prometheus text format when DATACHAT_METRICS_PORT is set.
+
+    with span("llm", model="gpt-4") as s:
+        ...
+        s.set(prompt_tokens=120, completion_tokens=80)
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+METRICS_LOG = os.environ.get("DATACHAT_METRICS_LOG", "metrics.jsonl")
+METRICS_PORT = int(os.environ.get("DATACHAT_METRICS_PORT", 0))
+METRICS_ENABLED = os.environ.get("DATACHAT_METRICS", "on").lower() not in ("0", "off", "false", "no")
+
+# Latency histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_logger = None
+_server = None
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        logger = logging.getLogger("datachat.metrics")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        if METRICS_LOG and not logger.handlers:
+            handler = RotatingFileHandler(METRICS_LOG, maxBytes=10 * 1024 * 1024, backupCount=5)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+        _logger = logger
+    return _logger
+
+
+def start_trace():
+    """
+    Starts a new trace for one user request, the spans that follow carry its id
+    """
+    trace_id = uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    _count("datachat_requests_total", {})
+    return trace_id
+
+
+def _count(name, labels, value=1):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def _observe(name, seconds):
+    with _lock:
+        histogram = _histograms.setdefault(name, {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0})
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+
+
+class Span:
+    """
+    A timed stage of the pipeline. Attributes set on it end up in the log record,
+    token counts, cache status and failures also feed the counters.
+    """
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.error = None
+        # Exception class of the failure, the only error label on the counters: the message can
+        # hold anything (column names, user code) and would give every failure its own series
+        self.error_type = None
+        self.start = None
+        self._parent = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, reason):
+        self.error = str(reason)[:200]
+        self.error_type = type(reason).__name__ if isinstance(reason, BaseException) else "error"
+
+    def __enter__(self):
+        self._parent = _current_span.get()
+        _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _current_span.set(self._parent)
+        if exc_type is not None and self.error is None and not issubclass(exc_type, GeneratorExit):
+            self.fail("%s: %s" % (exc_type.__name__, exc))
+            self.error_type = exc_type.__name__
+        if METRICS_ENABLED:
+            self._record(seconds)
+        return False
+
+    def _record(self, seconds):
+        _observe(self.name, seconds)
+        attrs = self.attributes
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if attrs.get(kind):
+                _count("datachat_tokens_total", {"model": attrs.get("model", ""), "type": kind.split("_")[0]}, attrs[kind])
+        if "cache" in attrs:
+            _count("datachat_cache_total", {"span": self.name, "result": attrs["cache"]})
+        if "outcome" in attrs:
+            _count("datachat_outcomes_total", {"span": self.name, "outcome": attrs["outcome"]})
+        if attrs.get("tokens_saved"):
+            _count("datachat_prompt_tokens_saved_total", {"span": self.name}, attrs["tokens_saved"])
+        if attrs.get("wasted_tokens"):
+            _count("datachat_prefetch_wasted_tokens_total", {}, attrs["wasted_tokens"])
+        if "image_bytes" in attrs:
+            _count("datachat_image_bytes_total", {}, attrs["image_bytes"])
+        if self.error:
+            _count("datachat_errors_total", {"span": self.name, "type": self.error_type})
+
+        record = {"ts": round(time.time(), 3), "trace": _trace_id.get(), "span": self.name,
+                  "seconds": round(seconds, 6), "ok": self.error is None}
+        if self.error:
+            record["error"] = self.error
+            record["error_type"] = self.error_type
+        record.update((k, round(v, 6) if isinstance(v, float) else v) for k, v in attrs.items())
+        _get_logger().info(json.dumps(record, default=str))
+
+
+def span(name, **attributes):
+    return Span(name, attributes)
+
+
+def annotate(**attributes):
+    """
+    Sets attributes on the innermost open span, if any. Lets lower layers such as the
+    api client report token usage without knowing which stage called them.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def traced(name):
+    """
+    Decorator wrapping every call of the function in a span
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels) + "}"
+
+
+def prometheus_text():
+    """
+    All metrics in the Prometheus text exposition format
+    """
+    lines = ["# TYPE datachat_stage_seconds histogram"]
+    with _lock:
+        for name, histogram in sorted(_histograms.items()):
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                lines.append('datachat_stage_seconds_bucket{stage="%s",le="%s"} %d' % (name, bound, count))
+            lines.append('datachat_stage_seconds_bucket{stage="%s",le="+Inf"} %d' % (name, histogram["count"]))
+            lines.append('datachat_stage_seconds_sum{stage="%s"} %f' % (name, histogram["sum"]))
+            lines.append('datachat_stage_seconds_count{stage="%s"} %d' % (name, histogram["count"]))
+        declared = set()
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in declared:
+                lines.append("# TYPE %s counter" % name)
+                declared.add(name)
+            lines.append("%s%s %s" % (name, _labels(labels), value))
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        payload = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """
+    Serves /metrics on the given port from a background thread, once per process.
+    Does nothing when no port is configured.
+    """
+    global _server
+    with _lock:
+        if _server is not None or not port:
+            return _server
+        _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
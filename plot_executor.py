@@ -0,0 +1,398 @@
+"""
+Runs generated plotting code in a pool of pre-warmed worker processes, so a slow or
+runaway script neither blocks the Streamlit server thread nor competes for its GIL.
+
+Each worker imports pandas and matplotlib (Agg) and loads the bundled datasets once at
+start up. A job gets a wall-clock timeout and can be cancelled; the worker running it is
+then killed and replaced by a fresh one. Workers also run under an address space limit.
+Uploads of DATACHAT_SHARED_FRAMES_MB or more are memory-mapped by the workers from files
+written once (shared_frames.py), smaller ones are pickled to each worker that needs them.
+With the "view" handoff the workers, and only they, run pandas in copy-on-write mode. There a
+chained assignment (df["a"][mask] = 0) would change nothing, so it fails the job instead.
+"""
+import atexit
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import ForkingPickler
+from code_optimizer import OPTIMIZER_ENABLED, UnsafeCodeError, optimize_code
+from shared_frames import SharedFrames
+
+DEFAULT_WORKERS = int(os.environ.get("DATACHAT_PLOT_WORKERS", 0)) or os.cpu_count() or 2
+DEFAULT_TIMEOUT = float(os.environ.get("DATACHAT_PLOT_TIMEOUT", 30))
+DEFAULT_MEMORY_LIMIT_MB = int(os.environ.get("DATACHAT_PLOT_MEMORY_MB", 1024))
+# "view": the generated code gets copy-on-write views of the datasets (get_primer emits
+# .copy(deep=False)), "copy": it deep copies them as before
+DATAFRAME_HANDOFF = os.environ.get("DATACHAT_DATAFRAME_HANDOFF", "view")
+
+# Uploaded datasets each worker keeps around, keyed by fingerprint
+_WORKER_EXTRA_DATASETS = 4
+
+
+class PlotExecutionError(Exception):
+    pass
+
+
+class PlotTimeoutError(PlotExecutionError):
+    pass
+
+
+class PlotCancelledError(PlotExecutionError):
+    pass
+
+
+class PlotRejectedError(PlotExecutionError):
+    pass
+
+
+def _limit_memory(memory_limit_mb):
+    # Allow memory_limit_mb on top of what the warmed up worker already uses, returns the limit.
+    # Only the soft limit is set, so it can be raised by the size of the shared frames mapped later.
+    try:
+        import resource
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        limit = current + memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+        return limit
+    except (ImportError, OSError, ValueError):
+        # No /proc or no resource module (Windows, macOS): run without a memory limit
+        return None
+
+
+def _set_memory_limit(limit):
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+    except (ImportError, OSError, ValueError):
+        pass
+
+
+def enable_copy_on_write():
+    """
+    Turns on pandas copy-on-write for this process, returns False if pandas is too old (< 1.5)
+    """
+    import pandas as pd
+    try:
+        pd.set_option("mode.copy_on_write", True)
+    except (KeyError, pd.errors.OptionError):
+        return False
+    return True
+
+
+def handoff_datasets(datasets, handoff, copy_on_write):
+    """
+    The datasets mapping a job sees. In "view" mode every dataframe is a shallow copy: under
+    copy-on-write it shares the data and a write copies only what it touches, so nothing the code
+    does to datasets[...] or df leaks into the next job. Without copy-on-write they are deep copies.
+    """
+    if handoff != "view":
+        return datasets
+    return {name: df.copy(deep=not copy_on_write) for name, df in datasets.items()}
+
+
+def _worker_main(jobs, results):
+    dataset_files, memory_limit_mb, handoff = jobs.recv()
+    import io
+    import warnings
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import reduction
+    from figure_info import figure_metadata
+    from shared_frames import mapped_bytes, read_frame
+
+    copy_on_write = handoff == "view" and enable_copy_on_write()
+    chained_assignment = getattr(pd.errors, "ChainedAssignmentError", None)
+    bundled = {name: pd.read_csv(path) for name, path in dataset_files.items()}
+    extra = OrderedDict()
+    # Bytes mapped for each shared frame in extra, they count against the address space limit
+    mapped = {}
+    base_limit = _limit_memory(memory_limit_mb)
+    results.send(("ready", None, None, None, None))
+
+    while True:
+        try:
+            job = jobs.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        code, dataset_refs, frames, image_format, dpi = job
+        for fingerprint, frame in frames.items():
+            if isinstance(frame, str):
+                # A large frame shared through files (see shared_frames.py), mapped rather than copied
+                mapped[fingerprint] = mapped_bytes(frame)
+                if base_limit is not None:
+                    _set_memory_limit(base_limit + sum(mapped.values()))
+                frame = read_frame(frame)
+            extra[fingerprint] = frame
+        datasets = dict(bundled)
+        for name, fingerprint in dataset_refs.items():
+            datasets[name] = extra[fingerprint]
+            extra.move_to_end(fingerprint)
+        datasets = handoff_datasets(datasets, handoff, copy_on_write)
+        # Same eviction order as _Worker.fingerprints on the parent side
+        while len(extra) > _WORKER_EXTRA_DATASETS:
+            fingerprint, _ = extra.popitem(last=False)
+            mapped.pop(fingerprint, None)
+
+        namespace = {"datasets": datasets, "pd": pd, "plt": plt}
+        namespace.update(reduction.namespace())
+        # Seconds spent running the code and encoding the figure, reported back for the metrics
+        timings = {}
+        try:
+            start = time.perf_counter()
+            with warnings.catch_warnings():
+                if copy_on_write and chained_assignment is not None:
+                    # df["a"][mask] = 0 changes nothing under copy-on-write, fail instead of plotting unchanged data
+                    warnings.simplefilter("error", chained_assignment)
+                exec(code, namespace)
+            timings["exec_seconds"] = time.perf_counter() - start
+            buf = io.BytesIO()
+            start = time.perf_counter()
+            plt.savefig(buf, format=image_format, dpi=dpi or "figure")
+            timings["savefig_seconds"] = time.perf_counter() - start
+            # What the figure shows, for "Describe it", read while the figure is still open
+            start = time.perf_counter()
+            try:
+                figure = figure_metadata(plt.gcf())
+            except Exception:
+                figure = None
+            timings["figure_info_seconds"] = time.perf_counter() - start
+            results.send(("ok", buf.getvalue(), str(namespace.get("reasoning", "")), timings, figure))
+        except MemoryError:
+            results.send(("error", "MemoryError: the plot exceeded the worker memory limit", None, timings, None))
+        except BaseException as e:
+            results.send(("error", "%s: %s" % (type(e).__name__, e), None, timings, None))
+        finally:
+            plt.close("all")
+
+
+class _Worker:
+    """
+    A worker is a plain subprocess running this file, talking over two pipes.
+    multiprocessing is not used because Streamlit installs the app script as __main__,
+    which spawned children would re-run.
+    """
+
+    def __init__(self, dataset_files, memory_limit_mb, handoff):
+        job_r, job_w = os.pipe()
+        result_r, result_w = os.pipe()
+        # One BLAS thread per worker, the pool itself provides the parallelism
+        env = dict(os.environ, OPENBLAS_NUM_THREADS="1", OMP_NUM_THREADS="1", MPLBACKEND="Agg")
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(job_r), str(result_w)],
+                                        pass_fds=(job_r, result_w), env=env)
+        os.close(job_r)
+        os.close(result_w)
+        self.jobs = Connection(job_w, readable=False)
+        self.results = Connection(result_r, writable=False)
+        self.jobs.send((dataset_files, memory_limit_mb, handoff))
+        self.ready = False
+        # Fingerprints of uploaded datasets this worker already holds
+        self.fingerprints = OrderedDict()
+
+    def wait_ready(self):
+        if not self.ready:
+            self.results.recv()
+            self.ready = True
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        self.jobs.close()
+        self.results.close()
+
+
+class PlotJob:
+    """
+    Handle on a submitted job: result() waits for (image bytes, reasoning), cancel() stops it.
+    Once done, timings holds the seconds spent optimizing, queued, executing and encoding
+    the figure, and the number of rewrites code_optimizer made, and figure what the figure
+    shows (see figure_info.py), or None.
+    """
+
+    def __init__(self):
+        self._cancel = threading.Event()
+        self.future = None
+        self.timings = {}
+        self.figure = None
+
+    def cancel(self):
+        self._cancel.set()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class PlotExecutor:
+    """
+    Pool of warm worker processes executing generated plotting code.
+    dataset_files maps dataset names to the CSV files every worker preloads,
+    so the generated code can refer to datasets["<name>"].
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, dataset_files=None, timeout=DEFAULT_TIMEOUT,
+                 memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, handoff=DATAFRAME_HANDOFF):
+        self.size = workers
+        self.dataset_files = dict(dataset_files or {})
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.handoff = handoff
+        self._idle = queue.Queue()
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plot-executor")
+        self._closed = False
+        self._shared = SharedFrames()
+        # Empty frames with the dtypes of the bundled datasets, read on the first optimization
+        self._bundled_dtypes = None
+        self._bundled_lock = threading.Lock()
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+        atexit.register(self.shutdown)
+
+    def _spawn(self):
+        return _Worker(self.dataset_files, self.memory_limit_mb, self.handoff)
+
+    def _replace(self, worker):
+        worker.kill()
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def submit(self, code, datasets=None, timeout=None, image_format="png", dpi=None):
+        """
+        Queues the code for execution and returns a PlotJob.
+        datasets maps names to dataframes that are not bundled (e.g. uploads),
+        each is keyed by its fingerprint and only sent to a worker that lacks it.
+        The figure is encoded as image_format (png, webp or svg) at dpi.
+        """
+        from profiling import dataset_fingerprint
+
+        refs = {name: dataset_fingerprint(df) for name, df in (datasets or {}).items()}
+        frames = {refs[name]: df for name, df in (datasets or {}).items()}
+        job = PlotJob()
+        job.future = self._threads.submit(self._execute, job, (code, refs, frames, image_format, dpi),
+                                          self.timeout if timeout is None else timeout)
+        return job
+
+    def run(self, code, datasets=None, timeout=None, image_format="png", dpi=None):
+        """
+        Executes the code and returns the encoded figure and its reasoning string
+        """
+        return self.submit(code, datasets, timeout, image_format, dpi).result()
+
+    def _numeric_columns(self, frames):
+        """
+        Columns numeric in every dataset the code can use, the optimizer only vectorizes
+        arithmetic on those (a category column has none)
+        """
+        import pandas as pd
+        from profiling import numeric_columns
+
+        with self._bundled_lock:
+            if self._bundled_dtypes is None:
+                try:
+                    self._bundled_dtypes = [pd.read_csv(path).iloc[:0] for path in self.dataset_files.values()]
+                except (OSError, ValueError):
+                    # The workers cannot load them either, the code cannot use their columns
+                    self._bundled_dtypes = []
+        return numeric_columns(self._bundled_dtypes + list(frames.values()))
+
+    def _execute(self, job, payload, timeout):
+        code, refs, frames, image_format, dpi = payload
+        if job._cancel.is_set():
+            raise PlotCancelledError("The plot was cancelled")
+        if OPTIMIZER_ENABLED:
+            start = time.perf_counter()
+            try:
+                code, rewrites = optimize_code(code, self._numeric_columns(frames))
+                job.timings["rewrites"] = len(rewrites)
+            except UnsafeCodeError as e:
+                raise PlotRejectedError(str(e))
+            except SyntaxError:
+                # Runs as is, the worker reports the error
+                pass
+            job.timings["optimize_seconds"] = time.perf_counter() - start
+        queued = time.perf_counter()
+        worker = self._idle.get()
+        job.timings["queue_seconds"] = time.perf_counter() - queued
+        # Pickled before anything is written, so a frame that cannot be pickled leaves the worker idle
+        try:
+            missing = {}
+            for fp, df in frames.items():
+                if fp not in worker.fingerprints:
+                    # Large frames go by the path of their memory-mapped copy, written once for all workers
+                    missing[fp] = self._shared.path(fp, df) or df
+            message = ForkingPickler.dumps((code, refs, missing, image_format, dpi))
+        except BaseException as e:
+            self._idle.put(worker)
+            raise PlotExecutionError("The datasets could not be sent to the plot worker: %s: %s"
+                                     % (type(e).__name__, e))
+
+        # From here on the worker is replaced on any failure, whatever state it was left in
+        sent = False
+        try:
+            worker.wait_ready()
+            worker.jobs.send_bytes(message)
+            sent = True
+            for fp in refs.values():
+                worker.fingerprints[fp] = True
+                worker.fingerprints.move_to_end(fp)
+            while len(worker.fingerprints) > _WORKER_EXTRA_DATASETS:
+                worker.fingerprints.popitem(last=False)
+
+            deadline = time.monotonic() + timeout
+            while not worker.results.poll(0.05):
+                if job._cancel.is_set():
+                    raise PlotCancelledError("The plot was cancelled")
+                if time.monotonic() > deadline:
+                    raise PlotTimeoutError("The plot took longer than %s seconds" % timeout)
+            status, image, reasoning, timings, figure = worker.results.recv()
+        except PlotExecutionError:
+            self._replace(worker)
+            raise
+        except (EOFError, OSError) as e:
+            self._replace(worker)
+            if not sent:
+                raise PlotExecutionError("The plot worker failed to start: %s" % e)
+            # The worker died, most likely killed for exceeding its memory limit
+            raise PlotExecutionError("The plot worker crashed")
+        except BaseException as e:
+            self._replace(worker)
+            raise PlotExecutionError("%s: %s" % (type(e).__name__, e))
+        self._idle.put(worker)
+        job.timings.update(timings)
+        job.figure = figure
+        if status != "ok":
+            raise PlotExecutionError(image)
+        return image, reasoning
+
+    def shutdown(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        self._shared.close()
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                worker.jobs.send(None)
+            except OSError:
+                pass
+            try:
+                worker.process.wait(1)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+
+
+if __name__ == "__main__":
+    _worker_main(Connection(int(sys.argv[1]), writable=False), Connection(int(sys.argv[2]), readable=False))
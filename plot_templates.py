@@ -0,0 +1,221 @@
+"""
+Local fast path for simple "Show:" prompts. A histogram of X, the mean of Y by Z or Y over time
+does not need a round trip to ChatGPT: the intent is matched with a few patterns, the column
+names are resolved against the dataset profile and the plot code is generated from a template.
+The code has the same shape as a ChatGPT answer, so it is appended to the primer code and ends
+with a reasoning string. Prompts that do not match confidently go to ChatGPT as before.
+"""
+import difflib
+import os
+import re
+import threading
+from profiling import get_profile
+from reduction import MAX_BARS, ROW_THRESHOLD
+from metrics import span
+
+TEMPLATES_ENABLED = os.environ.get("DATACHAT_TEMPLATES", "on").lower() not in ("0", "off", "false", "no")
+# Matches scoring below this go to ChatGPT
+MIN_CONFIDENCE = float(os.environ.get("DATACHAT_TEMPLATE_CONFIDENCE", 0.8))
+
+AGGREGATIONS = {
+    "mean": "mean", "average": "mean", "avg": "mean", "median": "median", "total": "sum", "sum": "sum",
+    "max": "max", "maximum": "max", "min": "min", "minimum": "min",
+}
+_AGG_WORDS = {"mean": "Average", "median": "Median", "sum": "Total", "max": "Maximum", "min": "Minimum"}
+_TIME_NAMES = ("date", "time", "year", "month", "day", "week", "quarter", "period")
+
+_PREFIX = re.compile(r"^\s*show\s*:?\s*", re.I)
+_CHART = re.compile(r"^(?:me\s+)?(?:an?\s+|the\s+)?(?:(bar|line|column)\s+)?(?:chart|plot|graph)\s+(?:of|showing)\s+", re.I)
+_ARTICLE = re.compile(r"^(?:the|a|an|each|every)\s+", re.I)
+_PATTERNS = [
+    ("histogram", 1.0, re.compile(r"^(?:histogram|distribution|spread)\s+of\s+(?P<x>.+)$", re.I)),
+    ("count", 1.0, re.compile(r"^(?:count|number)\s+of\s+(?:rows|records|items|entries)\s+(?:by|per|for each|across)\s+(?P<x>.+)$", re.I)),
+    ("count", 0.95, re.compile(r"^(?P<x>.+?)\s+counts?$", re.I)),
+    ("bar", 1.0, re.compile(r"^(?P<agg>" + "|".join(AGGREGATIONS) + r")\s+(?:of\s+)?(?P<y>.+?)\s+(?:by|per|for each|across)\s+(?P<x>.+)$", re.I)),
+    ("line", 1.0, re.compile(r"^(?P<y>.+?)\s+over\s+(?P<x>time|the years|years)$", re.I)),
+    ("line", 0.95, re.compile(r"^(?P<y>.+?)\s+over\s+(?P<x>.+)$", re.I)),
+    ("bar", 0.9, re.compile(r"^(?P<y>.+?)\s+(?:by|per|for each|across)\s+(?P<x>.+)$", re.I)),
+]
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _normalize(text):
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def resolve_column(phrase, profile):
+    """
+    The profile column a phrase of the prompt refers to and a confidence between 0 and 1:
+    1 for the exact name, 0.9 when the phrase is part of exactly one column name, otherwise
+    the similarity of the closest name if it is clearly closer than the runner-up
+    """
+    phrase = _normalize(_ARTICLE.sub("", phrase.strip()))
+    if not phrase:
+        return None, 0.0
+    names = {_normalize(col["name"]): col for col in profile["columns"]}
+    if phrase in names:
+        return names[phrase], 1.0
+    words = set(phrase.split())
+    partial = [col for name, col in names.items() if words <= set(name.split())]
+    if len(partial) == 1:
+        return partial[0], 0.9
+    scores = sorted(((difflib.SequenceMatcher(None, phrase, name).ratio(), name) for name in names), reverse=True)
+    if scores and (len(scores) == 1 or scores[0][0] - scores[1][0] >= 0.1):
+        return names[scores[0][1]], scores[0][0]
+    return None, 0.0
+
+
+def _is_time(col):
+    return col["dtype"].startswith("datetime") or (
+        col["numeric"] and any(word in _normalize(col["name"]).split() for word in _TIME_NAMES))
+
+
+def _time_column(profile):
+    # Datetime columns first, then numeric columns named like year or month
+    for col in profile["columns"]:
+        if col["dtype"].startswith("datetime"):
+            return col
+    return next((col for col in profile["columns"] if _is_time(col)), None)
+
+
+def _is_category(col):
+    return not col["numeric"] or col["cardinality"] <= MAX_BARS
+
+
+def match_intent(prompt, profile):
+    """
+    Matches a "Show:" prompt to a plot template. Returns a dict with the kind of plot,
+    the resolved columns and the confidence, or None when no pattern fits.
+    """
+    text = _PREFIX.sub("", prompt).strip().rstrip(".!?")
+    chart = _CHART.match(text)
+    if chart:
+        text = text[chart.end():]
+    text = _ARTICLE.sub("", text)
+
+    for kind, confidence, pattern in _PATTERNS:
+        m = pattern.match(text)
+        if m is None:
+            continue
+        groups = m.groupdict()
+        intent = {"kind": kind, "agg": AGGREGATIONS.get((groups.get("agg") or "mean").lower(), "mean"),
+                  "x": None, "y": None, "confidence": confidence}
+        if kind == "line" and groups["x"].lower() in ("time", "the years", "years"):
+            intent["x"] = _time_column(profile)
+        else:
+            intent["x"], score = resolve_column(groups["x"], profile)
+            intent["confidence"] *= score
+        if groups.get("y"):
+            intent["y"], score = resolve_column(groups["y"], profile)
+            intent["confidence"] *= score
+        if _fits(intent):
+            return intent
+    return None
+
+
+def _fits(intent):
+    # The columns must exist and have types the template can plot
+    x, y, kind = intent["x"], intent["y"], intent["kind"]
+    if x is None or (kind in ("bar", "line") and y is None):
+        return False
+    if kind == "histogram":
+        return x["numeric"]
+    if kind == "count":
+        return _is_category(x)
+    if kind == "line":
+        return y["numeric"] and _is_time(x)
+    return y["numeric"] and _is_category(x) and x is not y
+
+
+def generate_code(intent, rows):
+    """
+    Plot code for the intent, to run after the primer code (df, fig and ax are defined)
+    """
+    kind = intent["kind"]
+    x = intent["x"]["name"]
+    y = intent["y"]["name"] if intent["y"] else None
+    if kind == "histogram":
+        return ("ax.hist(df[%r].dropna(), bins=30, edgecolor='white')\n"
+                "ax.set_xlabel(%r)\nax.set_ylabel('Count')\nax.set_title(%r)\n"
+                "fig.suptitle('')\n"
+                "reasoning = %r\n") % (
+            x, x, "Distribution of " + x,
+            "A histogram is the standard way to show the distribution of a single numeric column. "
+            "The values of '%s' are split into 30 equal-width bins and each bar shows how many rows fall "
+            "into a bin, which makes the center, spread, skew and outliers of the column visible." % x)
+    if kind == "count":
+        return ("counts = df[%r].value_counts()\n"
+                "counts = counts.head(%d)\n"
+                "ax.bar(counts.index.astype(str), counts.values)\n"
+                "ax.set_xlabel(%r)\nax.set_ylabel('Count')\nax.set_title(%r)\n"
+                "plt.setp(ax.get_xticklabels(), rotation=45, ha='right')\n"
+                "fig.suptitle('')\n"
+                "reasoning = %r\n") % (
+            x, MAX_BARS, x, "Number of rows by " + x,
+            "A bar chart compares counts across categories. Each bar is the number of rows for one value "
+            "of '%s', sorted from the most to the least frequent, keeping at most %d bars." % (x, MAX_BARS))
+    label = _AGG_WORDS[intent["agg"]] + " " + y
+    if kind == "bar":
+        if intent["x"]["cardinality"] > MAX_BARS:
+            body = "values = plot_bars(ax, df, %r, %r, agg=%r)\n" % (x, y, intent["agg"])
+        else:
+            body = ("values = df.groupby(%r, observed=True)[%r].agg(%r).sort_values(ascending=False)\n"
+                    "ax.bar(values.index.astype(str), values.values)\n") % (x, y, intent["agg"])
+        return (body +
+                "ax.set_xlabel(%r)\nax.set_ylabel(%r)\nax.set_title(%r)\n"
+                "plt.setp(ax.get_xticklabels(), rotation=45, ha='right')\n"
+                "fig.suptitle('')\n"
+                "reasoning = %r\n") % (
+            x, label, label + " by " + x,
+            "A bar chart is the clearest way to compare one numeric value across categories. The rows are "
+            "grouped by '%s' and '%s' is aggregated with the %s in each group, so each bar is one category, "
+            "sorted from the highest to the lowest value." % (x, y, intent["agg"]))
+    # Line over time: one point per time value, or the downsampling helper for many distinct values
+    if intent["x"]["cardinality"] > ROW_THRESHOLD:
+        body = "plot_line(ax, df, %r, %r)\n" % (x, y)
+    elif intent["x"]["cardinality"] < rows:
+        body = ("values = df.groupby(%r)[%r].agg(%r).sort_index()\n"
+                "ax.plot(values.index, values.values, marker='o')\n") % (x, y, intent["agg"])
+    else:
+        body = ("values = df[[%r, %r]].dropna().sort_values(%r)\n"
+                "ax.plot(values[%r], values[%r])\n") % (x, y, x, x, y)
+        label = y
+    return (body +
+            "ax.set_xlabel(%r)\nax.set_ylabel(%r)\nax.set_title(%r)\n"
+            "fig.suptitle('')\n"
+            "reasoning = %r\n") % (
+        x, label, label + " over " + x,
+        "A line plot shows how a value changes over time. '%s' is plotted against '%s' in time order; "
+        "when several rows share a time value they are combined with the %s, so the line shows the trend "
+        "instead of the spread within each period." % (y, x, intent["agg"]))
+
+
+def template_code(df_dataset, prompt, min_confidence=MIN_CONFIDENCE):
+    """
+    The plot code for a simple "Show:" prompt, or None when the prompt should go to ChatGPT
+    """
+    if not TEMPLATES_ENABLED:
+        return None
+    with span("template") as s:
+        profile = get_profile(df_dataset)
+        intent = match_intent(prompt, profile)
+        hit = intent is not None and intent["confidence"] >= min_confidence
+        s.set(outcome="hit" if hit else "miss")
+        if intent is not None:
+            s.set(intent=intent["kind"], confidence=round(intent["confidence"], 3))
+        with _lock:
+            _stats["hits" if hit else "misses"] += 1
+        if not hit:
+            return None
+        return generate_code(intent, profile["rows"])
+
+
+def template_stats():
+    """
+    Number of prompts answered from a template and sent to ChatGPT, and the hit rate
+    """
+    with _lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    return {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
@@ -0,0 +1,241 @@
+"""
+Speculative prefetch for "Explore:" answers. ChatGPT answers an Explore prompt with five numbered
+suggestions and users usually pick one of them next, which then waits on a full GPT-4 round trip.
+Once the suggestions are shown, their primers are built and their code is requested on a
+background thread (and the plots rendered), within a token budget per Explore answer. The code
+lands in the response cache and the render cache, and a "Show:" prompt matching a suggestion
+takes its code straight from here. Suggestions nobody picked within PREFETCH_TTL count as waste.
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from helpers import format_question, format_response, get_primer, run_requests
+from metrics import span
+from plot_executor import PlotExecutionError
+from plot_templates import MIN_CONFIDENCE, TEMPLATES_ENABLED, match_intent
+from profiling import dataset_fingerprint, get_profile
+from prompt_budget import count_tokens
+from render_cache import PLOT_DPI, PLOT_FORMAT, get_render_cache, render_key
+
+PREFETCH_ENABLED = os.environ.get("DATACHAT_PREFETCH", "on").lower() not in ("0", "off", "false", "no")
+PREFETCH_RENDER = os.environ.get("DATACHAT_PREFETCH_RENDER", "on").lower() not in ("0", "off", "false", "no")
+# Estimated tokens (prompts and answers) spent on the suggestions of one Explore answer
+PREFETCH_TOKENS = int(os.environ.get("DATACHAT_PREFETCH_TOKENS", 8000))
+# Seconds a prefetched suggestion is kept for the user to pick it
+PREFETCH_TTL = 600
+# Tokens set aside for each answer when checking the budget before a request
+ANSWER_TOKENS = 300
+MAX_SUGGESTIONS = 5
+CONCURRENCY = 3
+
+_SUGGESTION = re.compile(r"^\s*\d+[.)]\s*(.+?)\s*$")
+
+
+def parse_suggestions(text, limit=MAX_SUGGESTIONS):
+    """
+    The numbered prompts of an Explore answer, each as a "Show:" prompt
+    """
+    prompts = []
+    for line in text.splitlines():
+        match = _SUGGESTION.match(line)
+        if match:
+            prompt = match.group(1).strip("\"'` ")
+            if prompt:
+                prompts.append(prompt if prompt.lower().startswith("show:") else "Show: " + prompt)
+    return prompts[:limit]
+
+
+def prompt_key(prompt):
+    """
+    A prompt with case, spacing, quotes and trailing punctuation ignored, and with or without "Show:"
+    """
+    text = re.sub(r"\s+", " ", prompt.strip().strip("\"'` ").lower())
+    if text.startswith("show:"):
+        text = text[len("show:"):].strip()
+    return text.rstrip(".?! ")
+
+
+def _template_answers(df_dataset, prompt):
+    # Prompts the local templates answer are fast already
+    if not TEMPLATES_ENABLED:
+        return False
+    intent = match_intent(prompt, get_profile(df_dataset))
+    return intent is not None and intent["confidence"] >= MIN_CONFIDENCE
+
+
+class _Prefetched:
+    __slots__ = ("prompt", "code", "tokens", "expires")
+
+    def __init__(self, prompt, code, tokens, expires):
+        self.prompt = prompt
+        self.code = code
+        self.tokens = tokens
+        self.expires = expires
+
+
+class Prefetcher:
+    """
+    Code generated ahead of time for suggested prompts, by dataset fingerprint and prompt_key.
+    prefetch() returns at once, claim() hands out the code of a suggestion the user picked.
+    """
+
+    def __init__(self, token_budget=PREFETCH_TOKENS, ttl=PREFETCH_TTL, render=PREFETCH_RENDER, workers=1):
+        self.token_budget = token_budget
+        self.ttl = ttl
+        self.render = render
+        self.generated = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+        self.tokens = 0
+        self.wasted_tokens = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+    def _expire(self, now):
+        # Drops suggestions nobody picked in time, returns the tokens they cost
+        wasted = 0
+        for key in [k for k, entry in self._entries.items() if entry.expires <= now]:
+            wasted += self._entries.pop(key).tokens
+            self.wasted += 1
+        self.wasted_tokens += wasted
+        return wasted
+
+    def prefetch(self, df_dataset, df_name, suggestions, key, handoff="copy", executor=None, datasets=None):
+        """
+        Starts generating the code of the suggested prompts in the background, returns the Future
+        """
+        # The prefetch spans share the trace id of the Explore prompt
+        return self._threads.submit(contextvars.copy_context().run, self._prefetch, df_dataset, df_name, suggestions,
+                                    key, handoff, executor, datasets)
+
+    def _prefetch(self, df_dataset, df_name, suggestions, key, handoff, executor, datasets):
+        with span("prefetch", suggestions=len(suggestions), outcome="none") as s:
+            fingerprint = dataset_fingerprint(df_dataset)
+            with self._lock:
+                s.set(wasted_tokens=self._expire(time.monotonic()))
+                known = {k for (fp, k) in self._entries if fp == fingerprint}
+
+            prompts, questions, primers, spent = [], [], [], 0
+            skipped = {"template": 0, "known": 0, "over_budget": 0}
+            for prompt in suggestions:
+                if prompt_key(prompt) in known:
+                    skipped["known"] += 1
+                    continue
+                if _template_answers(df_dataset, prompt):
+                    skipped["template"] += 1
+                    continue
+                primer1, primer2 = get_primer(df_dataset, df_name, handoff, prompt)
+                question = format_question(primer1, primer2, prompt)
+                cost = count_tokens(question) + ANSWER_TOKENS
+                if spent + cost > self.token_budget:
+                    skipped["over_budget"] += 1
+                    continue
+                spent += cost
+                prompts.append(prompt)
+                questions.append(question)
+                primers.append(primer2)
+            s.set(requests=len(questions), **{"skipped_" + k: v for k, v in skipped.items()})
+            if not questions:
+                return
+
+            answers = run_requests(questions, key, fingerprint, limit=CONCURRENCY)
+            codes = []
+            tokens = 0
+            expires = time.monotonic() + self.ttl
+            with self._lock:
+                for prompt, question, answer in zip(prompts, questions, answers):
+                    if isinstance(answer, Exception):
+                        continue
+                    cost = count_tokens(question) + count_tokens(answer)
+                    tokens += cost
+                    self._entries[(fingerprint, prompt_key(prompt))] = _Prefetched(prompt, answer, cost, expires)
+                    self.generated += 1
+                    codes.append(answer)
+                self.tokens += tokens
+            s.set(outcome="generated" if codes else "failed", generated=len(codes), tokens=tokens)
+
+            if self.render and executor is not None:
+                rendered = 0
+                for primer2, answer in zip(primers, answers):
+                    if not isinstance(answer, Exception) and self._render(executor, format_response(primer2 + answer),
+                                                                          fingerprint, datasets):
+                        rendered += 1
+                s.set(rendered=rendered)
+
+    @staticmethod
+    def _render(executor, code, fingerprint, datasets):
+        cache = get_render_cache()
+        key = render_key(code, fingerprint)
+        if cache.get(key):
+            return True
+        job = executor.submit(code, datasets, image_format=PLOT_FORMAT, dpi=PLOT_DPI)
+        try:
+            image, reasoning = job.result()
+        except PlotExecutionError:
+            return False
+        cache.put(key, image, reasoning, job.figure)
+        return True
+
+    def claim(self, df_dataset, prompt):
+        """
+        The prefetched code for prompt on this dataset, or None. Every "Show:" prompt is
+        counted as a hit or miss on the prefetch_use span.
+        """
+        with span("prefetch_use", outcome="miss") as s:
+            entry_key = (dataset_fingerprint(df_dataset), prompt_key(prompt))
+            with self._lock:
+                s.set(wasted_tokens=self._expire(time.monotonic()))
+                entry = self._entries.pop(entry_key, None)
+                if entry is None:
+                    self.misses += 1
+                    return None
+                self.hits += 1
+            s.set(outcome="hit", suggestion=entry.prompt, tokens=entry.tokens)
+            return entry.code
+
+    def stats(self):
+        """
+        How many prefetched suggestions were picked, and the tokens spent on those that were not
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            return {"generated": self.generated, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / self.generated if self.generated else 0.0,
+                    "pending": len(self._entries), "wasted": self.wasted, "tokens": self.tokens,
+                    "wasted_tokens": self.wasted_tokens}
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+    return _prefetcher
+
+
+def prefetch_suggestions(df_dataset, df_name, answer, key, handoff="copy", executor=None, datasets=None):
+    """
+    Prefetches the suggestions of an Explore answer, returns the suggested prompts
+    """
+    suggestions = parse_suggestions(answer)
+    if PREFETCH_ENABLED and suggestions:
+        get_prefetcher().prefetch(df_dataset, df_name, suggestions, key, handoff, executor, datasets)
+    return suggestions
+
+
+def prefetched_code(df_dataset, prompt):
+    """
+    The code prefetched for a suggestion matching prompt, or None
+    """
+    if not PREFETCH_ENABLED:
+        return None
+    return get_prefetcher().claim(df_dataset, prompt)
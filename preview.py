@@ -0,0 +1,40 @@
+import math
+import pandas as pd
+import streamlit as st
+from fragments import fragment
+from profiling import get_profile
+
+PAGE_SIZE = 100
+
+
+def column_summary(profile):
+    """
+    One row per column with its type, number of distinct values and categorical values
+    """
+    return pd.DataFrame([{
+        "Column": col["name"],
+        "Type": col["dtype"],
+        "Distinct": col["cardinality"],
+        "Values": ", ".join(col["categories"]) if col["categories"] is not None else "",
+    } for col in profile["columns"]])
+
+
+# Paging only reruns the preview, not the whole chat script
+@fragment
+def dataset_preview(name, df_dataset, page_size=PAGE_SIZE):
+    """
+    Shows a summary of the dataset columns, taken from the cached profile, and one page of rows.
+    Only the rows of the current page are sliced and sent to the browser.
+    """
+    profile = get_profile(df_dataset)
+    st.subheader(name)
+    st.caption("%d rows, %d columns" % (profile["rows"], len(profile["columns"])))
+    with st.expander("Column summary"):
+        st.dataframe(column_summary(profile), hide_index=True)
+
+    pages = max(1, math.ceil(profile["rows"] / page_size))
+    # A page number per dataset, so switching datasets keeps each one's position
+    page = st.number_input("Page (of %d)" % pages, min_value=1, max_value=pages, value=1, step=1,
+                           key="preview_page_" + profile["fingerprint"])
+    start = (page - 1) * page_size
+    st.dataframe(df_dataset.iloc[start:start + page_size], hide_index=True)
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+# Columns with fewer distinct values than this are listed as categorical in the primers
+CATEGORICAL_LIMIT = 20
+
+# Profiles kept, least recently used ones are dropped past this
+MAX_PROFILES = int(os.environ.get("DATACHAT_PROFILE_CACHE_SIZE", 32))
+
+# Profiles keyed by the content fingerprint of the dataframe
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+# Fingerprints keyed by id() of the dataframe, so reruns don't rehash the same object
+_fingerprints = {}
+
+
+def dataset_fingerprint(df_dataset):
+    """
+    Returns a content fingerprint of the dataframe (column names, dtypes and values).
+    The hash is memoized per dataframe object, call invalidate_profile after
+    mutating a dataframe in place.
+    """
+    entry = _fingerprints.get(id(df_dataset))
+    if entry is not None and entry[0]() is df_dataset:
+        return entry[1]
+
+    h = hashlib.sha1()
+    h.update(repr(list(zip(df_dataset.columns, df_dataset.dtypes.astype(str)))).encode())
+    h.update(str(df_dataset.shape).encode())
+    h.update(pd.util.hash_pandas_object(df_dataset, index=True).values.tobytes())
+    fingerprint = h.hexdigest()
+
+    key = id(df_dataset)
+    try:
+        ref = weakref.ref(df_dataset, lambda _, key=key: _fingerprints.pop(key, None))
+    except TypeError:
+        return fingerprint
+    _fingerprints[key] = (ref, fingerprint)
+    return fingerprint
+
+
+def _is_numeric(dtype):
+    # Compact dtypes from ingest.py (int16, float32, ...) count as numeric too
+    return is_numeric_dtype(dtype) and not is_bool_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype)
+
+
+def _profile_column(name, column):
+    """
+    Profile a single column: dtype, number of distinct values and, for low
+    cardinality object or category columns, the list of values in order of appearance
+    """
+    dtype = column.dtype
+    uniques = column.unique()
+    categorical = isinstance(dtype, pd.CategoricalDtype)
+    info = {
+        "name": name,
+        "dtype": str(dtype),
+        "cardinality": len(uniques),
+        "categories": None,
+        "numeric": _is_numeric(dtype),
+    }
+    if len(uniques) < CATEGORICAL_LIMIT and (dtype == "O" or categorical):
+        info["categories"] = [str(x) for x in uniques]
+    return info
+
+
+def build_profile(df_dataset):
+    """
+    Walks every column of the dataframe once and returns its profile
+    """
+    return {
+        "fingerprint": dataset_fingerprint(df_dataset),
+        "rows": len(df_dataset),
+        "columns": [_profile_column(str(i), df_dataset[i]) for i in df_dataset.columns],
+        "head": df_dataset.head().to_string(),
+    }
+
+
+def get_profile(df_dataset):
+    """
+    Returns the cached profile of the dataframe, building it on first use
+    """
+    fingerprint = dataset_fingerprint(df_dataset)
+    with _profiles_lock:
+        profile = _profiles.get(fingerprint)
+        if profile is not None:
+            _profiles.move_to_end(fingerprint)
+            return profile
+    profile = build_profile(df_dataset)
+    with _profiles_lock:
+        _profiles[fingerprint] = profile
+        while len(_profiles) > MAX_PROFILES:
+            _profiles.popitem(last=False)
+    return profile
+
+
+def invalidate_profile(df_dataset=None):
+    """
+    Drops the cached fingerprint and profile of the dataframe.
+    Without an argument every cached profile is dropped.
+    """
+    if df_dataset is None:
+        with _profiles_lock:
+            _profiles.clear()
+        _fingerprints.clear()
+        return
+    entry = _fingerprints.pop(id(df_dataset), None)
+    if entry is not None:
+        with _profiles_lock:
+            _profiles.pop(entry[1], None)
+
+
+def refresh_profile(df_dataset):
+    """
+    Rebuilds the profile of a dataframe that has changed in place
+    """
+    invalidate_profile(df_dataset)
+    return get_profile(df_dataset)
+
+
+def numeric_columns(frames):
+    """
+    Names of the columns that are numeric in every dataframe holding them. Read from the
+    dtypes only, so it costs nothing on large frames.
+    """
+    numeric, other = set(), set()
+    for df_dataset in frames:
+        for name, dtype in df_dataset.dtypes.items():
+            (numeric if _is_numeric(dtype) else other).add(str(name))
+    return numeric - other
+
+
+def describe_columns(profile):
+    """
+    Text listing the categorical values and numeric types of each column,
+    shared by the code primer and the dataset description
+    """
+    desc = ""
+    for col in profile["columns"]:
+        if col["categories"] is not None:
+            desc = desc + "\nThe column '" + col["name"] + "' has categorical values '" + \
+                "','".join(col["categories"]) + "'. "
+        elif col["numeric"]:
+            desc = desc + "\nThe column '" + col["name"] + "' is type " + col["dtype"] + " and contains numeric values. "
+    return desc
@@ -0,0 +1,140 @@
+"""
+Token budget for the dataset part of the prompts. Small datasets keep the full column listing
+from profiling.describe_columns. Wide or high-cardinality datasets would overflow the prompt, so
+their columns are ranked by relevance to the user's question and listed in that order,
+with truncated value lists, until PRIMER_TOKEN_BUDGET is used up.
+"""
+import logging
+import math
+import os
+import re
+import threading
+
+PRIMER_TOKEN_BUDGET = int(os.environ.get("DATACHAT_PRIMER_TOKENS", 1500))
+# Categorical values listed per column once the primer is compacted
+MAX_VALUES = 8
+# Columns of the head rows kept in a compacted dataset description
+HEAD_COLUMNS = 8
+HEAD_WIDTH = 24
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+_DROPPED_NOTE = "\nThe dataframe has %d more columns that are not listed. "
+
+logger = logging.getLogger(__name__)
+
+# The tiktoken encoding, loaded on the first count: the first load downloads the BPE file,
+# which must not block startup or fail the import when offline. False once it failed.
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except ImportError:
+                _encoding = False
+            except Exception as e:
+                logger.warning("Loading the tiktoken encoding failed, token counts are estimated: %s", e)
+                _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    Number of GPT-4 tokens in text. Uses tiktoken when it is installed, otherwise an
+    estimate: one token per punctuation mark and per 4 characters of each word.
+    """
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return sum(math.ceil(len(w) / 4) for w in _WORD.findall(text))
+
+
+def _words(text):
+    return set(w.lower() for w in re.findall(r"[A-Za-z0-9]+", text))
+
+
+def rank_columns(profile, question):
+    """
+    Columns of the profile, most relevant to the question first. A column named in the
+    question ranks highest, then columns sharing words with it or whose values it mentions.
+    Ties keep categorical and numeric columns ahead of free text, in dataset order.
+    """
+    lowered = question.lower()
+    words = _words(question)
+
+    def score(item):
+        position, col = item
+        relevance = 0
+        if col["name"].lower() in lowered:
+            relevance += 10
+        relevance += 3 * len(_words(col["name"]) & words)
+        if col["categories"] is not None:
+            relevance += sum(1 for value in col["categories"] if value.lower() in words)
+        described = col["categories"] is not None or col["numeric"]
+        return (-relevance, not described, position)
+
+    return [col for _, col in sorted(enumerate(profile["columns"]), key=score)]
+
+
+def _column_line(col, max_values=MAX_VALUES):
+    if col["categories"] is not None:
+        values = col["categories"][:max_values]
+        more = len(col["categories"]) - len(values)
+        return "\nThe column '" + col["name"] + "' has categorical values '" + "','".join(values) + "'" + \
+            (" and " + str(more) + " more" if more > 0 else "") + ". "
+    if col["numeric"]:
+        return "\nThe column '" + col["name"] + "' is type " + col["dtype"] + " and contains numeric values. "
+    return ""
+
+
+def budget_columns(profile, question, budget, full_names, full_details):
+    """
+    Returns the column names (joined for the primer) and column details for the prompt,
+    plus a report of the tokens used and saved. full_names and full_details are the
+    uncompacted texts, returned unchanged when they fit within budget.
+    """
+    full_tokens = count_tokens(full_names) + count_tokens(full_details)
+    if full_tokens <= budget:
+        return full_names, full_details, {"budget_tokens": full_tokens, "unbudgeted_tokens": full_tokens, "tokens_saved": 0,
+                                          "columns_kept": len(profile["columns"]), "compacted": False}
+
+    # Greedily add columns by relevance, name and details first, then only their names
+    ranked = rank_columns(profile, question)
+    detailed, listed = [], []
+    used = count_tokens(_DROPPED_NOTE % len(ranked))
+    for col in ranked:
+        cost = count_tokens("'" + col["name"] + "',") + count_tokens(_column_line(col))
+        if used + cost > budget:
+            break
+        detailed.append(col)
+        used += cost
+    for col in ranked[len(detailed):]:
+        cost = count_tokens("'" + col["name"] + "',")
+        if used + cost > budget:
+            break
+        listed.append(col)
+        used += cost
+
+    kept = set(id(col) for col in detailed + listed)
+    names = "','".join(col["name"] for col in profile["columns"] if id(col) in kept)
+    details = "".join(_column_line(col) for col in detailed)
+    dropped = len(profile["columns"]) - len(kept)
+    if dropped:
+        details += _DROPPED_NOTE % dropped
+    tokens = count_tokens(names) + count_tokens(details)
+    return names, details, {"budget_tokens": tokens, "unbudgeted_tokens": full_tokens, "tokens_saved": full_tokens - tokens,
+                            "columns_kept": len(kept), "compacted": True}
+
+
+def compact_head(df_dataset, columns, width=HEAD_WIDTH):
+    """
+    The head rows restricted to the given columns, long values cut to width characters
+    """
+    keep = set(columns)
+    head = df_dataset.head()[[c for c in df_dataset.columns if str(c) in keep]].astype(str)
+    return head.apply(lambda s: s.str.slice(0, width)).to_string()
@@ -0,0 +1,219 @@
+"""
+Reuse of generated plot code for rephrased prompts. The response cache only matches the exact
+prompt, so "Show: avg price by brand" and "show average price per brand" both go to ChatGPT.
+This index keeps the prompts answered by run_request per dataset fingerprint, as normalized
+tokens with their MinHash signature and the columns and values they mention. A new prompt close
+enough to a past one, mentioning the same columns, values and numbers and asking for the same
+kind of plot, gets its code: "price where Heating is GasW" never reuses the plot of GasA.
+"""
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+from metrics import span
+from profiling import dataset_fingerprint, get_profile
+
+SIMILARITY_THRESHOLD = float(os.environ.get("DATACHAT_SIMILAR_THRESHOLD", 0.8))
+SIMILAR_ENABLED = os.environ.get("DATACHAT_SIMILAR_PROMPTS", "on").lower() not in ("0", "off", "false", "no")
+NUM_PERM = 64
+# Prompts remembered per dataset, the oldest are dropped first
+MAX_PROMPTS = 500
+
+_PHRASES = [(re.compile(p), r) for p, r in (
+    (r"\bfor (each|every)\b", "by"), (r"\bas a function of\b", "by"), (r"\bcompared to\b", "versus"),
+)]
+SYNONYMS = {
+    "avg": "mean", "average": "mean", "total": "sum", "per": "by", "across": "by", "vs": "versus",
+    "against": "versus", "number": "count", "distribution": "histogram", "frequency": "count",
+    "graph": "chart", "plot": "chart", "biggest": "largest", "highest": "largest", "top": "largest",
+    "lowest": "smallest", "bottom": "smallest",
+}
+STOPWORDS = {"a", "an", "the", "of", "me", "please", "show", "chart", "and", "in", "for", "with", "to", "i", "want", "see"}
+# Words that change what is plotted: two prompts are only alike if these agree
+OPERATIONS = {
+    "mean", "sum", "median", "max", "min", "count", "histogram", "bar", "line", "pie", "scatter", "box",
+    "heatmap", "versus", "over", "time", "largest", "smallest", "trend", "correlation", "stacked", "percent",
+}
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def _stem(word):
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize(text):
+    """
+    Lowercase word tokens of a prompt with synonyms unified, plurals stemmed and filler words dropped
+    """
+    text = text.lower()
+    for pattern, replacement in _PHRASES:
+        text = pattern.sub(replacement, text)
+    words = (SYNONYMS.get(w, w) for w in re.findall(r"[a-z0-9]+", text))
+    return [_stem(w) for w in words if w not in STOPWORDS]
+
+
+def _column_tokens(name):
+    return [_stem(SYNONYMS.get(w, w)) for w in re.findall(r"[a-z0-9]+", name.lower())]
+
+
+def mentioned_columns(tokens, columns):
+    """
+    The column names whose tokens appear in order in the prompt tokens
+    """
+    found = set()
+    text = " " + " ".join(tokens) + " "
+    for name in columns:
+        column = " ".join(_column_tokens(name))
+        if column and " " + column + " " in text:
+            found.add(name)
+    # A column whose name is part of a longer mentioned one ("Price" in "Sale Price") is not a mention of its own
+    return frozenset(name for name in found
+                     if not any(other != name and " ".join(_column_tokens(name)) in " ".join(_column_tokens(other))
+                                for other in found))
+
+
+def mentioned_values(prompt, values):
+    """
+    The categorical values and the numbers written in the prompt. Values are matched on the raw
+    words of the prompt, as filler words and synonyms ("top", "a") can be values too.
+    """
+    text = " " + " ".join(re.findall(r"[a-z0-9]+", prompt.lower())) + " "
+    found = set(re.findall(r"\d+(?:\.\d+)?", prompt))
+    for value in values:
+        words = re.findall(r"[a-z0-9]+", value.lower())
+        if words and " " + " ".join(words) + " " in text:
+            found.add(value)
+    return frozenset(found)
+
+
+def shingles(tokens):
+    return set(tokens) | set(a + " " + b for a, b in zip(tokens, tokens[1:]))
+
+
+def minhash(items):
+    """
+    MinHash signature of a set of strings, NUM_PERM values whose agreement estimates the Jaccard similarity
+    """
+    if not items:
+        return np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    hashes = np.array([zlib.crc32(item.encode()) & 0x7FFFFFFF for item in items], dtype=np.uint64)
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0)
+
+
+class _Entry:
+    __slots__ = ("prompt", "shingles", "columns", "values", "operations", "code")
+
+    def __init__(self, prompt, shingles, columns, values, operations, code):
+        self.prompt = prompt
+        self.shingles = shingles
+        self.columns = columns
+        self.values = values
+        self.operations = operations
+        self.code = code
+
+
+class PromptIndex:
+    """
+    Past prompts and their generated code per dataset fingerprint. lookup() returns the code of
+    the most similar past prompt that mentions the same columns and values and asks for the same
+    operations. values are the categorical values of the dataset, as listed in its profile.
+    """
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, max_prompts=MAX_PROMPTS):
+        self.threshold = threshold
+        self.max_prompts = max_prompts
+        self._datasets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _features(prompt, columns, values):
+        tokens = normalize(prompt)
+        return (shingles(tokens), mentioned_columns(tokens, columns), mentioned_values(prompt, values),
+                frozenset(t for t in tokens if t in OPERATIONS))
+
+    def add(self, fingerprint, prompt, code, columns, values=()):
+        items, mentioned, filters, operations = self._features(prompt, columns, values)
+        with self._lock:
+            entries = self._datasets.setdefault(fingerprint, OrderedDict())
+            key = frozenset(items)
+            entries[key] = (_Entry(prompt, items, mentioned, filters, operations, code), minhash(items))
+            entries.move_to_end(key)
+            while len(entries) > self.max_prompts:
+                entries.popitem(last=False)
+
+    def lookup(self, fingerprint, prompt, columns, values=()):
+        """
+        Returns (code, similarity, past prompt) for the closest past prompt, or None when no
+        past prompt comes within 0.15 of the threshold
+        """
+        items, mentioned, filters, operations = self._features(prompt, columns, values)
+        with self._lock:
+            entries = list(self._datasets.get(fingerprint, {}).values())
+        if not entries or not items:
+            return None
+        # MinHash agreement picks the candidates, the exact Jaccard similarity decides
+        signature = minhash(items)
+        estimates = (np.stack([sig for _, sig in entries]) == signature).mean(axis=1)
+        best = None
+        for i in np.flatnonzero(estimates >= self.threshold - 0.15):
+            entry = entries[i][0]
+            if entry.columns != mentioned or entry.values != filters or entry.operations != operations:
+                continue
+            similarity = len(items & entry.shingles) / len(items | entry.shingles)
+            if best is None or similarity > best[1]:
+                best = (entry.code, similarity, entry.prompt)
+        return best
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_prompt_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PromptIndex()
+    return _index
+
+
+def _names_and_values(df_dataset):
+    # The column names and the values of the low-cardinality columns, from the cached profile
+    columns = get_profile(df_dataset)["columns"]
+    return [c["name"] for c in columns], [v for c in columns for v in c["categories"] or ()]
+
+
+def similar_code(df_dataset, prompt):
+    """
+    Code generated earlier for a prompt like this one on the same dataset, or None.
+    Every decision is logged on the similar_prompt span with the similarity and matched prompt.
+    """
+    if not SIMILAR_ENABLED:
+        return None
+    with span("similar_prompt", outcome="miss") as s:
+        index = get_prompt_index()
+        match = index.lookup(dataset_fingerprint(df_dataset), prompt, *_names_and_values(df_dataset))
+        if match is None:
+            return None
+        code, similarity, past_prompt = match
+        s.set(similarity=round(similarity, 3), prompt=prompt, matched_prompt=past_prompt)
+        if similarity < index.threshold:
+            return None
+        s.set(outcome="hit")
+        return code
+
+
+def remember_code(df_dataset, prompt, code):
+    """
+    Adds the code generated for prompt to the index of the dataset
+    """
+    if SIMILAR_ENABLED and code:
+        get_prompt_index().add(dataset_fingerprint(df_dataset), prompt, code, *_names_and_values(df_dataset))
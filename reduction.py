@@ -0,0 +1,148 @@
+"""
+Data reduction for plotting large datasets. These helpers are defined in the namespace the
+generated code runs in, and get_primer tells the model to use them once a dataset is above
+ROW_THRESHOLD rows. Below the threshold they plot the raw data unchanged.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+ROW_THRESHOLD = int(os.environ.get("DATACHAT_REDUCE_ROWS", 50_000))
+# Points kept per line by the downsampling
+LINE_POINTS = 2_000
+HEXBIN_GRIDSIZE = 80
+MAX_BARS = 30
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling. x must be sorted ascending.
+    Returns the indices of the n_out points that best preserve the shape of the line.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    # Bucket edges for the n - 2 points between the fixed first and last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket is the third corner of the triangle
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+        indices[i + 1] = a
+    return indices
+
+
+def downsample(df, x, y, n_out=LINE_POINTS, threshold=None):
+    """
+    Returns df sorted by x and, above the row threshold, reduced to about n_out rows per y
+    column with LTTB. y can be a column name or a list of them.
+    """
+    threshold = ROW_THRESHOLD if threshold is None else threshold
+    ys = [y] if isinstance(y, str) else list(y)
+    data = df[[x] + [c for c in ys if c != x]].dropna().sort_values(x)
+    if len(data) <= threshold:
+        return data
+    xs = data[x]
+    numeric_x = xs.astype("int64") if pd.api.types.is_datetime64_any_dtype(xs) else xs
+    keep = np.unique(np.concatenate([lttb(numeric_x.to_numpy(), data[c].to_numpy(), n_out) for c in ys]))
+    return data.iloc[keep]
+
+
+def plot_line(ax, df, x, y, **kwargs):
+    """
+    Line plot of y over x, downsampled with LTTB above the row threshold
+    """
+    ys = [y] if isinstance(y, str) else list(y)
+    label = kwargs.pop("label", None)
+    data = downsample(df, x, ys)
+    for column in ys:
+        ax.plot(data[x], data[column], label=label if label and len(ys) == 1 else column, **kwargs)
+    return data
+
+
+def bin_2d(df, x, y, bins=HEXBIN_GRIDSIZE):
+    """
+    Counts of df in a bins x bins grid over x and y, as a dataframe of bin centers and counts
+    """
+    data = df[[x, y]].dropna()
+    counts, x_edges, y_edges = np.histogram2d(data[x], data[y], bins=bins)
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    xi, yi = np.nonzero(counts)
+    return pd.DataFrame({x: x_centers[xi], y: y_centers[yi], "count": counts[xi, yi]})
+
+
+def plot_scatter(ax, df, x, y, **kwargs):
+    """
+    Scatter plot of y against x. Above the row threshold the points are aggregated
+    into a hexbin density plot, whose cost does not grow with the number of rows.
+    """
+    data = df[[x, y]].dropna()
+    if len(data) <= ROW_THRESHOLD:
+        return ax.scatter(data[x], data[y], **kwargs)
+    kwargs.pop("s", None)
+    kwargs.pop("alpha", None)
+    hexbin = ax.hexbin(data[x], data[y], gridsize=HEXBIN_GRIDSIZE, mincnt=1, bins="log",
+                       cmap=kwargs.pop("cmap", "viridis"), **kwargs)
+    ax.figure.colorbar(hexbin, ax=ax, label="count")
+    return hexbin
+
+
+def aggregate(df, x, y=None, agg="mean", max_bars=MAX_BARS):
+    """
+    Aggregates y by the categories of x (row counts when y is None), keeping the
+    max_bars largest categories and folding the rest into "Other"
+    """
+    groups = df.groupby(x, observed=True)
+    values = groups.size() if y is None else groups[y].agg(agg)
+    if len(values) > max_bars:
+        top = values.nlargest(max_bars - 1)
+        rest = df[~df[x].isin(top.index)]
+        other = len(rest) if y is None else rest[y].agg(agg)
+        values = pd.concat([top, pd.Series({"Other": other})])
+    return values
+
+
+def plot_bars(ax, df, x, y=None, agg="mean", **kwargs):
+    """
+    Bar chart of y aggregated by x, computed once on the whole frame and capped to MAX_BARS bars
+    """
+    values = aggregate(df, x, y, agg)
+    ax.bar(values.index.astype(str), values.values, **kwargs)
+    return values
+
+
+def namespace():
+    """
+    The helpers that are defined for the generated code
+    """
+    return {
+        "downsample": downsample,
+        "plot_line": plot_line,
+        "plot_scatter": plot_scatter,
+        "plot_bars": plot_bars,
+        "aggregate": aggregate,
+        "bin_2d": bin_2d,
+    }
+
+
+def primer_hint(rows):
+    """
+    Instruction added to the primer for datasets above the row threshold
+    """
+    if rows <= ROW_THRESHOLD:
+        return ""
+    return ("\nThe dataframe has " + str(rows) + " rows, so do not plot the raw rows. These functions are already"
+            " defined, do not import or redefine them: plot_line(ax, df, x, y) for line plots (y can be a list),"
+            " plot_scatter(ax, df, x, y) for scatter plots, plot_bars(ax, df, x, y, agg='mean') for bar charts"
+            " (y=None counts rows), and aggregate(df, x, y, agg) which returns the aggregated series.")
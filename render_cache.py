@@ -0,0 +1,119 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from code_optimizer import normalized_code
+
+# Output of the rendered plots for this deployment: png, webp or svg, and the resolution
+PLOT_FORMAT = os.environ.get("DATACHAT_PLOT_FORMAT", "png").lower()
+PLOT_DPI = int(os.environ.get("DATACHAT_PLOT_DPI", 100))
+RENDER_CACHE_MB = int(os.environ.get("DATACHAT_RENDER_CACHE_MB", 64))
+
+PLOT_FORMATS = ("png", "webp", "svg")
+if PLOT_FORMAT not in PLOT_FORMATS:
+    raise ValueError("DATACHAT_PLOT_FORMAT must be one of " + ", ".join(PLOT_FORMATS))
+
+
+def normalize_code(code):
+    """
+    Normalizes generated code for use in a cache key: formatting, comments, file I/O and
+    show() calls do not change the plot (see code_optimizer). Code that does not parse only
+    has trailing whitespace, blank lines and full-line comments removed.
+    """
+    normalized = normalized_code(code)
+    if normalized is not None:
+        return normalized
+    lines = []
+    for line in code.splitlines():
+        line = line.rstrip()
+        if line and not line.lstrip().startswith("#"):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def render_key(code, fingerprint, image_format=PLOT_FORMAT, dpi=PLOT_DPI):
+    """
+    Content address of a rendered plot: the normalized code, the fingerprint of the
+    dataset it runs on and the output settings
+    """
+    h = hashlib.sha256()
+    for part in (normalize_code(code), fingerprint or "", image_format, str(dpi)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def to_image(data, image_format=PLOT_FORMAT):
+    """
+    Wraps encoded plot bytes in what st.image accepts, SVG has to be passed as markup
+    """
+    if image_format == "svg":
+        return data.decode("utf-8")
+    return io.BytesIO(data)
+
+
+class RenderCache:
+    """
+    In-memory LRU cache of rendered plots (encoded bytes and the reasoning string, and what
+    the figure shows for "Describe it"), bounded by the total size of the images it holds
+    """
+
+    def __init__(self, max_bytes=RENDER_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[:2]
+
+    def figure(self, key):
+        """
+        The figure metadata stored with a plot (see figure_info.py), or None.
+        Not counted as a hit or miss, it is read after get() found the plot.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[2] if entry else None
+
+    def put(self, key, data, reasoning, figure=None):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[0])
+            self._entries[key] = (data, reasoning, figure)
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self.bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """
+    Returns the process-wide render cache
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache()
+    return _cache
@@ -0,0 +1,147 @@
+"""
+Large uploads handed to the plot workers through memory-mapped files instead of a pickled copy
+per worker. The parent writes a frame once per fingerprint: every numeric, boolean or datetime
+column (and the codes of a category column) as a .npy file, the remaining columns and the index
+in one pickle. The workers map the .npy files read-only, so the operating system keeps one copy
+of the data in the page cache however many workers use it. Under copy-on-write a write to such
+a column copies it first, without copy-on-write it raises as the arrays are read-only.
+"""
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Frames of at least this many MB are shared through files, smaller ones are pickled to each worker
+SHARE_MIN_MB = int(os.environ.get("DATACHAT_SHARED_FRAMES_MB", 64))
+SHARE_DIR = os.environ.get("DATACHAT_SHARED_FRAMES_DIR") or tempfile.gettempdir()
+# Frames kept on disk, the least recently used directory is removed past this
+MAX_SHARED_FRAMES = 8
+
+logger = logging.getLogger(__name__)
+
+
+def frame_bytes(df):
+    """
+    In-memory size of the frame without inspecting object cells, cheap on large frames
+    """
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+
+def _mappable(column):
+    import numpy as np
+    return isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufcmM"
+
+
+def write_frame(df, path):
+    """
+    Writes df to the directory path, returns the number of bytes the workers will map
+    """
+    import numpy as np
+    import pandas as pd
+
+    os.makedirs(path)
+    layout, rest, mapped = [], {}, 0
+    for i, (_, column) in enumerate(df.items()):
+        if _mappable(column):
+            values = column.to_numpy()
+            np.save(os.path.join(path, "%d.npy" % i), values)
+            layout.append(("array", None))
+            mapped += values.nbytes
+        elif isinstance(column.dtype, pd.CategoricalDtype) and len(column):
+            codes = column.cat.codes.to_numpy()
+            np.save(os.path.join(path, "%d.npy" % i), codes)
+            layout.append(("category", column.dtype))
+            mapped += codes.nbytes
+        else:
+            rest[i] = column.array
+            layout.append(("pickled", None))
+    with open(os.path.join(path, "frame.pkl"), "wb") as f:
+        pickle.dump({"columns": df.columns, "index": df.index, "layout": layout, "rest": rest}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    return mapped
+
+
+def read_frame(path):
+    """
+    The frame written to path, its array columns memory-mapped read-only
+    """
+    import numpy as np
+    import pandas as pd
+
+    with open(os.path.join(path, "frame.pkl"), "rb") as f:
+        meta = pickle.load(f)
+    columns = {}
+    for i, (kind, dtype) in enumerate(meta["layout"]):
+        if kind == "array":
+            columns[i] = np.load(os.path.join(path, "%d.npy" % i), mmap_mode="r")
+        elif kind == "category":
+            columns[i] = pd.Categorical.from_codes(np.load(os.path.join(path, "%d.npy" % i), mmap_mode="r"),
+                                                   dtype=dtype)
+        else:
+            columns[i] = meta["rest"][i]
+    # Built from a dict with copy=False the columns stay separate blocks, nothing is consolidated
+    df = pd.DataFrame(columns, index=meta["index"], copy=False)
+    df.columns = meta["columns"]
+    return df
+
+
+def mapped_bytes(path):
+    """
+    Bytes of the files read_frame maps from path
+    """
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.name.endswith(".npy"))
+
+
+class SharedFrames:
+    """
+    Directory of the frames shared with the workers of one executor, keyed by fingerprint
+    """
+
+    def __init__(self, root=SHARE_DIR, min_bytes=SHARE_MIN_MB * 1024 * 1024, max_frames=MAX_SHARED_FRAMES):
+        self.root = root
+        self.min_bytes = min_bytes
+        self.max_frames = max_frames
+        self._dir = None
+        self._paths = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, fingerprint, df):
+        """
+        The directory holding df, written on first use, or None when df is small enough to be
+        pickled or could not be written (the caller pickles it then)
+        """
+        if frame_bytes(df) < self.min_bytes:
+            return None
+        with self._lock:
+            path = self._paths.get(fingerprint)
+            if path is not None:
+                self._paths.move_to_end(fingerprint)
+                return path
+            path = None
+            try:
+                if self._dir is None:
+                    self._dir = tempfile.mkdtemp(prefix="datachat-frames-", dir=self.root)
+                path = os.path.join(self._dir, fingerprint)
+                write_frame(df, path)
+            except OSError as e:
+                # Out of disk space or no temp dir: the frame is pickled to the worker as before
+                if path is not None:
+                    shutil.rmtree(path, ignore_errors=True)
+                logger.warning("Sharing a %d MB frame failed, pickling it: %s", frame_bytes(df) // 2 ** 20, e)
+                return None
+            self._paths[fingerprint] = path
+            while len(self._paths) > self.max_frames:
+                # Workers that mapped the files keep their data after the unlink
+                _, evicted = self._paths.popitem(last=False)
+                shutil.rmtree(evicted, ignore_errors=True)
+            return path
+
+    def close(self):
+        with self._lock:
+            if self._dir is not None:
+                shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+            self._paths.clear()
@@ -0,0 +1,459 @@
+"""
+Embedded SQL engine for "Show:" prompts on large datasets. Pandas code from ChatGPT scans the
+whole dataframe for every chart, in the plot worker that also holds a copy of it. Past SQL_ROWS
+rows ChatGPT is given the table schema instead and writes one aggregation query plus the code
+that plots its result. The query runs on a process-wide copy of the dataset in SQLite (in
+memory), or in DuckDB with DATACHAT_SQL_ENGINE=duckdb when it is installed, and only the small
+result frame goes to the plot executor. Tables, the indexes built for filtered columns and the
+query results are kept per dataset fingerprint, so the next questions on the same dataset
+reuse them.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_float_dtype, is_integer_dtype
+from helpers import chat_completion
+from metrics import annotate, span, traced
+from profiling import dataset_fingerprint, describe_columns, get_profile
+from prompt_budget import PRIMER_TOKEN_BUDGET, budget_columns, count_tokens
+
+# sqlite, duckdb (falls back to sqlite when it is not installed) or off
+SQL_ENGINE = os.environ.get("DATACHAT_SQL_ENGINE", "sqlite").lower()
+# Datasets with at least this many rows get the SQL path
+SQL_ROWS = int(os.environ.get("DATACHAT_SQL_ROWS", 200_000))
+# Datasets kept loaded in the engine, and query results kept per dataset
+SQL_TABLES = int(os.environ.get("DATACHAT_SQL_TABLES", 4))
+MAX_RESULTS = 64
+# A column gets an index once this many queries have filtered on it
+INDEX_AFTER = 2
+# A query must aggregate the data to at most this many rows
+MAX_RESULT_ROWS = 5_000
+QUERY_TIMEOUT = 30
+LOAD_CHUNK_ROWS = 100_000
+TABLE = "data"
+# Name of the query result in the datasets sent to the plot executor
+QUERY_RESULT = "Query result"
+
+SQL_ENGINES = ("off", "sqlite", "duckdb")
+if SQL_ENGINE not in SQL_ENGINES:
+    raise ValueError("DATACHAT_SQL_ENGINE must be one of " + ", ".join(SQL_ENGINES))
+
+_SQL_BLOCK = re.compile(r"```sql\s*\n(.*?)```", re.S | re.I)
+_PYTHON_BLOCK = re.compile(r"```(?:python|py)?\s*\n(.*?)```", re.S | re.I)
+_WHERE = re.compile(r"\bWHERE\b(.*?)(?=\bGROUP\s+BY\b|\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\bWINDOW\b|\)|$)",
+                    re.S | re.I)
+# The name of a common table expression: WITH [RECURSIVE] name [(columns)] AS (, or , name AS (
+_CTE_NAME = re.compile(r'(?:\bWITH\s+(?:RECURSIVE\s+)?|,\s*)(?:"((?:[^"]|"")*)"|([A-Za-z_]\w*))\s*(?:\(([^()]*)\)\s*)?AS\s*\(',
+                       re.I)
+# SQLite actions a query may take, everything else (writes, attach, pragmas) is denied
+_ALLOWED = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+# A table function or a quoted path in a FROM clause, and the DuckDB functions reading files or databases
+_EXTERNAL_SOURCE = re.compile(r"\b(?:FROM|JOIN)\s+(?:'|[A-Za-z_][\w.]*\s*\()|"
+                              r"\b(?:read_\w+|\w+_scan|glob|query|query_table|sniff_csv|st_read)\s*\(", re.I)
+
+logger = logging.getLogger(__name__)
+
+
+class SQLQueryError(ValueError):
+    """
+    The answer had no usable query, or the query failed, was not read-only or did not aggregate
+    """
+
+
+def use_sql_engine(df_dataset):
+    return SQL_ENGINE != "off" and len(df_dataset) >= SQL_ROWS
+
+
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def check_query(query):
+    """
+    The query without its trailing semicolon, if it is a single SELECT statement
+    """
+    query = query.strip().rstrip(";").strip()
+    if not re.match(r"(SELECT|WITH)\b", query, re.I):
+        raise SQLQueryError("only SELECT queries can run")
+    if ";" in re.sub(r"'(?:[^']|'')*'", "''", query):
+        raise SQLQueryError("only one statement can run")
+    return query
+
+
+def check_sources(query):
+    """
+    DuckDB reads files, urls and other databases named in a FROM clause. Table functions
+    (read_csv, read_parquet, ...) and quoted paths are rejected, the table is the only source.
+    """
+    if _EXTERNAL_SOURCE.search(re.sub(r"'(?:[^']|'')*'", "''", query)):
+        raise SQLQueryError("the query can only read the table %s" % TABLE)
+
+
+def normalize_query(query):
+    # Queries differing in whitespace only share their result
+    parts = re.split(r"('(?:[^']|'')*')", query)
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)).strip()
+
+
+def split_answer(answer):
+    """
+    The query and the plotting code of an answer to the SQL primer
+    """
+    match = _SQL_BLOCK.search(answer)
+    if match is None:
+        raise SQLQueryError("the answer has no SQL query")
+    query = check_query(match.group(1))
+    rest = answer[:match.start()] + answer[match.end():]
+    code = _PYTHON_BLOCK.search(rest)
+    return query, (code.group(1) if code else rest).strip() + "\n"
+
+
+def filter_columns(query, columns):
+    """
+    The table columns a query filters on, candidates for an index
+    """
+    used = []
+    for clause in _WHERE.findall(query):
+        for name in columns:
+            if name not in used and (quote(name) in clause or re.search(r"\b%s\b" % re.escape(name), clause)):
+                used.append(name)
+    return used
+
+
+def check_identifiers(query, columns):
+    """
+    SQLite reads a double-quoted name that is not a column as a string, so a misspelt
+    column would group or filter on a constant. Quoted names must be columns or aliases.
+    """
+    text = re.sub(r"'(?:[^']|'')*'", "''", query)
+    aliases = {m.replace('""', '"') for m in re.findall(r'\bAS\s+"((?:[^"]|"")*)"', text, re.I)}
+    # Unquoted aliases (AS avg_price) and the names and columns of common table expressions (WITH t AS (...)),
+    # the engines match unquoted names without regard to case
+    unquoted = {m.lower() for m in re.findall(r"\bAS\s+([A-Za-z_]\w*)", text, re.I)}
+    for quoted, name, listed in _CTE_NAME.findall(text):
+        if quoted:
+            aliases.add(quoted.replace('""', '"'))
+        for item in [name] + listed.split(","):
+            item = item.strip()
+            if item.startswith('"'):
+                aliases.add(item[1:-1].replace('""', '"'))
+            elif item:
+                unquoted.add(item.lower())
+    for name in re.findall(r'"((?:[^"]|"")*)"', text):
+        name = name.replace('""', '"')
+        if name not in columns and name not in aliases and name.lower() not in unquoted and name != TABLE:
+            raise SQLQueryError('the table has no column named "%s"' % name)
+
+
+def _values(column):
+    """
+    The values of a column as SQLite binds them, NaN is stored as NULL
+    """
+    if is_datetime64_any_dtype(column.dtype):
+        return column.dt.strftime("%Y-%m-%d %H:%M:%S").tolist()
+    if isinstance(column.dtype, np.dtype):
+        return column.tolist()
+    # Categories and nullable dtypes: pd.NA can not be bound
+    return column.astype(object).where(column.notna(), None).tolist()
+
+
+def _sql_type(dtype, engine):
+    if is_bool_dtype(dtype) or is_integer_dtype(dtype):
+        return "INTEGER"
+    if is_float_dtype(dtype):
+        return "REAL"
+    if is_datetime64_any_dtype(dtype):
+        # SQLite has no date type, dates are stored as text
+        return "TIMESTAMP" if engine == "duckdb" else "TEXT"
+    return "TEXT"
+
+
+class _SQLiteTable:
+    """
+    A dataset copied into an in-memory SQLite database. Building an index costs more than a
+    scan of the table, so a column gets one when the second query filters on it.
+    """
+    engine = "sqlite"
+
+    def __init__(self, df_dataset):
+        self.columns = [str(c) for c in df_dataset.columns]
+        self.indexes = set()
+        self.uses = Counter()
+        self._con = sqlite3.connect(":memory:", check_same_thread=False)
+        self._con.execute("CREATE TABLE %s (%s)" % (TABLE, ", ".join(
+            quote(name) + " " + _sql_type(dtype, self.engine) for name, dtype in zip(self.columns, df_dataset.dtypes))))
+        insert = "INSERT INTO %s VALUES (%s)" % (TABLE, ", ".join("?" * len(self.columns)))
+        # Column by column tolist() is much faster than to_sql, in chunks to bound the Python objects
+        for start in range(0, len(df_dataset), LOAD_CHUNK_ROWS):
+            part = df_dataset.iloc[start:start + LOAD_CHUNK_ROWS]
+            self._con.executemany(insert, zip(*[_values(part.iloc[:, i]) for i in range(len(self.columns))]))
+        self._con.commit()
+
+    def index(self, columns):
+        built = []
+        for name in columns:
+            self.uses[name] += 1
+            if name not in self.indexes and self.uses[name] >= INDEX_AFTER:
+                self._con.execute("CREATE INDEX %s ON %s (%s)" % (quote("ix_" + name), TABLE, quote(name)))
+                self.indexes.add(name)
+                built.append(name)
+        if built:
+            self._con.execute("ANALYZE")
+        return built
+
+    def execute(self, query, limit, timeout):
+        check_identifiers(query, self.columns)
+        deadline = time.monotonic() + timeout
+        self._con.set_authorizer(lambda action, *args: sqlite3.SQLITE_OK if action in _ALLOWED else sqlite3.SQLITE_DENY)
+        self._con.set_progress_handler(lambda: time.monotonic() > deadline, 10_000)
+        try:
+            cursor = self._con.execute(query)
+            rows = cursor.fetchmany(limit)
+            names = [d[0] for d in cursor.description]
+        except sqlite3.OperationalError as e:
+            if time.monotonic() > deadline:
+                raise SQLQueryError("the query ran for more than %d seconds" % timeout)
+            raise SQLQueryError(str(e))
+        except sqlite3.Error as e:
+            raise SQLQueryError(str(e))
+        finally:
+            self._con.set_authorizer(None)
+            self._con.set_progress_handler(None, 0)
+        return pd.DataFrame.from_records(rows, columns=names)
+
+    def close(self):
+        self._con.close()
+
+
+class _DuckDBTable:
+    """
+    A dataset registered with DuckDB, which scans the dataframe's columns in place. Once it
+    is registered the connection loses access to files, urls and extensions, and the setting
+    is locked so a query cannot turn it back on.
+    """
+    engine = "duckdb"
+
+    def __init__(self, df_dataset):
+        import duckdb
+
+        self.columns = [str(c) for c in df_dataset.columns]
+        self.indexes = set()
+        frame = df_dataset.copy(deep=False)
+        frame.columns = self.columns
+        self._con = duckdb.connect()
+        self._con.register(TABLE, frame)
+        self._con.execute("SET enable_external_access = false")
+        self._con.execute("SET lock_configuration = true")
+
+    def index(self, columns):
+        # Columnar scans need no indexes
+        return []
+
+    def execute(self, query, limit, timeout):
+        import duckdb
+
+        check_sources(query)
+        timer = threading.Timer(timeout, self._con.interrupt)
+        timer.start()
+        try:
+            return self._con.execute("SELECT * FROM (%s) LIMIT %d" % (query, limit)).fetch_df()
+        except duckdb.Error as e:
+            raise SQLQueryError(str(e))
+        finally:
+            timer.cancel()
+
+    def close(self):
+        self._con.close()
+
+
+def _table_class(engine):
+    if engine == "duckdb":
+        try:
+            import duckdb  # noqa: F401
+            return _DuckDBTable
+        except ImportError:
+            logger.warning("duckdb is not installed, the SQL engine uses SQLite")
+    return _SQLiteTable
+
+
+class _Entry:
+    __slots__ = ("table", "results", "lock")
+
+    def __init__(self, table):
+        self.table = table
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+
+class SQLEngine:
+    """
+    Datasets loaded for SQL by fingerprint, at most max_tables of them (least recently
+    queried first out), each with the results of its last max_results queries
+    """
+
+    def __init__(self, engine=SQL_ENGINE, max_tables=SQL_TABLES, max_results=MAX_RESULTS,
+                 max_rows=MAX_RESULT_ROWS, timeout=QUERY_TIMEOUT):
+        self.table_class = _table_class(engine)
+        self.max_tables = max_tables
+        self.max_results = max_results
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self.loads = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sql-load")
+
+    def _entry(self, df_dataset):
+        fingerprint = dataset_fingerprint(df_dataset)
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint)
+                return entry
+            entry = self._entries[fingerprint] = _Entry(None)
+            entry.lock.acquire()
+            evicted = []
+            while len(self._entries) > self.max_tables:
+                evicted.append(self._entries.popitem(last=False)[1])
+        # Closed under their own lock once a query running on them is done, outside the engine
+        # lock since a failed load takes the engine lock while holding its entry lock
+        for old in evicted:
+            with old.lock:
+                if old.table is not None:
+                    old.table.close()
+                    old.table = None
+        # Loaded outside the engine lock, other sessions wait on this entry only
+        try:
+            with span("sql_load", engine=self.table_class.engine, rows=len(df_dataset)):
+                entry.table = self.table_class(df_dataset)
+            self.loads += 1
+        except Exception:
+            with self._lock:
+                self._entries.pop(fingerprint, None)
+            raise
+        finally:
+            entry.lock.release()
+        return entry
+
+    def preload(self, df_dataset):
+        """
+        Starts loading df_dataset in the background, so the table is usually ready by the
+        time ChatGPT has written the query. Returns the Future.
+        """
+        return self._threads.submit(self._entry, df_dataset)
+
+    def query(self, df_dataset, query):
+        """
+        Runs a read-only query on the table data holding df_dataset and returns the result frame.
+        Raises SQLQueryError when the query fails or returns more than max_rows rows.
+        """
+        query = check_query(query)
+        key = normalize_query(query)
+        entry = self._entry(df_dataset)
+        with span("sql", engine=self.table_class.engine, cache="miss") as s, entry.lock:
+            if entry.table is None:
+                raise SQLQueryError("the dataset could not be loaded or was unloaded, please ask again")
+            result = entry.results.get(key)
+            if result is not None:
+                entry.results.move_to_end(key)
+                self.hits += 1
+                s.set(cache="hit", rows=len(result))
+                return result
+            self.misses += 1
+            built = entry.table.index(filter_columns(query, entry.table.columns))
+            result = entry.table.execute(query, self.max_rows + 1, self.timeout)
+            if len(result) > self.max_rows:
+                raise SQLQueryError("the query returns more than %d rows, it has to aggregate the data" % self.max_rows)
+            entry.results[key] = result
+            while len(entry.results) > self.max_results:
+                entry.results.popitem(last=False)
+            s.set(rows=len(result), indexes_built=len(built))
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"tables": len(self._entries), "loads": self.loads, "hits": self.hits, "misses": self.misses,
+                    "indexes": sum(len(e.table.indexes) for e in self._entries.values() if e.table is not None)}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_sql_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = SQLEngine()
+    return _engine
+
+
+def preload_table(df_dataset):
+    """
+    Starts loading a dataset the SQL path will be used for
+    """
+    if use_sql_engine(df_dataset):
+        get_sql_engine().preload(df_dataset)
+
+
+@traced("get_sql_primer")
+def get_sql_primer(df_dataset, question="", budget=PRIMER_TOKEN_BUDGET):
+    """
+    Primer for the SQL path: the table schema and instructions to answer with an aggregation
+    query and the code plotting its result, which the plot executor gets as df
+    """
+    profile = get_profile(df_dataset)
+    engine = get_sql_engine().table_class.engine
+    types = sorted(set(_sql_type(dtype, engine) for dtype in df_dataset.dtypes))
+    instructions = "\nThe table has %d rows, so do not load it in Python. First write one %s query on the table " \
+                   "%s that computes only what the plot needs (filter with WHERE, aggregate with GROUP BY, " \
+                   "COUNT, SUM, AVG, MIN, MAX), returning at most %d rows, in a ```sql block. Quote column " \
+                   "names with double quotes." % (profile["rows"], "SQLite" if engine == "sqlite" else "DuckDB",
+                                                   TABLE, MAX_RESULT_ROWS)
+    instructions = instructions + "\nThen write a ```python block that plots the query result, a dataframe " \
+                                  "called df with the columns the query selects, on ax."
+    instructions = instructions + "\nLabel the x and y axes appropriately."
+    instructions = instructions + "\nAdd a title. Set the fig suptitle as empty."
+    instructions = instructions + "\nPut your reasoning of why you chose the specifc plot type and other reasons of how you came up with the plot according to the prompt in a long string and store it in a variable named \"reasoning\""
+    instructions = instructions + "\nUsing Python version 3.9.12, write the query and the script to graph the following: "
+
+    if engine == "sqlite" and any(is_datetime64_any_dtype(dtype) for dtype in df_dataset.dtypes):
+        types.append("dates as TEXT 'YYYY-MM-DD HH:MM:SS'")
+    primer_desc = "Use a table called %s with column types %s and columns '" % (TABLE, ", ".join(types))
+    names, columns, report = budget_columns(profile, question, budget - count_tokens(primer_desc + "'. " + instructions),
+                                            "','".join(str(x) for x in df_dataset.columns), describe_columns(profile))
+    annotate(**report)
+    primer_desc = primer_desc + names + "'. " + columns + instructions
+    primer_code = "import pandas as pd\nimport matplotlib.pyplot as plt\n"
+    primer_code = primer_code + "fig,ax = plt.subplots(1,1,figsize=(10,4))\n"
+    primer_code = primer_code + "ax.spines['top'].set_visible(False)\nax.spines['right'].set_visible(False) \n"
+    primer_code = primer_code + "df=datasets[" + repr(QUERY_RESULT) + "].copy()\n"
+    return primer_desc, primer_code
+
+
+def run_sql_request(question_to_ask, key, fingerprint="", use_cache=True, stream=False):
+    """
+    Sends the SQL primer and prompt to the chatgpt-4 api, the answer holds a query and plotting code
+    """
+    task = "Generate a SQL query and a Python Code Script."
+    task = task + " The script should only include code, no comments."
+    return chat_completion(task, question_to_ask, key, fingerprint, use_cache, stream=stream, stage="llm_sql")
+
+
+def run_sql_answer(df_dataset, answer):
+    """
+    Runs the query of an answer and returns its result and the plotting code. The query is kept
+    in the code as a string, so the render cache and "Describe it" see it.
+    """
+    query, code = split_answer(answer)
+    result = get_sql_engine().query(df_dataset, query)
+    return result, "query = " + repr(query) + "\n" + code
@@ -0,0 +1,139 @@
+"""
+A local stand-in for the chatgpt chat completions api, used to run the app and its
+benchmarks offline. Answers are deterministic and built from the prompt itself.
+
+    python stub_llm.py --port 8765 --latency 0.5 --token-delay 0.01
+    DATACHAT_OPENAI_API_BASE=http://127.0.0.1:8765/v1 streamlit run app.py
+"""
+import argparse
+import json
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _numeric_columns(prompt):
+    return re.findall(r"The column '([^']+)' is type \w+ and contains numeric values", prompt)
+
+
+def _categorical_columns(prompt):
+    return re.findall(r"The column '([^']+)' has categorical values", prompt)
+
+
+def stub_reply(task, prompt):
+    """
+    Returns a deterministic answer shaped like the one chatgpt gives for each kind of task
+    """
+    if task.startswith("Generate a SQL query"):
+        numeric = _numeric_columns(prompt) or ["value"]
+        categorical = _categorical_columns(prompt)
+        if categorical:
+            return ('```sql\nSELECT "%s" AS label, AVG("%s") AS value FROM data GROUP BY "%s" ORDER BY value DESC\n```\n'
+                    "```python\nax.bar(df['label'].astype(str), df['value'])\n"
+                    "ax.set_xlabel('%s')\nax.set_ylabel('Average %s')\nax.set_title('Average %s by %s')\n"
+                    "fig.suptitle('')\n"
+                    "reasoning = 'A bar chart compares the average %s across each %s, aggregated in SQL.'\n```\n"
+                    % (categorical[0], numeric[0], categorical[0], categorical[0], numeric[0], numeric[0],
+                       categorical[0], numeric[0], categorical[0]))
+        return ('```sql\nSELECT MIN("%s") AS low, MAX("%s") AS high, AVG("%s") AS mean FROM data\n```\n'
+                "```python\nax.bar(['min', 'mean', 'max'], [df['low'][0], df['mean'][0], df['high'][0]])\n"
+                "ax.set_xlabel('Statistic')\nax.set_ylabel('%s')\nax.set_title('Range of %s')\n"
+                "fig.suptitle('')\n"
+                "reasoning = 'Bars show the minimum, mean and maximum of %s, aggregated in SQL.'\n```\n"
+                % (numeric[0], numeric[0], numeric[0], numeric[0], numeric[0], numeric[0]))
+    if task.startswith("Generate Python Code Script"):
+        numeric = _numeric_columns(prompt) or ["value"]
+        categorical = _categorical_columns(prompt)
+        if categorical:
+            return ("summary = df.groupby('%s')['%s'].mean()\n"
+                    "ax.bar(summary.index.astype(str), summary.values)\n"
+                    "ax.set_xlabel('%s')\nax.set_ylabel('Average %s')\nax.set_title('Average %s by %s')\n"
+                    "fig.suptitle('')\n"
+                    "reasoning = 'A bar chart compares the average %s across each %s.'\n"
+                    % (categorical[0], numeric[0], categorical[0], numeric[0], numeric[0], categorical[0],
+                       numeric[0], categorical[0]))
+        return ("ax.hist(df['%s'].dropna(), bins=20)\n"
+                "ax.set_xlabel('%s')\nax.set_ylabel('Count')\nax.set_title('Distribution of %s')\n"
+                "fig.suptitle('')\n"
+                "reasoning = 'A histogram shows how %s is distributed.'\n"
+                % (numeric[0], numeric[0], numeric[0], numeric[0]))
+    if task.startswith("Describe the plot"):
+        return "This plot shows the data generated by the given code."
+    if "suggest 5 prompts" in task:
+        numeric = _numeric_columns(task) or ["value"]
+        return "\n".join("%d. Show: the distribution of %s" % (i + 1, numeric[i % len(numeric)]) for i in range(5))
+    return "You said: " + prompt
+
+
+def _tokens(text):
+    # Split into word and whitespace pieces so streamed chunks join back to the exact text
+    return re.findall(r"\s+|\S+", text)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    token_delay = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = body.get("messages", [])
+        task = next((m["content"] for m in messages if m["role"] == "system"), "")
+        prompt = next((m["content"] for m in messages if m["role"] == "user"), "")
+        model = body.get("model", "gpt-4")
+        reply = stub_reply(task, prompt)
+        time.sleep(self.latency)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for piece in _tokens(reply):
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self._write_chunk("data: " + json.dumps(chunk) + "\n\n")
+                time.sleep(self.token_delay)
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+
+        time.sleep(self.token_delay * len(_tokens(reply)))
+        payload = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(_tokens(task + prompt)), "completion_tokens": len(_tokens(reply)),
+                      "total_tokens": len(_tokens(task + prompt)) + len(_tokens(reply))},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def serve(port=8765, latency=0.0, token_delay=0.0):
+    """
+    Starts the stub server and returns it, call serve_forever() or run it in a thread
+    """
+    handler = type("Handler", (StubHandler,), {"latency": latency, "token_delay": token_delay})
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the chatgpt chat completions api")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    args = parser.parse_args()
+    server = serve(args.port, args.latency, args.token_delay)
+    print("Stub chatgpt api listening on http://127.0.0.1:%d/v1" % args.port)
+    server.serve_forever()
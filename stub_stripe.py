@@ -0,0 +1,67 @@
+"""
+A local stand-in for the Stripe checkout sessions api, for running app_prd.py and checkout.py
+offline. Point the app at it with DATACHAT_STRIPE_API_BASE=http://127.0.0.1:8766
+
+    python stub_stripe.py --port 8766 --latency 0.5
+"""
+import argparse
+import itertools
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+_ids = itertools.count(1)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail = False
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+        time.sleep(self.latency)
+        if not self.path.startswith("/v1/checkout/sessions"):
+            return self._reply(404, {"error": {"type": "invalid_request_error", "message": "Unrecognized request URL"}})
+        if self.fail:
+            return self._reply(500, {"error": {"type": "api_error", "message": "Stub failure"}})
+        session_id = "cs_test_stub%06d" % next(_ids)
+        self._reply(200, {
+            "id": session_id,
+            "object": "checkout.session",
+            "mode": form.get("mode", ["payment"])[0],
+            "customer_email": form.get("customer_email", [None])[0],
+            "expires_at": int(form.get("expires_at", [time.time() + 24 * 3600])[0]),
+            "url": "https://checkout.stripe.com/c/pay/" + session_id,
+        })
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def serve(port=8766, latency=0.0, fail=False):
+    """
+    Starts the stub server and returns it, call serve_forever() or run it in a thread
+    """
+    handler = type("Handler", (StubHandler,), {"latency": latency, "fail": fail})
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the Stripe checkout sessions api")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--fail", action="store_true", help="answer every request with an api error")
+    args = parser.parse_args()
+    server = serve(args.port, args.latency, args.fail)
+    print("Stub Stripe api listening on http://127.0.0.1:%d" % args.port)
+    server.serve_forever()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Spans of the code under test are not written to the metrics log of the checkout
+os.environ.setdefault("DATACHAT_METRICS", "off")
@@ -0,0 +1,31 @@
+from streamlit.testing.v1 import AppTest
+
+from chat_history import history_window
+
+
+def history_app():
+    from chat_history import show_history
+
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": "message %d" % i} for i in range(50)]
+    show_history(messages, None, turns=20)
+
+
+def test_history_window():
+    assert history_window(50, 0, turns=20) == 30
+    assert history_window(50, 1, turns=20) == 10
+    assert history_window(50, 5, turns=20) == 0
+    assert history_window(50, 0, turns=0) == 0
+    assert history_window(5, 0, turns=20) == 0
+
+
+def test_only_the_latest_turns_are_rendered_and_earlier_ones_paged_in():
+    app = AppTest.from_function(history_app).run()
+    assert not app.exception
+    assert len(app.chat_message) == 20
+    assert app.chat_message[0].markdown[0].value == "message 30"
+    assert app.button[0].label == "Show 20 earlier messages"
+    app.button[0].click().run()
+    assert len(app.chat_message) == 40
+    assert app.button[0].label == "Show 10 earlier messages"
+    app.button[0].click().run()
+    assert len(app.chat_message) == 50 and not app.button
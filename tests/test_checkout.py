@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+import checkout
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(checkout.time, "time", clock.time)
+    return clock
+
+
+def settle(links):
+    deadline = time.monotonic() + 5
+    while links.stats()["pending"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def make_links(clock, ttl=3600, fail=()):
+    def create(user):
+        if user in fail:
+            raise RuntimeError("stripe is down")
+        return "https://pay/%s/%d" % (user, clock.now), clock.now + ttl
+    return checkout.CheckoutLinks(create=create, refresh_margin=60, retry_delay=30)
+
+
+def test_link_is_created_in_the_background_and_reused(clock):
+    links = make_links(clock)
+    assert links.get("a") is None
+    settle(links)
+    url = links.get("a")
+    assert url.startswith("https://pay/a/")
+    clock.now += 100
+    assert links.get("a") == url
+    assert links.stats()["created"] == 1
+    links.shutdown()
+
+
+def test_link_is_renewed_before_it_expires(clock):
+    links = make_links(clock)
+    links.get("a")
+    settle(links)
+    first = links.get("a")
+    clock.now += 3600 - 30
+    # Still valid while the new one is being created
+    assert links.get("a") == first
+    settle(links)
+    assert links.get("a") != first
+    links.shutdown()
+
+
+def test_expired_links_are_dropped(clock):
+    links = make_links(clock)
+    for user in ("a", "b", "c"):
+        links.get(user)
+    settle(links)
+    assert links.stats()["links"] == 3
+    clock.now += 7200
+    links.get("d")
+    settle(links)
+    assert set(links._links) == {"d"}
+    assert links.get("a") is None
+    links.shutdown()
+
+
+def test_failures_are_retried_after_a_delay(clock, caplog):
+    links = make_links(clock, fail={"a"})
+    links.get("a")
+    settle(links)
+    assert links.stats()["failures"] == 1
+    assert "stripe is down" in caplog.text
+    links.get("a")
+    settle(links)
+    assert links.stats()["failures"] == 1
+    clock.now += 31
+    links.get("a")
+    settle(links)
+    assert links.stats()["failures"] == 2
+    links.shutdown()
@@ -0,0 +1,146 @@
+import pandas as pd
+import pytest
+
+from code_optimizer import UnsafeCodeError, normalized_code, optimize_code, strip_io
+from profiling import numeric_columns
+
+PRIMER = 'df = datasets["Sales"].copy()\n'
+
+
+def sales():
+    return pd.DataFrame({"region": ["n", "s", "n", "e", "s", None],
+                         "price": [10.0, 20.0, None, 40.0, 50.0, 60.0],
+                         "units": [1, 2, 3, 4, 5, 6],
+                         "grade": pd.Categorical(["a", "b", "a", "c", "b", "a"])})
+
+
+def run(code, df):
+    namespace = {"datasets": {"Sales": df}, "pd": pd}
+    exec(code, namespace)
+    return namespace
+
+
+def optimized(code, df=None):
+    df = sales() if df is None else df
+    return optimize_code(PRIMER + code, numeric_columns([df]))
+
+
+def assert_same_result(code, names):
+    rewritten, _ = optimized(code)
+    before, after = run(PRIMER + code, sales()), run(rewritten, sales())
+    for name in names:
+        if isinstance(before[name], pd.Series):
+            pd.testing.assert_series_equal(before[name], after[name], check_names=False)
+        else:
+            assert before[name] == after[name]
+
+
+def test_io_and_show_are_stripped():
+    code = "df = pd.read_csv('x.csv')\nplt.plot([1])\nplt.savefig('x.png')\nplt.show()\ndf.to_csv('y.csv')\n"
+    assert strip_io(code) == "plt.plot([1])"
+    assert optimize_code(code)[1] == ["strip_io"] * 4
+
+
+@pytest.mark.parametrize("code", ["while True:\n    pass", "import os", "from subprocess import run", "import resource",
+                                  "eval('1')", "open('f')", "for i in range(10 ** 9):\n    pass",
+                                  "def f(n):\n    return f(n - 1)", "import itertools\nitertools.count()",
+                                  "import time\ntime.sleep(1)"])
+def test_unbounded_or_unsafe_code_is_rejected(code):
+    with pytest.raises(UnsafeCodeError):
+        optimize_code(code)
+    assert normalized_code(code) is None
+
+
+def test_numeric_map_and_rowwise_apply_are_vectorized():
+    code = 'a = df["price"].map(lambda x: x * 2 + 1)\nb = df.apply(lambda row: row["price"] / row["units"], axis=1)\n'
+    rewritten, rewrites = optimized(code)
+    assert rewrites == ["map_lambda", "rowwise_apply"]
+    assert "a = df['price'] * 2 + 1" in rewritten
+    assert "b = df['price'] / df['units']" in rewritten
+    assert_same_result(code, ["a", "b"])
+
+
+def test_category_and_unknown_columns_are_not_vectorized():
+    for code in ['a = df["grade"].map(lambda x: x * 2)', 'a = df.apply(lambda row: row["grade"] * 2, axis=1)',
+                 's = df["price"]\na = s.map(lambda x: x * 2)']:
+        assert optimized(code)[1] == []
+    # Without dtypes nothing is known to be numeric
+    assert optimize_code('a = df["price"].map(lambda x: x * 2)')[1] == []
+    # A column the code converts may not be numeric any more
+    for code in ['df["price"] = df["price"].astype("category")\na = df["price"].map(lambda x: x * 2)',
+                 'df = df.astype({"price": "category"})\na = df["price"].map(lambda x: x * 2)']:
+        assert optimized(code)[1] == []
+    mixed = [sales(), sales().assign(price=lambda d: d["price"].astype("category"))]
+    assert "price" not in numeric_columns(mixed)
+
+
+def test_iterrows_reading_columns_becomes_zip():
+    code = "total = 0\nfor i, row in df.iterrows():\n    total += row['units'] * 2\n"
+    rewritten, rewrites = optimized(code)
+    assert rewrites == ["iterrows"]
+    assert "zip(df.index, df['units'])" in rewritten
+    assert_same_result(code, ["total"])
+
+
+def test_iterrows_is_kept_when_values_are_formatted_or_written():
+    # iterrows upcasts units to float next to price, so the text would change from 1.0 to 1
+    for code in ["labels = [f'{row[\"units\"]}' for i, row in df.iterrows()]",
+                 "labels = []\nfor i, row in df.iterrows():\n    labels.append(str(row['units']))",
+                 "for i, row in df.iterrows():\n    df.loc[i, 'price'] = row['units']",
+                 "for i, row in df.iterrows():\n    print(row)"]:
+        assert "iterrows" not in optimized(code)[1]
+
+
+def test_repeated_groupby_is_built_once():
+    code = 'a = df.groupby("region")["price"].mean()\nb = df.groupby("region")["units"].sum()\n' \
+           'n = len(df)\nfor c in ["price", "units"]:\n    m = df.groupby("region")[c].max()\n'
+    rewritten, rewrites = optimized(code)
+    assert rewrites == ["groupby_once"]
+    assert rewritten.count(".groupby(") == 1
+    assert_same_result(code, ["a", "b", "m"])
+
+
+@pytest.mark.parametrize("between", [
+    "x = df\nx.dropna(inplace=True)",
+    "x = df.copy(deep=False)\nx.drop(columns=['units'], inplace=True)",
+    "x = df.loc\nx[0, 'price'] = 1000.0",
+    "values = df.values\nvalues[0, 2] = 100",
+    "df.pipe(lambda d: d.dropna(inplace=True))",
+    "def clean(d):\n    d.dropna(inplace=True)\nclean(df)",
+    "frames = [df]\nframes[0].dropna(inplace=True)",
+])
+def test_groupby_is_not_hoisted_across_an_alias(between):
+    code = 'a = df.groupby("region")["units"].sum()\n' + between + '\nb = df.groupby("region")["units"].sum()\n'
+    rewritten, rewrites = optimized(code)
+    assert "groupby_once" not in rewrites
+    assert_same_result(code, ["a", "b"])
+
+
+def test_groupby_is_not_hoisted_when_the_frame_is_bound_from_another_name():
+    code = 'raw = datasets["Sales"].copy()\ndf = raw\na = df.groupby("region")["units"].sum()\n' \
+           'raw.dropna(inplace=True)\nb = df.groupby("region")["units"].sum()\n'
+    assert "groupby_once" not in optimize_code(code, numeric_columns([sales()]))[1]
+    shallow = code.replace("df = raw", "df = raw.copy(deep=False)")
+    assert "groupby_once" not in optimize_code(shallow, numeric_columns([sales()]))[1]
+    # A deep copy shares nothing
+    deep = code.replace("df = raw", "df = raw.copy()")
+    assert "groupby_once" in optimize_code(deep, numeric_columns([sales()]))[1]
+
+
+def test_groupby_is_not_hoisted_across_a_mutation():
+    code = 'a = df.groupby("region")["units"].sum()\ndf.dropna(inplace=True)\nb = df.groupby("region")["units"].sum()\n'
+    assert "groupby_once" not in optimized(code)[1]
+    assert_same_result(code, ["a", "b"])
+
+
+@pytest.mark.parametrize("code", ['a = df["units"].apply(lambda x: x ** -1)', 'a = df["units"].map(lambda x: x ** 40)',
+                                  'a = df.apply(lambda row: row["price"] ** 2, axis=1)'])
+def test_powers_are_not_vectorized(code):
+    rewritten, rewrites = optimized(code)
+    assert rewrites == []
+    namespace = run(rewritten, sales())
+    if "-1" in code:
+        assert namespace["a"].tolist() == [1 / n for n in range(1, 7)]
+    elif "40" in code:
+        # Python ints do not wrap around like int64 would
+        assert namespace["a"].iloc[5] == 6 ** 40
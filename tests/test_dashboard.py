@@ -0,0 +1,50 @@
+import pytest
+
+import dashboard
+from dashboard import Chart, dashboard_message, dashboard_prompts
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("Dashboard: prices by region; sales over time", ["Show: prices by region", "Show: sales over time"]),
+    ("dashboard:\n- prices by region\n* Show: sales over time\n\n1. top 5 states",
+     ["Show: prices by region", "Show: sales over time", "Show: top 5 states"]),
+    ("Show: prices by region\nShow: sales over time", ["Show: prices by region", "Show: sales over time"]),
+    ("1) Show: a histogram of age\n2) show: age by sex", ["Show: a histogram of age", "show: age by sex"]),
+    ("Some context first\nShow: a\nignored line\nShow: b", ["Show: a", "Show: b"]),
+])
+def test_batch_messages_are_split(prompt, expected):
+    assert dashboard_prompts(prompt) == expected
+
+
+@pytest.mark.parametrize("prompt", ["Show: prices by region", "prices by region; sales over time",
+                                    "Dashboard:", "Dashboard: ;\n;", "Show: a\nthen show: b"])
+def test_single_prompts_are_not_dashboards(prompt):
+    assert dashboard_prompts(prompt) is None
+
+
+def test_number_of_charts_is_capped():
+    prompts = dashboard_prompts("Dashboard: " + ";".join("plot %d" % i for i in range(20)))
+    assert len(prompts) == dashboard.MAX_CHARTS
+    assert prompts[-1] == "Show: plot %d" % (dashboard.MAX_CHARTS - 1)
+
+
+class Images:
+    def __init__(self):
+        self.stored = []
+
+    def put(self, image):
+        self.stored.append(image)
+        return len(self.stored) - 1
+
+
+def test_dashboard_message_counts_failures():
+    ok, failed, empty = Chart("Show: a"), Chart("Show: b"), Chart("Show: c")
+    ok.image, ok.reasoning = b"png", "bars"
+    failed.error = "Failed to generate plot: KeyError: 'x'"
+    images = Images()
+    message = dashboard_message(images, [ok, failed, empty])
+    assert message["content"] == "A dashboard of 1 plots has been created based on your prompt (2 failed)"
+    assert message["dashboard"] == [{"prompt": "Show: a", "image": 0, "reasoning": "bars"},
+                                    {"prompt": "Show: b", "error": failed.error},
+                                    {"prompt": "Show: c", "error": "No plot was generated"}]
+    assert images.stored == [b"png"]
@@ -0,0 +1,35 @@
+import pandas as pd
+
+from dataset_store import DatasetRegistry
+
+
+def registry(tmp_path):
+    files = {}
+    for name, rows in (("Small", 3), ("Large", 300)):
+        path = tmp_path / (name + ".csv")
+        pd.DataFrame({"s": ["value %d" % i for i in range(rows)], "n": range(rows)}).to_csv(path, index=False)
+        files[name] = str(path)
+    return DatasetRegistry(files)
+
+
+def test_datasets_are_parsed_once_and_shared(tmp_path):
+    datasets = registry(tmp_path)
+    assert list(datasets) == ["Small", "Large"] and not datasets.is_loaded("Small")
+    df = datasets["Small"]
+    assert datasets["Small"] is df and datasets.is_loaded("Small")
+    assert df["s"].tolist() == ["value 0", "value 1", "value 2"]
+
+
+def test_memory_usage_is_counted_once_per_loaded_dataset(tmp_path, monkeypatch):
+    datasets = registry(tmp_path)
+    assert datasets.memory_usage() == {"Small": None, "Large": None}
+    datasets["Large"]
+    sizes = datasets.memory_usage()
+    assert sizes["Small"] is None
+    assert sizes["Large"] == datasets["Large"].memory_usage(deep=True).sum()
+
+    def count(*args, **kwargs):
+        raise AssertionError("counted again")
+
+    monkeypatch.setattr(pd.DataFrame, "memory_usage", count)
+    assert datasets.memory_usage() == sizes
@@ -0,0 +1,96 @@
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from figure_info import describe_figure, figure_metadata, wants_llm_description
+
+
+@pytest.fixture
+def ax():
+    fig, ax = plt.subplots()
+    yield ax
+    plt.close(fig)
+
+
+def metadata(ax):
+    ax.figure.canvas.draw()
+    figure = figure_metadata(ax.figure)
+    assert figure["plots"] == 1
+    return figure["axes"][0]
+
+
+def test_bar_plot(ax):
+    ax.bar(["north", "south", "east"], [3, 9, 1])
+    ax.set_title("Sales")
+    ax.set_ylabel("units")
+    info = metadata(ax)
+    assert info["plot_type"] == "Bar Plot"
+    assert info["title"] == "Sales" and info["ylabel"] == "units"
+    assert info["bars"] == 3
+    assert info["x_categories"] == ["north", "south", "east"]
+    assert info["highest"] == ["south", 9] and info["lowest"] == ["east", 1]
+
+
+def test_pandas_horizontal_bars(ax):
+    pd.Series([5.0, 2.0], index=["a", "b"]).plot.barh(ax=ax)
+    info = metadata(ax)
+    assert info["plot_type"] == "Horizontal Bar Plot"
+    assert info["highest"] == ["a", 5]
+
+
+def test_histogram(ax):
+    ax.hist(np.random.default_rng(0).normal(size=1000), bins=20, range=(-4, 4))
+    info = metadata(ax)
+    assert info["plot_type"] == "Histogram"
+    assert info["bins"] == 20
+    assert info["bin_range"] == [-4, 4]
+    assert "highest" not in info
+
+
+def test_line_plot_with_dates(ax):
+    days = pd.date_range("2024-01-01", periods=10)
+    ax.plot(days, np.arange(10), label="trend")
+    ax.plot(days, np.arange(10)[::-1], label="decline")
+    ax.legend()
+    info = metadata(ax)
+    assert info["plot_type"] == "Line Plot"
+    assert info["lines"] == 2 and info["points"] == 20
+    assert info["series"] == ["trend", "decline"]
+    assert info["peaks"][0][0] == "trend" and info["peaks"][0][2] == 9
+    assert str(info["peaks"][0][1]).startswith("2024-01-10")
+    assert str(info["x_range"][0]).startswith("2024-01-01")
+
+
+def test_pie_chart(ax):
+    ax.pie([1, 3], labels=["small", "large"])
+    info = metadata(ax)
+    assert info["plot_type"] == "Pie Chart"
+    assert info["slices"] == 2
+    assert info["largest"] == [["large", 75.0], ["small", 25.0]]
+    assert "x_range" not in info
+
+
+def test_several_plots_and_description():
+    fig, (left, right) = plt.subplots(1, 2)
+    left.bar(["a", "b"], [1, 2])
+    right.scatter([1, 2, 3], [3, 2, 1])
+    fig.suptitle("Overview")
+    figure = figure_metadata(fig)
+    plt.close(fig)
+    assert figure["suptitle"] == "Overview" and figure["plots"] == 2
+    assert figure["axes"][1]["plot_type"] == "Scatter Plot" and figure["axes"][1]["scatter_points"] == 3
+    text = describe_figure(figure, "Because.")
+    assert text.startswith('This figure has 2 plots under the title "Overview".')
+    assert "Plot 1 is a bar plot" in text and text.endswith("\n\nBecause.")
+
+
+def test_describe_goes_to_chatgpt_only_when_asked_or_without_metadata(ax):
+    ax.bar(["a"], [1])
+    figure = figure_metadata(ax.figure)
+    assert not wants_llm_description("Describe it", figure)
+    assert wants_llm_description("Describe it with ChatGPT", figure)
+    assert wants_llm_description("Describe it", None)
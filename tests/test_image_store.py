@@ -0,0 +1,51 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from image_store import ChatImageStore, make_thumbnail
+
+
+def png(width, color):
+    buf = io.BytesIO()
+    Image.new("RGB", (width, width // 2), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    images = [png(800, (i * 40, 0, 0)) for i in range(3)]
+    store = ChatImageStore(max_bytes=len(images[0]) + len(images[1]), image_format="png", spill_dir=str(tmp_path))
+    yield store, images
+    store.close()
+
+
+def test_thumbnails_are_downscaled():
+    with Image.open(io.BytesIO(make_thumbnail(png(800, "red"), "png", width=200))) as thumbnail:
+        assert thumbnail.size == (200, 100)
+    assert make_thumbnail(b"<svg/>", "svg") == b"<svg/>"
+
+
+def test_least_recently_viewed_images_spill_to_disk(store):
+    store, images = store
+    ids = [store.put(image) for image in images[:2]]
+    store.full(ids[0])
+    third = store.put(images[2])
+    footprint = store.footprint()
+    assert footprint["images"] == 3 and footprint["spilled"] == 1 and footprint["full_size_in_memory"] == 2
+    assert footprint["disk_bytes"] == len(images[1])
+    # The spilled image is read back when it is opened
+    assert store.full(ids[1]) == images[1]
+    assert store.footprint()["loads"] == 1
+    assert store.full(third) == images[2] and store.full(ids[0]) == images[0]
+    assert store.thumbnail(ids[1]) != images[1]
+
+
+def test_spilled_files_go_away_with_the_store(store):
+    store, images = store
+    for image in images:
+        store.put(image)
+    assert os.listdir(store.directory)
+    store.close()
+    assert not os.path.exists(store.directory)
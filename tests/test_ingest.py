@@ -0,0 +1,85 @@
+import io
+
+import pandas as pd
+
+import ingest
+
+
+def test_numbers_are_downcast():
+    df = ingest.shrink_dtypes(pd.DataFrame({"small": [1, 2, 3], "big": [1, 2, 70000],
+                                            "price": [0.5, 1.25, 2.0], "precise": [0.1, 0.2, 0.3]}))
+    assert str(df["small"].dtype) == "int8"
+    assert str(df["big"].dtype) == "int32"
+    assert str(df["price"].dtype) == "float32"
+    # 0.1 does not round-trip through float32
+    assert str(df["precise"].dtype) == "float64"
+
+
+def test_category_only_for_large_low_cardinality_columns():
+    few = ["a", "b", "c"]
+    large = pd.DataFrame({"s": few * (ingest.CATEGORY_MIN_ROWS // 3 + 1)})
+    assert isinstance(ingest.shrink_dtypes(large)["s"].dtype, pd.CategoricalDtype)
+    small = pd.DataFrame({"s": few * 10})
+    assert ingest.shrink_dtypes(small)["s"].dtype == object
+    many = pd.DataFrame({"s": ["v%d" % (i % 2000) for i in range(ingest.CATEGORY_MIN_ROWS)]})
+    assert ingest.shrink_dtypes(many)["s"].dtype == object
+
+
+def test_dates_are_parsed():
+    df = ingest.shrink_dtypes(pd.DataFrame({"day": ["2020-01-02", "2020-02-03", None],
+                                            "stamp": ["2020-01-02 10:11", "2020-01-03 12:00", "2020-01-04 00:00"],
+                                            "us": ["1/2/23", "12/31/23", "6/7/23"]}))
+    assert df["day"].dtype.kind == "M"
+    assert df["day"].isna().sum() == 1
+    assert df["stamp"].iloc[0] == pd.Timestamp("2020-01-02 10:11")
+    assert df["us"].iloc[1] == pd.Timestamp("2023-12-31")
+
+
+def test_versions_and_addresses_are_not_dates():
+    df = ingest.shrink_dtypes(pd.DataFrame({"version": ["1.2.3", "2.13.1", "1.0.10"],
+                                            "ip": ["10.0.0.1", "192.168.1.20", "8.8.8.8"],
+                                            "mixed": ["2020-01-02", "2020-01-03", "soon"]}))
+    assert (df.dtypes == object).all()
+    assert df["version"].tolist() == ["1.2.3", "2.13.1", "1.0.10"]
+
+
+def test_unparseable_value_past_the_sample_keeps_strings():
+    values = ["2020-01-%02d" % (i % 28 + 1) for i in range(150)] + ["2020-13-45"]
+    assert ingest.shrink_dtypes(pd.DataFrame({"d": values}))["d"].dtype == object
+
+
+def test_chunked_read_combines_chunks():
+    csv = "n,s\n" + "".join("%d,%s\n" % (i, "abc"[i % 3]) for i in range(25000))
+    df, report = ingest.read_csv_optimized(io.StringIO(csv), chunksize=10000)
+    assert report["rows"] == report["rows_read"] == 25000
+    assert not report["sampled"] and not report["truncated"]
+    assert str(df["n"].dtype) == "int16"
+    assert isinstance(df["s"].dtype, pd.CategoricalDtype)
+    assert df["s"].tolist()[:4] == ["a", "b", "c", "a"]
+
+
+def test_row_ceiling_truncates():
+    csv = "n\n" + "".join("%d\n" % i for i in range(100))
+    df, report = ingest.read_csv_optimized(io.StringIO(csv), chunksize=30, max_rows=50)
+    assert len(df) == 50 and report["truncated"]
+    assert "first 50 rows" in ingest.describe_report(report)
+
+
+def test_chunks_that_disagree_are_read_as_text():
+    ids = "".join("%d,%s\n" % (i, "2020-01-%02d" % (i % 28 + 1)) for i in range(100))
+    csv = "id,day\n" + ids + "A12,soon\n" + ids[:-1]
+    df, report = ingest.read_csv_optimized(io.StringIO(csv), chunksize=60)
+    assert report["rows"] == 201
+    assert {type(x) for x in df["id"]} == {str}
+    assert df["id"].iloc[100] == "A12" and df["id"].iloc[0] == "0"
+    # The bad date is past the first chunk, the column stays text instead of mixing dates and strings
+    assert {type(x) for x in df["day"]} == {str}
+    assert df.sort_values("id")["id"].iloc[0] == "0"
+    assert df.equals(ingest.shrink_dtypes(pd.read_csv(io.StringIO(csv), dtype={"id": str})))
+
+
+def test_dates_are_parsed_across_chunks():
+    csv = "day,n\n" + "".join("2020-01-%02d,%s\n" % (i % 28 + 1, "" if i == 150 else i) for i in range(200))
+    df, _ = ingest.read_csv_optimized(io.StringIO(csv), chunksize=60)
+    assert df["day"].dtype.kind == "M"
+    assert df["n"].dtype.kind == "f" and df["n"].isna().sum() == 1
@@ -0,0 +1,53 @@
+import time
+
+from llm_cache import ResponseCache
+
+
+def make_cache(tmp_path, **kwargs):
+    return ResponseCache(path=str(tmp_path / "cache.db"), enabled=True, **kwargs)
+
+
+def test_hit_and_miss_by_fingerprint(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("gpt-4", "task", "prompt", "answer", "fp1")
+    assert cache.get("gpt-4", "task", "prompt", "fp1") == "answer"
+    assert cache.get("gpt-4", "task", "prompt", "fp2") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_expired_entries_are_dropped(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, ttl=10)
+    cache.put("gpt-4", "task", "prompt", "answer")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("gpt-4", "task", "prompt") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, max_entries=2)
+    clock = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    for prompt in ("a", "b"):
+        clock[0] += 1
+        cache.put("gpt-4", "task", prompt, "answer " + prompt)
+    clock[0] += 1
+    assert cache.get("gpt-4", "task", "a") == "answer a"
+    clock[0] += 1
+    cache.put("gpt-4", "task", "c", "answer c")
+    assert cache.get("gpt-4", "task", "b") is None
+    assert cache.get("gpt-4", "task", "a") == "answer a"
+    assert cache.get("gpt-4", "task", "c") == "answer c"
+
+
+def test_size_cap(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=10)
+    cache.put("gpt-4", "task", "a", "x" * 6)
+    cache.put("gpt-4", "task", "b", "y" * 6)
+    assert cache.stats()["entries"] == 1
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), enabled=False)
+    cache.put("gpt-4", "task", "prompt", "answer")
+    assert cache.get("gpt-4", "task", "prompt") is None
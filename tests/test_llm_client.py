@@ -0,0 +1,18 @@
+import llm_client
+
+
+def test_clients_are_reused_per_key_and_model():
+    client = llm_client.get_client("sk-one", "gpt-4")
+    assert llm_client.get_client("sk-one", "gpt-4") is client
+    assert llm_client.get_client("sk-two", "gpt-4") is not client
+    assert llm_client.get_client("sk-one", "gpt-3.5-turbo") is not client
+
+
+def test_client_cache_is_bounded_and_not_keyed_by_the_api_key(monkeypatch):
+    monkeypatch.setattr(llm_client, "MAX_CLIENTS", 2)
+    llm_client._clients.clear()
+    for n in range(4):
+        llm_client.get_client("sk-key-%d" % n)
+    assert len(llm_client._clients) == 2
+    assert not any("sk-key" in key[0] for key in llm_client._clients)
+    assert [client.api_key for client in llm_client._clients.values()] == ["sk-key-2", "sk-key-3"]
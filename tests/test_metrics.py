@@ -0,0 +1,42 @@
+import logging
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def recording(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(metrics, "_histograms", {})
+    logger = logging.getLogger("datachat.metrics.test")
+    logger.propagate = False
+    monkeypatch.setattr(metrics, "_get_logger", lambda: logger)
+
+
+def test_errors_are_labelled_by_exception_class(recording):
+    for column in ("price", "size", "Région"):
+        with pytest.raises(KeyError):
+            with metrics.span("exec"):
+                raise KeyError(column)
+    with metrics.span("plot") as s:
+        s.fail(ValueError("could not convert string to float: 'n/a'"))
+    with metrics.span("plot") as s:
+        s.fail("free text")
+
+    errors = {labels: value for (name, labels), value in metrics._counters.items() if name == "datachat_errors_total"}
+    assert errors == {(("span", "exec"), ("type", "KeyError")): 3,
+                      (("span", "plot"), ("type", "ValueError")): 1,
+                      (("span", "plot"), ("type", "error")): 1}
+    assert "Région" not in metrics.prometheus_text()
+
+
+def test_spans_feed_histograms_and_counters(recording):
+    with metrics.span("llm", model="gpt-4") as s:
+        s.set(prompt_tokens=12, completion_tokens=3, cache="miss")
+    text = metrics.prometheus_text()
+    assert 'datachat_stage_seconds_count{stage="llm"} 1' in text
+    assert 'datachat_tokens_total{model="gpt-4",type="prompt"} 12' in text
+    assert 'datachat_cache_total{result="miss",span="llm"} 1' in text
+    assert "datachat_errors_total" not in text
@@ -0,0 +1,109 @@
+import pandas as pd
+import pytest
+
+import plot_executor
+from plot_executor import (PlotCancelledError, PlotExecutionError, PlotExecutor, PlotRejectedError,
+                           PlotTimeoutError)
+
+PLOT = "import matplotlib.pyplot as plt\nfig, ax = plt.subplots()\nax.bar(['a', 'b'], [1, 2])\nreasoning = 'bars'\n"
+
+
+@pytest.fixture
+def executor():
+    executor = PlotExecutor(workers=1, timeout=20)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.fixture
+def unoptimized(monkeypatch):
+    # Lets the tests run code the optimizer would reject
+    monkeypatch.setattr(plot_executor, "OPTIMIZER_ENABLED", False)
+
+
+def assert_pool_full(executor):
+    assert executor._idle.qsize() == executor.size
+    image, reasoning = executor.run(PLOT)
+    assert image.startswith(b"\x89PNG") and reasoning == "bars"
+
+
+def test_runs_code_and_reports_timings(executor):
+    job = executor.submit(PLOT)
+    image, reasoning = job.result()
+    assert image.startswith(b"\x89PNG")
+    assert reasoning == "bars"
+    assert {"exec_seconds", "savefig_seconds", "queue_seconds"} <= set(job.timings)
+    assert job.figure["axes"][0]["plot_type"] == "Bar Plot"
+
+
+def test_uploads_are_sent_to_the_worker(executor):
+    upload = pd.DataFrame({"x": ["u", "v"], "y": [3, 4]})
+    code = "import matplotlib.pyplot as plt\ndf = datasets['Upload']\nplt.bar(df['x'], df['y'])\nreasoning = str(len(df))\n"
+    assert executor.run(code, {"Upload": upload})[1] == "2"
+
+
+def test_error_in_code(executor):
+    with pytest.raises(PlotExecutionError, match="ZeroDivisionError"):
+        executor.run("x = 1 / 0")
+    assert_pool_full(executor)
+
+
+def test_unsafe_code_is_rejected(executor):
+    with pytest.raises(PlotRejectedError):
+        executor.run("while True:\n    pass\n")
+
+
+def test_timeout_replaces_the_worker(executor, unoptimized):
+    with pytest.raises(PlotTimeoutError):
+        executor.run("import time\ntime.sleep(30)", timeout=0.5)
+    assert_pool_full(executor)
+
+
+def test_cancel_replaces_the_worker(executor, unoptimized):
+    job = executor.submit("import time\ntime.sleep(30)")
+    job.cancel()
+    with pytest.raises(PlotCancelledError):
+        job.result()
+    assert_pool_full(executor)
+
+
+def test_crashed_worker_is_replaced(executor, unoptimized):
+    with pytest.raises(PlotExecutionError, match="crashed"):
+        executor.run("import os\nos._exit(1)")
+    assert_pool_full(executor)
+
+
+def test_frame_that_cannot_be_pickled_keeps_the_pool_full(executor):
+    upload = pd.DataFrame({"x": [lambda: None, 1]})
+    with pytest.raises(PlotExecutionError, match="could not be sent"):
+        executor.run(PLOT, {"Upload": upload})
+    assert_pool_full(executor)
+
+
+def test_map_on_a_category_upload_is_not_vectorized(executor):
+    upload = pd.DataFrame({"grade": pd.Categorical(["a", "b", "a"]), "n": [1, 2, 3]})
+    code = "import matplotlib.pyplot as plt\ndf = datasets['Upload']\nlabels = df['grade'].map(lambda x: x * 2)\n" \
+           "doubled = df['n'].map(lambda x: x * 2)\nplt.bar(labels.astype(str), doubled)\n" \
+           "reasoning = ','.join(labels.astype(str))\n"
+    job = executor.submit(code, {"Upload": upload})
+    assert job.result()[1] == "aa,bb,aa"
+    assert job.timings["rewrites"] == 1
+
+
+def test_generated_code_does_not_change_the_shared_frame(executor):
+    upload = pd.DataFrame({"x": ["u", "v", "w"], "y": [3, 4, 5]})
+    code = "df = datasets['Upload'].copy(deep=False)\ndf.loc[0, 'y'] = 100\ndf['x'] = 'changed'\n" \
+           "df.drop(columns=['y'], inplace=True)\ndatasets['Upload'].loc[1, 'y'] = 200\n" \
+           "plt.bar(['a'], [1])\nreasoning = ','.join(df.columns)\n"
+    assert executor.run(code, {"Upload": upload})[1] == "x"
+    # The next job on the same worker sees the frame as it was uploaded
+    check = "plt.bar(['a'], [1])\nreasoning = str(datasets['Upload'].values.tolist())\n"
+    assert executor.run(check, {"Upload": upload})[1] == "[['u', 3], ['v', 4], ['w', 5]]"
+
+
+def test_chained_assignment_fails_instead_of_doing_nothing(executor):
+    upload = pd.DataFrame({"y": [3, 4, 5]})
+    code = "df = datasets['Upload'].copy(deep=False)\ndf['y'][df['y'] > 3] = 0\nplt.bar(['a'], [1])\n"
+    with pytest.raises(PlotExecutionError, match="ChainedAssignmentError"):
+        executor.run(code, {"Upload": upload})
+    assert_pool_full(executor)
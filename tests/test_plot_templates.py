@@ -0,0 +1,97 @@
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+import reduction
+from plot_templates import generate_code, match_intent, resolve_column
+from profiling import build_profile
+
+
+def cars(n=60):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({"Brand": ["Ford", "Audi", "Kia"] * (n // 3), "Sale Price": rng.uniform(1, 9, n),
+                         "List Price": rng.uniform(1, 9, n), "Year": np.repeat(np.arange(2000, 2000 + n // 3), 3),
+                         "Sold": pd.date_range("2024-01-01", periods=n)})
+
+
+@pytest.fixture
+def profile():
+    return build_profile(cars())
+
+
+def run(code, df):
+    fig, ax = plt.subplots()
+    namespace = reduction.namespace()
+    namespace.update({"df": df, "fig": fig, "ax": ax, "plt": plt, "pd": pd})
+    try:
+        exec(code, namespace)
+        return ax, namespace["reasoning"]
+    finally:
+        plt.close(fig)
+
+
+@pytest.mark.parametrize("prompt, kind, x, y, agg", [
+    ("Show: a histogram of sale price", "histogram", "Sale Price", None, "mean"),
+    ("Show: distribution of the List Price.", "histogram", "List Price", None, "mean"),
+    ("Show: number of rows by brand", "count", "Brand", None, "mean"),
+    ("Show: brand counts", "count", "Brand", None, "mean"),
+    ("Show: median sale price by brand", "bar", "Brand", "Sale Price", "median"),
+    ("Show me a bar chart of total list price per brand", "bar", "Brand", "List Price", "sum"),
+    ("Show: sale price over time", "line", "Sold", "Sale Price", "mean"),
+    ("Show: list price over year", "line", "Year", "List Price", "mean"),
+    ("Show: sale price by brand", "bar", "Brand", "Sale Price", "mean"),
+])
+def test_match_intent_for_each_template(profile, prompt, kind, x, y, agg):
+    intent = match_intent(prompt, profile)
+    assert intent["kind"] == kind and intent["agg"] == agg
+    assert intent["x"]["name"] == x
+    assert (intent["y"] or {}).get("name") == y
+    assert intent["confidence"] >= 0.8
+
+
+@pytest.mark.parametrize("prompt", ["Show: correlation between sale price and year", "Show: histogram of brand",
+                                    "Show: mean brand by year", "Explain the data"])
+def test_other_prompts_match_no_template(profile, prompt):
+    assert match_intent(prompt, profile) is None
+
+
+def test_resolve_column_confidence(profile):
+    assert resolve_column("the Sale Price", profile)[1] == 1.0
+    column, confidence = resolve_column("sale", profile)
+    assert column["name"] == "Sale Price" and confidence == 0.9
+    # "price" is part of two column names and neither is clearly closer
+    assert resolve_column("price", profile) == (None, 0.0)
+    column, confidence = resolve_column("brnd", profile)
+    assert column["name"] == "Brand" and 0 < confidence < 0.9
+    assert resolve_column("mileage", profile) == (None, 0.0)
+    assert resolve_column("  ", profile) == (None, 0.0)
+
+
+def test_ambiguous_column_lowers_the_confidence(profile):
+    assert match_intent("Show: mean price by brand", profile) is None
+    intent = match_intent("Show: mean sale prise by brand", profile)
+    assert intent["y"]["name"] == "Sale Price" and intent["confidence"] < 1.0
+
+
+@pytest.mark.parametrize("prompt, artists", [
+    ("Show: histogram of sale price", "patches"), ("Show: brand counts", "patches"),
+    ("Show: mean sale price by brand", "patches"), ("Show: sale price over time", "lines"),
+    ("Show: list price over year", "lines"),
+])
+def test_generated_code_runs(profile, prompt, artists):
+    df = cars()
+    code = generate_code(match_intent(prompt, profile), len(df))
+    ax, reasoning = run(code, df)
+    assert len(getattr(ax, artists)) > 0
+    assert ax.get_title() and reasoning
+
+
+def test_bar_values_are_the_aggregates(profile):
+    df = cars()
+    ax, _ = run(generate_code(match_intent("Show: total sale price by brand", profile), len(df)), df)
+    heights = {tick.get_text(): bar.get_height() for tick, bar in zip(ax.get_xticklabels(), ax.patches)}
+    assert heights == pytest.approx(df.groupby("Brand")["Sale Price"].sum().to_dict())
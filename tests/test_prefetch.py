@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+import prefetch
+from prefetch import Prefetcher, parse_suggestions, prompt_key
+
+ANSWER = """Here are some prompts:
+1. Show: correlation between price and rooms
+2) "scatter of price against rooms"
+3. histogram of price
+Some closing words.
+"""
+
+
+def houses():
+    return pd.DataFrame({"price": [100.0, 200.0, 150.0], "rooms": [3, 5, 4]})
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    sent = []
+
+    def run_requests(questions, key, fingerprint="", use_cache=True, limit=4):
+        sent.extend(questions)
+        return ["ax.plot([%d])\n" % i if i else RuntimeError("failed") for i in range(len(questions))]
+
+    monkeypatch.setattr(prefetch, "run_requests", run_requests)
+    return sent
+
+
+def test_suggestions_are_parsed_as_show_prompts():
+    assert parse_suggestions(ANSWER) == ["Show: correlation between price and rooms",
+                                         "Show: scatter of price against rooms", "Show: histogram of price"]
+    assert prompt_key('Show:  Histogram of Price.') == prompt_key("histogram of price") == "histogram of price"
+
+
+def test_prefetched_code_is_claimed_once(requests):
+    prefetcher = Prefetcher(render=False)
+    df = houses()
+    prefetcher.prefetch(df, "df", parse_suggestions(ANSWER), "key").result()
+    # The histogram is answered by a local template, the first request failed
+    assert len(requests) == 2
+    assert prefetcher.claim(df, "Show: correlation between price and rooms") is None
+    assert prefetcher.claim(df, "show: Scatter of price against rooms!") == "ax.plot([1])\n"
+    assert prefetcher.claim(df, "Show: scatter of price against rooms") is None
+    stats = prefetcher.stats()
+    assert stats["generated"] == 1 and stats["hits"] == 1 and stats["misses"] == 2
+
+
+def test_unpicked_suggestions_count_as_waste(requests):
+    prefetcher = Prefetcher(render=False, ttl=0)
+    prefetcher.prefetch(houses(), "df", ["Show: scatter of price against rooms", "Show: rooms versus price"],
+                        "key").result()
+    stats = prefetcher.stats()
+    assert stats["generated"] == 1 and stats["pending"] == 0
+    assert stats["wasted"] == 1 and stats["wasted_tokens"] == stats["tokens"] > 0
+
+
+def test_token_budget_limits_the_requests(requests):
+    prefetcher = Prefetcher(render=False, token_budget=1)
+    prefetcher.prefetch(houses(), "df", ["Show: scatter of price against rooms"], "key").result()
+    assert requests == [] and prefetcher.stats()["generated"] == 0
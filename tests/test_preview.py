@@ -0,0 +1,35 @@
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+from preview import column_summary
+from profiling import build_profile
+
+
+def frame():
+    return pd.DataFrame({"n": range(250), "kind": ["a", "b"] * 125})
+
+
+def preview_app():
+    import pandas as pd
+    from preview import dataset_preview
+
+    dataset_preview("Numbers", pd.DataFrame({"n": range(250), "kind": ["a", "b"] * 125}), page_size=100)
+
+
+def test_column_summary():
+    summary = column_summary(build_profile(frame()))
+    assert summary["Column"].tolist() == ["n", "kind"]
+    assert summary["Distinct"].tolist() == [250, 2]
+    assert summary["Values"].tolist() == ["", "a, b"]
+
+
+def test_preview_sends_one_page_of_rows():
+    app = AppTest.from_function(preview_app).run()
+    assert not app.exception
+    assert app.caption[0].value == "250 rows, 2 columns"
+    assert app.number_input[0].label == "Page (of 3)"
+    rows = app.dataframe[-1].value
+    assert len(rows) == 100 and rows["n"].iloc[0] == 0
+    app.number_input[0].set_value(3).run()
+    rows = app.dataframe[-1].value
+    assert rows["n"].tolist() == list(range(200, 250))
@@ -0,0 +1,30 @@
+import pandas as pd
+
+import profiling
+
+
+def test_profile_is_cached_by_fingerprint():
+    df = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "x"]})
+    profile = profiling.get_profile(df)
+    assert profiling.get_profile(df.copy()) is profile
+    assert profile["columns"][1]["categories"] == ["x", "y"]
+    assert profile["columns"][0]["numeric"]
+
+
+def test_profile_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(profiling, "MAX_PROFILES", 3)
+    profiling.invalidate_profile()
+    frames = [pd.DataFrame({"a": [i]}) for i in range(5)]
+    for df in frames:
+        profiling.get_profile(df)
+    assert len(profiling._profiles) == 3
+    assert list(profiling._profiles) == [profiling.dataset_fingerprint(df) for df in frames[2:]]
+
+
+def test_refresh_profile_after_mutation():
+    df = pd.DataFrame({"a": [1, 2]})
+    before = profiling.get_profile(df)
+    df["b"] = ["u", "v"]
+    after = profiling.refresh_profile(df)
+    assert after is not before
+    assert [col["name"] for col in after["columns"]] == ["a", "b"]
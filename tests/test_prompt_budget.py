@@ -0,0 +1,87 @@
+import builtins
+import sys
+
+import pandas as pd
+import pytest
+
+import prompt_budget
+from profiling import build_profile, describe_columns
+from prompt_budget import budget_columns, compact_head, count_tokens, rank_columns
+
+
+@pytest.fixture
+def estimated(monkeypatch):
+    # Token counts without tiktoken, so the numbers do not depend on what is installed
+    monkeypatch.setattr(prompt_budget, "_encoding", False)
+
+
+def wide(columns=60):
+    data = {"Price": [1.0, 2.0], "Heating Type": ["GasA", "GasW"]}
+    data.update({"Notes %d" % i: ["some long free text %d" % i, "more text"] for i in range(columns)})
+    return pd.DataFrame(data)
+
+
+def test_count_tokens_estimate(estimated):
+    assert count_tokens("") == 0
+    assert count_tokens("The column 'Price'.") == 8
+    assert count_tokens("abcdefghi") == 3
+
+
+def test_encoding_is_loaded_on_first_count(monkeypatch, caplog):
+    class Broken:
+        @staticmethod
+        def get_encoding(name):
+            raise OSError("no network")
+
+    monkeypatch.setattr(prompt_budget, "_encoding", None)
+    monkeypatch.setitem(sys.modules, "tiktoken", Broken)
+    assert count_tokens("abcdefgh") == 2
+    assert "token counts are estimated" in caplog.text
+    assert prompt_budget._encoding is False
+
+
+def test_missing_tiktoken_falls_back_to_the_estimate(monkeypatch):
+    real_import = builtins.__import__
+
+    def no_tiktoken(name, *args, **kwargs):
+        if name == "tiktoken":
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(prompt_budget, "_encoding", None)
+    monkeypatch.setattr(builtins, "__import__", no_tiktoken)
+    assert count_tokens("abcdefgh") == 2
+
+
+def test_rank_columns_puts_mentioned_columns_and_values_first():
+    profile = build_profile(wide(3))
+    names = [col["name"] for col in rank_columns(profile, "Show: mean price where heating is GasW")]
+    assert names[:2] == ["Price", "Heating Type"]
+    names = [col["name"] for col in rank_columns(profile, "Show: count by GasA")]
+    assert names[0] == "Heating Type"
+
+
+def test_budget_keeps_small_datasets_unchanged(estimated):
+    profile = build_profile(wide(2))
+    full_names, full_details = "','".join(c["name"] for c in profile["columns"]), describe_columns(profile)
+    names, details, report = budget_columns(profile, "price", 1000, full_names, full_details)
+    assert (names, details) == (full_names, full_details)
+    assert not report["compacted"] and report["tokens_saved"] == 0
+
+
+def test_budget_compacts_wide_datasets(estimated):
+    profile = build_profile(wide())
+    full_names, full_details = "','".join(c["name"] for c in profile["columns"]), describe_columns(profile)
+    names, details, report = budget_columns(profile, "price by heating type", 100, full_names, full_details)
+    assert report["compacted"] and report["budget_tokens"] <= 100
+    assert report["tokens_saved"] == report["unbudgeted_tokens"] - report["budget_tokens"] > 0
+    assert names.startswith("Price','Heating Type")
+    assert "more columns that are not listed" in details
+    assert report["columns_kept"] < len(profile["columns"])
+
+
+def test_compact_head_keeps_columns_in_dataset_order_and_cuts_values():
+    head = compact_head(wide(3), ["Notes 1", "Price"], width=6)
+    lines = head.splitlines()
+    assert lines[0].split() == ["Price", "Notes", "1"]
+    assert "some l" in head and "some long" not in head
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+import prompt_index
+from prompt_index import PromptIndex, mentioned_values, normalize
+
+
+def houses():
+    return pd.DataFrame({"Heating Type": ["GasA", "GasW", "Grav", "GasA"], "Price": [100, 200, 150, 120],
+                         "Year": [2008, 2009, 2010, 2010]})
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = PromptIndex(threshold=0.8)
+    monkeypatch.setattr(prompt_index, "_index", index)
+    return index
+
+
+def test_normalize_unifies_synonyms_and_plurals():
+    assert normalize("Show me the avg prices per brand") == normalize("show average price by brands")
+
+
+def test_rephrased_prompt_reuses_the_code(index):
+    df = houses()
+    prompt_index.remember_code(df, "Show: average price where Heating Type is GasA", "code A")
+    assert prompt_index.similar_code(df, "show avg prices where heating type is GasA") == "code A"
+
+
+def test_prompt_with_another_value_is_a_miss(index):
+    df = houses()
+    prompt_index.remember_code(df, "Show: average price where Heating Type is GasA", "code A")
+    assert prompt_index.similar_code(df, "Show: average price where Heating Type is GasW") is None
+    prompt_index.remember_code(df, "Show: mean price for houses built after 2008", "code 2008")
+    assert prompt_index.similar_code(df, "Show: mean price for houses built after 2009") is None
+    assert prompt_index.similar_code(df, "Show: average price for houses built after 2008") == "code 2008"
+
+
+def test_values_and_numbers_are_read_from_the_raw_prompt():
+    assert mentioned_values("price where heating is gasw or Grav, top 2.5", ["GasA", "GasW", "Grav"]) == \
+        frozenset(["GasW", "Grav", "2.5"])
+
+
+def test_threshold(index):
+    columns, values = ["Price", "Year"], []
+    index.add("f", "Show: mean price by year", "code", columns, values)
+    code, similarity, past = index.lookup("f", "Show: mean price by year now", columns, values)
+    assert code == "code" and past == "Show: mean price by year"
+    assert similarity < 0.8
+    df = houses()
+    prompt_index.remember_code(df, "Show: mean price by year", "code")
+    assert prompt_index.similar_code(df, "Show: mean price by year now") is None
+    index.threshold = similarity
+    assert prompt_index.similar_code(df, "Show: mean price by year now") == "code"
@@ -0,0 +1,62 @@
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from matplotlib.collections import PolyCollection
+
+import reduction
+from reduction import aggregate, bin_2d, downsample, lttb, primer_hint
+
+
+def test_lttb_keeps_the_ends_and_the_peaks():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[500] = 10
+    keep = lttb(x, y, 50)
+    assert len(keep) == 50 and keep[0] == 0 and keep[-1] == 999
+    assert 500 in keep
+    assert np.all(np.diff(keep) > 0)
+    assert len(lttb(x, y, 2000)) == 1000
+
+
+def test_downsample_only_above_the_threshold():
+    df = pd.DataFrame({"t": pd.date_range("2024-01-01", periods=5000, freq="min")[::-1],
+                       "v": np.sin(np.arange(5000) / 100)})
+    small = downsample(df, "t", "v", n_out=100, threshold=10_000)
+    assert len(small) == 5000 and small["t"].is_monotonic_increasing
+    reduced = downsample(df, "t", "v", n_out=100, threshold=1000)
+    assert len(reduced) == 100 and reduced["t"].is_monotonic_increasing
+
+
+def test_aggregate_folds_small_categories_into_other():
+    df = pd.DataFrame({"k": ["k%d" % (i % 40) for i in range(400)], "v": np.arange(400)})
+    counts = aggregate(df, "k", max_bars=5)
+    assert len(counts) == 5 and counts["Other"] == 360
+    means = aggregate(df, "k", "v", max_bars=50)
+    assert len(means) == 40 and means["k0"] == df[df["k"] == "k0"]["v"].mean()
+
+
+def test_bin_2d_counts_every_row():
+    df = pd.DataFrame({"x": np.arange(1000.0), "y": np.arange(1000.0) % 7})
+    assert bin_2d(df, "x", "y", bins=10)["count"].sum() == 1000
+
+
+def test_scatter_becomes_hexbin_above_the_threshold(monkeypatch):
+    df = pd.DataFrame({"x": np.arange(200.0), "y": np.arange(200.0)})
+    fig, ax = plt.subplots()
+    try:
+        assert len(reduction.plot_scatter(ax, df, "x", "y").get_offsets()) == 200
+        monkeypatch.setattr(reduction, "ROW_THRESHOLD", 100)
+        hexbin = reduction.plot_scatter(ax, df, "x", "y", s=3)
+        assert isinstance(hexbin, PolyCollection) and len(hexbin.get_array()) < 200
+        # The colorbar of the counts
+        assert len(fig.axes) == 2
+    finally:
+        plt.close(fig)
+
+
+def test_primer_hint_only_for_large_datasets():
+    assert primer_hint(reduction.ROW_THRESHOLD) == ""
+    assert "plot_bars(ax, df, x, y" in primer_hint(reduction.ROW_THRESHOLD + 1)
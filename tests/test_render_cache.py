@@ -0,0 +1,34 @@
+from render_cache import RenderCache, normalize_code, render_key, to_image
+
+
+def test_formatting_comments_and_io_do_not_change_the_key():
+    code = "x = [1, 2]\nplt.plot(x)\n"
+    same = "# a comment\nx = [1,2]\n\nplt.plot(x)   \nplt.savefig('out.png')\nplt.show()\n"
+    assert normalize_code(code) == normalize_code(same)
+    assert render_key(code, "f1") == render_key(same, "f1")
+    assert render_key(code, "f1") != render_key(code, "f2")
+    assert render_key(code, "f1", "png") != render_key(code, "f1", "svg")
+    assert render_key(code, "f1", dpi=100) != render_key(code, "f1", dpi=200)
+
+
+def test_code_that_does_not_parse_is_still_normalized():
+    assert normalize_code("if x:\n  # note\n  y(  \n\n") == "if x:\n  y("
+
+
+def test_cache_is_bounded_by_image_bytes():
+    cache = RenderCache(max_bytes=10)
+    cache.put("a", b"1234", "first", {"plots": 1})
+    cache.put("b", b"5678", "second")
+    assert cache.get("a") == (b"1234", "first")
+    assert cache.figure("a") == {"plots": 1}
+    # "b" is the least recently used and goes first
+    cache.put("c", b"90ab", "third")
+    assert cache.get("b") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 2, "bytes": 8}
+    cache.put("huge", b"x" * 11, "too large")
+    assert cache.get("huge") is None and cache.stats()["entries"] == 2
+
+
+def test_svg_is_passed_as_markup():
+    assert to_image(b"<svg/>", "svg") == "<svg/>"
+    assert to_image(b"\x89PNG", "png").read() == b"\x89PNG"
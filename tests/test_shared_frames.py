@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from plot_executor import PlotExecutor
+from shared_frames import SharedFrames, mapped_bytes, read_frame, write_frame
+
+
+def mixed_frame(rows=6):
+    return pd.DataFrame({
+        "int": np.arange(rows),
+        "float": np.linspace(0, 1, rows),
+        "text": ["t%d" % i for i in range(rows)],
+        "category": pd.Categorical(["a", "b"] * (rows // 2)),
+        "date": pd.date_range("2020-01-01", periods=rows),
+        "nullable": pd.array(list(range(rows - 1)) + [None], dtype="Int64"),
+    }, index=["r%d" % i for i in range(rows)])
+
+
+def test_round_trip_maps_array_columns(tmp_path):
+    df = mixed_frame()
+    path = str(tmp_path / "frame")
+    write_frame(df, path)
+    shared = read_frame(path)
+    pd.testing.assert_frame_equal(shared, df)
+    values = shared["int"].to_numpy()
+    while not isinstance(values, np.memmap):
+        values = values.base
+    assert not values.flags.writeable
+    assert mapped_bytes(path) > 0
+
+
+def test_small_frames_are_not_shared(tmp_path):
+    shared = SharedFrames(root=str(tmp_path), min_bytes=1024 * 1024)
+    assert shared.path("fp", mixed_frame()) is None
+
+
+def test_frames_are_written_once_and_evicted(tmp_path):
+    shared = SharedFrames(root=str(tmp_path), min_bytes=0, max_frames=2)
+    first = shared.path("fp1", mixed_frame())
+    assert shared.path("fp1", mixed_frame()) == first
+    shared.path("fp2", mixed_frame())
+    shared.path("fp3", mixed_frame())
+    assert not os.path.exists(first)
+    shared.close()
+    assert not os.listdir(str(tmp_path))
+
+
+@pytest.fixture
+def executor():
+    executor = PlotExecutor(workers=2, timeout=20, handoff="view")
+    executor._shared.min_bytes = 0
+    yield executor
+    executor.shutdown()
+
+
+def test_workers_plot_shared_frames(executor):
+    upload = pd.DataFrame({"a": np.arange(1000), "b": ["x", "y"] * 500})
+    code = ("import matplotlib.pyplot as plt\ndf = datasets['Upload'].copy(deep=False)\n"
+            "total = df['a'].sum()\ndf.loc[0, 'a'] = 10 ** 6\nplt.plot(df['a'])\nreasoning = str(total)\n")
+    jobs = [executor.submit(code, {"Upload": upload}) for _ in range(4)]
+    # The write of each job stays in its copy, the shared data is unchanged
+    assert [job.result()[1] for job in jobs] == ["499500"] * 4
+    assert len(executor._shared._paths) == 1
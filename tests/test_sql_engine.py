@@ -0,0 +1,149 @@
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import sql_engine
+from sql_engine import (SQLEngine, SQLQueryError, check_identifiers, check_query, check_sources, filter_columns,
+                        split_answer)
+
+
+def sales(n=6):
+    return pd.DataFrame({"region": ["n", "s", "e"] * (n // 3), "price": [float(i) for i in range(n)],
+                         "day": pd.date_range("2024-01-01", periods=n)})
+
+
+@pytest.fixture
+def engine():
+    return SQLEngine(engine="sqlite", max_tables=2, max_rows=10, timeout=5)
+
+
+def test_check_query_accepts_one_select():
+    assert check_query("  SELECT 1;  ") == "SELECT 1"
+    assert check_query("with t as (select 1) select * from t") == "with t as (select 1) select * from t"
+    assert check_query("SELECT 'a;b' AS x;") == "SELECT 'a;b' AS x"
+
+
+@pytest.mark.parametrize("query", ["DELETE FROM data", "PRAGMA table_info(data)", "ATTACH 'x.db' AS x",
+                                   "SELECT 1; DROP TABLE data", "SELECT 1; SELECT 2", "  ", "SELECTED"])
+def test_check_query_rejects_other_statements(query):
+    with pytest.raises(SQLQueryError):
+        check_query(query)
+
+
+def test_split_answer():
+    answer = "Here:\n```sql\nSELECT \"region\", AVG(\"price\") AS p FROM data GROUP BY 1;\n```\n" \
+             "```python\nax.bar(df['region'], df['p'])\n```"
+    query, code = split_answer(answer)
+    assert query == 'SELECT "region", AVG("price") AS p FROM data GROUP BY 1'
+    assert code == "ax.bar(df['region'], df['p'])\n"
+    with pytest.raises(SQLQueryError, match="no SQL query"):
+        split_answer("```python\nax.bar([1], [2])\n```")
+
+
+def test_filter_columns_and_identifiers():
+    query = 'SELECT "region", COUNT(*) FROM data WHERE "price" > 2 AND day < \'2024-02-01\' GROUP BY "region"'
+    assert filter_columns(query, ["region", "price", "day"]) == ["price", "day"]
+    check_identifiers(query, ["region", "price", "day"])
+    check_identifiers('SELECT AVG("price") AS "mean price" FROM data ORDER BY "mean price"', ["price"])
+    with pytest.raises(SQLQueryError, match="no column named"):
+        check_identifiers('SELECT "regoin", COUNT(*) FROM data GROUP BY "regoin"', ["region"])
+
+
+def test_aggregation_query_and_result_cache(engine):
+    df = sales()
+    result = engine.query(df, 'SELECT "region", SUM("price") AS total FROM data GROUP BY "region" ORDER BY "region"')
+    assert result.values.tolist() == [["e", 7.0], ["n", 3.0], ["s", 5.0]]
+    again = engine.query(df, 'SELECT "region", SUM("price") AS total\n  FROM data GROUP BY "region" ORDER BY "region";')
+    assert again is result
+    assert engine.stats()["hits"] == 1
+    dates = engine.query(df, "SELECT MIN(day) FROM data")
+    assert dates.iloc[0, 0] == "2024-01-01 00:00:00"
+
+
+@pytest.mark.parametrize("query", ["WITH x AS (SELECT 1) DELETE FROM data",
+                                   "WITH x AS (SELECT 1) INSERT INTO data VALUES ('w', 1.0, NULL)",
+                                   "WITH x AS (SELECT 1) UPDATE data SET price = 0",
+                                   "SELECT * FROM pragma_table_info('data')",
+                                   "SELECT load_extension('evil')"])
+def test_authorizer_denies_everything_but_reads(engine, query):
+    df = sales()
+    with pytest.raises(SQLQueryError, match="not authorized"):
+        engine.query(df, query)
+    assert engine.query(df, "SELECT COUNT(*) FROM data").iloc[0, 0] == 6
+    # The authorizer is only set while a query of the engine runs
+    table = engine._entry(df).table
+    table._con.execute("CREATE TABLE scratch (x)")
+
+
+def test_result_must_aggregate(engine):
+    with pytest.raises(SQLQueryError, match="more than 10 rows"):
+        engine.query(sales(30), "SELECT * FROM data")
+
+
+def test_second_filter_builds_an_index(engine):
+    df = sales()
+    engine.query(df, 'SELECT COUNT(*) FROM data WHERE "region" = \'n\'')
+    assert engine.stats()["indexes"] == 0
+    engine.query(df, 'SELECT SUM("price") FROM data WHERE "region" = \'s\'')
+    assert engine.stats()["indexes"] == 1
+
+
+def test_evicted_table_is_closed_after_its_running_query(engine):
+    first, second, third = sales(3), sales(6), sales(9)
+    entry = engine._entry(first)
+    engine._entry(second)
+    connection = entry.table._con
+    # A query holds the entry lock while the next load evicts the table
+    entry.lock.acquire()
+    loader = threading.Thread(target=engine._entry, args=(third,))
+    loader.start()
+    time.sleep(0.2)
+    assert connection.execute("SELECT COUNT(*) FROM data").fetchone() == (3,)
+    entry.lock.release()
+    loader.join(5)
+    assert entry.table is None
+    with pytest.raises(sqlite3.ProgrammingError):
+        connection.execute("SELECT 1")
+    assert engine.stats()["tables"] == 2
+
+
+def test_duckdb_falls_back_to_sqlite_when_missing(monkeypatch, caplog):
+    import builtins
+
+    real_import = builtins.__import__
+
+    def no_duckdb(name, *args, **kwargs):
+        if name == "duckdb":
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", no_duckdb)
+    assert sql_engine._table_class("duckdb") is sql_engine._SQLiteTable
+    assert "duckdb is not installed" in caplog.text
+
+
+@pytest.mark.parametrize("query", ["SELECT * FROM read_csv('/etc/passwd')", "SELECT * FROM '/etc/passwd'",
+                                   "SELECT a FROM data JOIN read_parquet('x.parquet') USING (a)",
+                                   "SELECT * FROM data, glob ('*')"])
+def test_duckdb_queries_read_only_the_table(query):
+    with pytest.raises(SQLQueryError, match="can only read the table"):
+        check_sources(query)
+
+
+def test_duckdb_table_queries_pass():
+    check_sources('SELECT EXTRACT(YEAR FROM "day") AS y, COUNT(*) FROM data WHERE "region" = \'from x(\' GROUP BY 1')
+    check_sources("SELECT * FROM (SELECT * FROM data) t")
+
+
+@pytest.mark.parametrize("query", [
+    'SELECT "region", AVG("price") AS avg_price FROM data GROUP BY "region" ORDER BY "avg_price" DESC',
+    'WITH t AS (SELECT "region", SUM("price") AS total FROM data GROUP BY "region") SELECT * FROM "t"',
+    'WITH "by region" (r, n) AS (SELECT "region", COUNT(*) FROM data GROUP BY 1), u AS (SELECT 1) '
+    'SELECT "r", "n" FROM "by region", "U"',
+])
+def test_unquoted_aliases_and_cte_names_are_accepted(engine, query):
+    check_identifiers(query, ["region", "price", "day"])
+    assert len(engine.query(sales(), query)) == 3
@@ -0,0 +1,93 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import user_store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = user_store.UserStore(str(tmp_path / "users.db"), pool_size=2, iterations=1000)
+    yield store
+    store.close()
+
+
+def stored_password(store, email):
+    with store.pool.connection() as conn:
+        return conn.execute("SELECT password FROM users WHERE email = ?", (email,)).fetchone()[0]
+
+
+def insert_raw(store, email, password):
+    with store.pool.connection() as conn, conn:
+        conn.execute("INSERT INTO users (email, password) VALUES (?, ?)", (email, password))
+
+
+def test_sign_up_and_sign_in(store):
+    assert store.add_user("a@example.com", "secret")
+    assert not store.add_user("a@example.com", "other")
+    assert stored_password(store, "a@example.com").startswith("pbkdf2_sha256$1000$")
+    assert store.authenticate("a@example.com", "secret")
+    assert not store.authenticate("a@example.com", "wrong")
+    assert not store.authenticate("nobody@example.com", "secret")
+
+
+def test_plain_text_password_is_upgraded(store):
+    insert_raw(store, "old@example.com", "hunter2")
+    assert not store.authenticate("old@example.com", "hunter")
+    assert stored_password(store, "old@example.com") == "hunter2"
+    assert store.authenticate("old@example.com", "hunter2")
+    upgraded = stored_password(store, "old@example.com")
+    assert upgraded.startswith("pbkdf2_sha256$1000$")
+    store.forget("old@example.com")
+    assert store.authenticate("old@example.com", "hunter2")
+
+
+def test_weaker_hash_is_rehashed(store):
+    insert_raw(store, "weak@example.com", user_store.hash_password("pw", iterations=10))
+    assert store.authenticate("weak@example.com", "pw")
+    assert stored_password(store, "weak@example.com").startswith("pbkdf2_sha256$1000$")
+
+
+@pytest.mark.parametrize("stored", ["pbkdf2_sha256$", "pbkdf2_sha256$1000$salt", "pbkdf2_sha256$many$salt$00",
+                                    "pbkdf2_sha256$0$salt$00", "pbkdf2_sha256$1000$sél$00",
+                                    "pbkdf2_sha256$1$2$3$4"])
+def test_malformed_hash_is_a_failed_login(store, stored):
+    assert not user_store.verify_password("pw", stored)
+    insert_raw(store, "broken@example.com", stored)
+    assert not store.authenticate("broken@example.com", "pw")
+    assert stored_password(store, "broken@example.com") == stored
+
+
+def test_login_cache_expires(store, monkeypatch):
+    store.add_user("a@example.com", "secret")
+    now = [1000.0]
+    monkeypatch.setattr(user_store.time, "monotonic", lambda: now[0])
+    assert store.authenticate("a@example.com", "secret")
+    # A cached login does not read the database
+    monkeypatch.setattr(store.pool, "connection", None)
+    assert store.authenticate("a@example.com", "secret")
+    now[0] += store.session_ttl + 1
+    with pytest.raises(TypeError):
+        store.authenticate("a@example.com", "secret")
+
+
+def test_database_is_created_with_its_table(tmp_path):
+    path = tmp_path / "new.db"
+    user_store.UserStore(str(path), pool_size=1).close()
+    assert sqlite3.connect(str(path)).execute("SELECT count(*) FROM users").fetchone() == (0,)
+
+
+def test_existing_accounts_sign_in_and_are_upgraded(tmp_path):
+    path = tmp_path / "users.db"
+    shutil.copy(os.path.join(ROOT, "users.db"), str(path))
+    accounts = sqlite3.connect(str(path)).execute("SELECT email, password FROM users").fetchall()
+    assert accounts
+    store = user_store.UserStore(str(path), pool_size=1, iterations=1000)
+    for email, password in accounts:
+        assert store.authenticate(email, password)
+        assert stored_password(store, email).startswith("pbkdf2_sha256$1000$")
+    store.close()
@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import json, sys
+import helpers, llm_client, prompt_budget, warmup
+before = {"openai": "openai" in sys.modules, "matplotlib": "matplotlib" in sys.modules}
+assert warmup.start_warmup() and not warmup.start_warmup()
+assert warmup.wait_warmup(60)
+print(json.dumps({"before": before, "openai": "openai" in sys.modules, "tiktoken": "tiktoken" in sys.modules,
+                  "encoding": prompt_budget._encoding is not None, "clients": len(llm_client._clients),
+                  "session": llm_client._session is not None}))
+"""
+
+
+def test_warmup_imports_modules_but_loads_no_encoding_or_client():
+    env = dict(os.environ, DATACHAT_WARMUP="on", DATACHAT_METRICS="off")
+    out = subprocess.run([sys.executable, "-c", SCRIPT], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    state = json.loads(out.stdout.strip().splitlines()[-1])
+    # Importing the app's modules leaves the heavy imports to the warm-up thread
+    assert state["before"] == {"openai": False, "matplotlib": False}
+    assert state["openai"]
+    assert not state["tiktoken"] and not state["encoding"]
+    assert state["clients"] == 0 and not state["session"]
@@ -0,0 +1,165 @@
+"""
+User accounts for the sign up / sign in pages. Replaces the module-level sqlite3 connection that
+every Streamlit session shared: connections come from a small pool, the database runs in WAL
+mode so logins read while a sign up writes, and passwords are stored as salted PBKDF2 hashes.
+Successful logins are remembered for a short while so a repeated sign in skips the hashing.
+"""
+import hashlib
+import hmac
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+USER_DB_PATH = os.environ.get("DATACHAT_USER_DB", "users.db")
+# PBKDF2-SHA256 iterations for new and rehashed passwords
+HASH_ITERATIONS = int(os.environ.get("DATACHAT_PASSWORD_ITERATIONS", 200_000))
+SESSION_TTL = int(os.environ.get("DATACHAT_LOGIN_CACHE_SECONDS", 300))
+POOL_SIZE = 4
+
+_SCHEME = "pbkdf2_sha256"
+# The same SQL strings on every call, so each pooled connection prepares them once
+_CREATE = "CREATE TABLE IF NOT EXISTS users (email TEXT PRIMARY KEY, password TEXT NOT NULL)"
+_INSERT = "INSERT INTO users (email, password) VALUES (?, ?)"
+_SELECT = "SELECT password FROM users WHERE email = ?"
+_UPDATE = "UPDATE users SET password = ? WHERE email = ?"
+
+
+def hash_password(password, iterations=HASH_ITERATIONS, salt=None):
+    """
+    Salted PBKDF2-SHA256 hash of the password, as "pbkdf2_sha256$iterations$salt$hash"
+    """
+    salt = salt or secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("ascii"), iterations)
+    return "%s$%d$%s$%s" % (_SCHEME, iterations, salt, digest.hex())
+
+
+def verify_password(password, stored):
+    """
+    Checks the password against a stored hash. Rows from before hashing hold the plain
+    password, they are compared in constant time too. A malformed hash matches no password.
+    """
+    if not stored.startswith(_SCHEME + "$"):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    try:
+        _, iterations, salt, _ = stored.split("$")
+        return hmac.compare_digest(hash_password(password, int(iterations), salt), stored)
+    except ValueError:
+        # Wrong number of fields, a non-numeric or zero iteration count or a non-ASCII salt
+        return False
+
+
+class ConnectionPool:
+    """
+    A fixed number of sqlite3 connections handed out to one thread at a time
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=10):
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, cached_statements=32)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._idle.get(timeout=self.timeout)
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+class UserStore:
+    """
+    Thread-safe store of user accounts on top of a ConnectionPool
+    """
+
+    def __init__(self, path=USER_DB_PATH, pool_size=POOL_SIZE, iterations=HASH_ITERATIONS, session_ttl=SESSION_TTL):
+        self.iterations = iterations
+        self.session_ttl = session_ttl
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as conn, conn:
+            conn.execute(_CREATE)
+        # Logins verified in the last session_ttl seconds, keyed by an HMAC of email and password
+        # under a per-process key, so no password is kept in memory
+        self._key = secrets.token_bytes(32)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session_key(self, email, password):
+        return hmac.new(self._key, email.encode("utf-8") + b"\x00" + password.encode("utf-8"), "sha256").digest()
+
+    def add_user(self, email, password):
+        """
+        Creates the account, returns False when the email is already registered
+        """
+        hashed = hash_password(password, self.iterations)
+        try:
+            with self.pool.connection() as conn, conn:
+                conn.execute(_INSERT, (email, hashed))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def authenticate(self, email, password):
+        """
+        True when the email and password match an account. Plain-text and weaker hashes
+        are upgraded to the current iteration count on a successful login.
+        """
+        key = self._session_key(email, password)
+        now = time.monotonic()
+        with self._lock:
+            expires = self._sessions.get(key, (None, 0))[1]
+            if expires > now:
+                return True
+
+        with self.pool.connection() as conn:
+            row = conn.execute(_SELECT, (email,)).fetchone()
+        if row is None or not verify_password(password, row[0]):
+            return False
+        if not row[0].startswith("%s$%d$" % (_SCHEME, self.iterations)):
+            with self.pool.connection() as conn, conn:
+                conn.execute(_UPDATE, (hash_password(password, self.iterations), email))
+
+        with self._lock:
+            # Expired entries are dropped as new logins come in
+            for stale in [k for k, (_, exp) in self._sessions.items() if exp <= now]:
+                del self._sessions[stale]
+            self._sessions[key] = (email, now + self.session_ttl)
+        return True
+
+    def forget(self, email):
+        """
+        Drops the remembered logins of the user, e.g. on sign out
+        """
+        with self._lock:
+            for key in [k for k, (e, _) in self._sessions.items() if e == email]:
+                del self._sessions[key]
+
+    def close(self):
+        self.pool.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_user_store():
+    """
+    The process-wide user store, opened on first use
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UserStore()
+    return _store
@@ -0,0 +1,53 @@
+"""
+Background warm-up of a fresh server process. openai (with requests and aiohttp), stripe and
+matplotlib take longer to import than the rest of the app, so the app's modules only import
+them where they are used. Once the first page has been sent, a daemon thread imports them so
+the first prompt does not pay for them either. See benchmarks/bench_cold_start.py for the
+import times and the time to first render.
+"""
+import importlib
+import os
+import threading
+import time
+from metrics import span
+
+WARMUP_ENABLED = os.environ.get("DATACHAT_WARMUP", "on").lower() not in ("0", "off", "false", "no")
+# Imported by the warm-up thread, the plot workers import matplotlib themselves
+WARMUP_MODULES = ("openai",)
+
+_started = False
+_lock = threading.Lock()
+_done = threading.Event()
+
+
+def _warmup(modules):
+    with span("warmup", modules=len(modules)) as s:
+        for module in modules:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                s.fail(e)
+            s.set(**{"import_%s_seconds" % module.replace(".", "_"): time.perf_counter() - start})
+    _done.set()
+
+
+def start_warmup(modules=WARMUP_MODULES):
+    """
+    Starts importing modules once per process and returns at once. Call it at the end of
+    the script, so the imports do not hold the GIL while the first page is rendered.
+    """
+    global _started
+    with _lock:
+        if _started or not WARMUP_ENABLED:
+            return False
+        _started = True
+    threading.Thread(target=_warmup, args=(modules,), name="warmup", daemon=True).start()
+    return True
+
+
+def wait_warmup(timeout=None):
+    """
+    Blocks until the warm-up has finished, returns False on timeout
+    """
+    return _done.wait(timeout)